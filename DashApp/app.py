@@ -1,10 +1,16 @@
 import dash
 from callbacks.gene_callbacks import register_callbacks
+from callbacks.differential_callbacks import register_differential_callbacks
+from callbacks.manifold_callbacks import register_manifold_callbacks
 from layouts.layout_manager import create_layout, register_layout_callbacks
 from layouts.navigation import register_navbar_callbacks
 import dash_bootstrap_components as dbc
 import dash_mantine_components as dmc
 from dotenv import load_dotenv
+from flask import jsonify
+from db.connection import get_pool_stats
+from data.result_cache import result_cache
+from data.background_jobs import analysis_job_manager, job_manager
 
 load_dotenv()
 
@@ -16,7 +22,8 @@ app = dash.Dash(
         dbc.icons.FONT_AWESOME  # Add Font Awesome for icons
     ],
     suppress_callback_exceptions=True,
-    use_pages=False  # We're using our own routing solution
+    use_pages=False,  # We're using our own routing solution
+    background_callback_manager=job_manager  # Heavy callbacks run in a local process pool
 )
 
 # Set HTML lang attribute for accessibility
@@ -53,6 +60,21 @@ app.title = "Urotheliome"
 register_layout_callbacks(app)  # For page routing
 register_navbar_callbacks(app)  # For navbar toggle on mobile
 register_callbacks(app)         # For gene visualization
+register_differential_callbacks(app)  # For the differential expression page
+register_manifold_callbacks(app)      # For the sample manifold page
+
+# Lightweight diagnostics, per gunicorn worker
+@app.server.route("/stats/db-pool")
+def db_pool_stats():
+    return jsonify(get_pool_stats())
+
+@app.server.route("/stats/result-cache")
+def result_cache_stats():
+    return jsonify(result_cache.stats())
+
+@app.server.route("/stats/background-jobs")
+def background_job_stats():
+    return jsonify({"default": job_manager.stats(), "analysis": analysis_job_manager.stats()})
 
 # Run the app (for development only)
 if __name__ == "__main__":
@@ -0,0 +1,239 @@
+/*
+ * Client-side rendering of the Gene Visualization plot.
+ *
+ * The server sends the rows for the selected genes, datasets and TER threshold
+ * once (see data/columnar.py); switching plot type, x-axis or y-axis scale
+ * redraws the figure from those rows without a server round-trip. Traces
+ * mirror what plotly.express builds for px.box / px.violin / px.strip with
+ * color="DatasetName". With several genes, every x-axis group other than
+ * GeneName itself is split per gene ('GENE · group'), the groups of each gene
+ * kept together in selection order.
+ *
+ * Selections above PLOT_SUMMARY_THRESHOLD rows are marked `summary` and come
+ * with only a sample of their rows; box and violin plots of those, and every
+ * overview plot, are requested from the server, which draws them from
+ * precomputed statistics (update_summary_plot). A strip plot of such a
+ * selection requests its rows separately ("viz-strip-request", answered in
+ * "viz-strip-data" by update_strip_rows), sampled down only above
+ * PLOT_STRIP_MAX_POINTS.
+ *
+ * Strip plots of more points than PLOT_WEBGL_THRESHOLD (`webgl` in the data)
+ * are drawn as WebGL scatter traces: categories are placed at integer
+ * positions in the same 'total ascending' order, datasets side by side within
+ * each category, with a reproducible jitter.
+ */
+(function () {
+    const TYPED_ARRAYS = {
+        i1: Int8Array, u1: Uint8Array, i2: Int16Array, u2: Uint16Array,
+        i4: Int32Array, u4: Uint32Array, f4: Float32Array, f8: Float64Array
+    };
+
+    const TRANSFORMS = {
+        linear: x => x,
+        log10: x => Math.log10(x + 1),
+        log2: x => Math.log2(x + 1)
+    };
+
+    // Same hover columns, in the same order, as the server-side plots used
+    const HOVER_COLUMNS = ['GeneName', 'DatasetName', 'SubsetName', 'TissueName',
+                           'SubstrateType', 'Gender', 'Stage', 'Status',
+                           'NhuDifferentiation', 'SampleId', 'TER'];
+
+    // Joins gene and group names when groups are split per gene (GROUP_SEPARATOR server-side)
+    const GROUP_SEPARATOR = ' · ';
+
+    function decodeArray(spec) {
+        const bytes = Uint8Array.from(atob(spec.bdata), c => c.charCodeAt(0));
+        return new TYPED_ARRAYS[spec.dtype](bytes.buffer);
+    }
+
+    // Decode a column to plain values, with null for missing entries
+    function decodeColumn(spec) {
+        if (spec.categories) {
+            const codes = decodeArray(spec.codes);
+            return Array.from(codes, code => code < 0 ? null : spec.categories[code]);
+        }
+        return Array.from(decodeArray(spec.values), value => Number.isNaN(value) ? null : value);
+    }
+
+    function groupRows(groups) {
+        // Row positions per group, in order of first appearance (as px does)
+        const rows = new Map();
+        groups.forEach((group, i) => {
+            if (!rows.has(group)) {
+                rows.set(group, []);
+            }
+            rows.get(group).push(i);
+        });
+        return rows;
+    }
+
+    function styleTrace(trace, plotType) {
+        if (plotType === 'violin') {
+            return Object.assign(trace, {
+                type: 'violin', points: 'all', box: {visible: false}, scalegroup: 'True'
+            });
+        }
+        Object.assign(trace, {type: 'box', boxpoints: 'all'});
+        if (plotType === 'box') {
+            trace.notched = false;
+        } else {
+            // strip: points only, drawn as an invisible box
+            Object.assign(trace, {
+                fillcolor: 'rgba(255,255,255,0)', line: {color: 'rgba(255,255,255,0)'},
+                hoveron: 'points', pointpos: 0
+            });
+        }
+        return trace;
+    }
+
+    // Reproducible jitter in [-0.5, 0.5) for the i-th point
+    function jitter(i) {
+        const h = Math.sin(i * 12.9898 + 78.233) * 43758.5453;
+        return h - Math.floor(h) - 0.5;
+    }
+
+    // Categories in 'total ascending' order of their summed y values, after
+    // their gene's position when split per gene
+    function orderCategories(traces, geneOrder) {
+        const totals = new Map();
+        traces.forEach(trace => trace.x.forEach((category, i) => {
+            totals.set(category, (totals.get(category) || 0) + trace.y[i]);
+        }));
+        return Array.from(totals.keys()).sort((a, b) =>
+            (geneOrder.get(a) || 0) - (geneOrder.get(b) || 0) || totals.get(a) - totals.get(b));
+    }
+
+    // Same points as a strip plot, as scattergl traces on a numeric x-axis
+    function webglStripTraces(traces, grouped, categories) {
+        const position = new Map(categories.map((category, i) => [category, i]));
+
+        const width = grouped ? 0.8 / traces.length : 0.8;
+        let seed = 0;
+        const glTraces = traces.map((trace, slot) => {
+            const offset = grouped ? (slot - (traces.length - 1) / 2) * width : 0;
+            // %{x} would show the numeric position; carry the category in customdata
+            const xField = `%{customdata[${trace.customdata.length ? trace.customdata[0].length : 0}]}`;
+            return {
+                type: 'scattergl',
+                mode: 'markers',
+                name: trace.name,
+                legendgroup: trace.legendgroup,
+                showlegend: true,
+                x: trace.x.map(category => position.get(category) + offset + 0.8 * width * jitter(seed++)),
+                y: trace.y,
+                customdata: trace.customdata.map((row, i) => row.concat([trace.x[i]])),
+                hovertemplate: trace.hovertemplate.split('%{x}').join(xField),
+                xaxis: 'x',
+                yaxis: 'y'
+            };
+        });
+        const axis = {
+            type: 'linear', tickmode: 'array', tickvals: categories.map((_, i) => i),
+            ticktext: categories, range: [-0.5, categories.length - 0.5], zeroline: false
+        };
+        return [glTraces, axis];
+    }
+
+    function renderExpression(data, plotType, xAxis, yAxisType, stripData, baseLayout) {
+        const noUpdate = window.dash_clientside.no_update;
+        if (!data) {
+            return [{}, noUpdate, noUpdate];
+        }
+        if (plotType === 'overview' || (data.summary && plotType !== 'strip')) {
+            // Strip rows arriving after a switch away from the strip view change nothing
+            if (window.dash_clientside.callback_context.triggered_id === 'viz-strip-data') {
+                return [noUpdate, noUpdate, noUpdate];
+            }
+            return [noUpdate, {key: data.key, plotType: plotType, xAxis: xAxis, yAxisType: yAxisType}, noUpdate];
+        }
+        if (data.summary) {
+            // Draw from the selection's full rows once they are here
+            if (!stripData || JSON.stringify(stripData.key) !== JSON.stringify(data.key)) {
+                return [noUpdate, noUpdate, {key: data.key}];
+            }
+            data = Object.assign({}, data, stripData);
+        }
+        const columns = {};
+        HOVER_COLUMNS.forEach(name => { columns[name] = decodeColumn(data.columns[name]); });
+        const transform = TRANSFORMS[yAxisType] || TRANSFORMS.linear;
+        const tpm = Array.from(decodeArray(data.tpm), transform);
+        // Missing x values are plotted as their own 'Unknown' group
+        let x = columns[xAxis].map(value => value === null ? 'Unknown' : value);
+        const genes = data.genes || [data.gene];
+        const splitByGene = genes.length > 1 && xAxis !== 'GeneName';
+        const geneOrder = new Map();
+        if (splitByGene) {
+            const genePosition = new Map(genes.map((gene, i) => [gene, i]));
+            x = x.map((value, i) => {
+                const category = `${columns.GeneName[i]}${GROUP_SEPARATOR}${value}`;
+                geneOrder.set(category, genePosition.get(columns.GeneName[i]));
+                return category;
+            });
+        }
+
+        // customdata holds every hover column except the x-axis column
+        const customColumns = HOVER_COLUMNS.filter(name => name !== xAxis);
+        const hoverLines = xAxis === 'DatasetName'
+            ? ['DatasetName=%{x}']
+            : [`DatasetName=%{customdata[${customColumns.indexOf('DatasetName')}]}`, `${xAxis}=%{x}`];
+        hoverLines.push('TPM=%{y}');
+        customColumns.forEach((name, i) => {
+            if (name !== 'DatasetName') {
+                hoverLines.push(`${name}=%{customdata[${i}]}`);
+            }
+        });
+        const hovertemplate = hoverLines.join('<br>') + '<extra></extra>';
+
+        const traces = [];
+        groupRows(columns.DatasetName).forEach((rows, dataset) => {
+            traces.push(styleTrace({
+                name: dataset,
+                legendgroup: dataset,
+                offsetgroup: dataset,
+                alignmentgroup: 'True',
+                showlegend: true,
+                orientation: 'v',
+                x: rows.map(i => x[i]),
+                y: rows.map(i => tpm[i]),
+                customdata: rows.map(i => customColumns.map(name => columns[name][i])),
+                hovertemplate: hovertemplate,
+                x0: ' ',
+                y0: ' ',
+                xaxis: 'x',
+                yaxis: 'y'
+            }, plotType));
+        });
+
+        let title = `Expression of ${data.gene} by ${xAxis}`;
+        if (data.ter > 0) {
+            title += ` (TER > ${data.ter})`;
+        }
+        if (tpm.length < data.total) {
+            title += ` - ${tpm.length.toLocaleString('en')} of ${data.total.toLocaleString('en')} samples shown`;
+        }
+        const layout = Object.assign({}, baseLayout, {
+            title: {text: title},
+            xaxis: Object.assign({}, baseLayout.xaxis, {title: {text: xAxis}})
+        });
+        // px overlays the groups when the x-axis is the colour column itself
+        const grouped = xAxis !== 'DatasetName';
+        if (plotType === 'strip' && data.webgl) {
+            const [glTraces, axis] = webglStripTraces(traces, grouped, orderCategories(traces, geneOrder));
+            delete layout.xaxis.categoryorder;
+            Object.assign(layout.xaxis, axis);
+            return [{data: glTraces, layout: layout}, noUpdate, noUpdate];
+        }
+        if (splitByGene) {
+            Object.assign(layout.xaxis, {categoryorder: 'array', categoryarray: orderCategories(traces, geneOrder)});
+        }
+        layout[plotType === 'violin' ? 'violinmode' : 'boxmode'] = grouped ? 'group' : 'overlay';
+        return [{data: traces, layout: layout}, noUpdate, noUpdate];
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        plots: Object.assign({}, (window.dash_clientside || {}).plots, {
+            renderExpression: renderExpression
+        })
+    });
+})();
@@ -0,0 +1,81 @@
+"""
+Measure the request body the browser sends to the plot callbacks.
+
+Renders the comparison plot over every dataset, then compares the size of
+the callback request with and without the rendered figure attached as State
+(as the callback used to declare it). The visualization plot is drawn in the
+browser (assets/expression_plot.js), so its figure never reaches the server.
+
+Run from DashApp/ with DATABASE_PATH set:
+    python -m benchmarks.callback_payload GENE1 GENE2
+"""
+import argparse
+import json
+import time
+
+from app import app
+from data.background_jobs import BACKGROUND_POLL_INTERVAL
+from data.fetch_names import fetch_datasets
+
+
+def request_body(output, inputs, figure_state=None):
+    body = {
+        "output": output,
+        "inputs": [{"id": i, "property": p, "value": v} for i, p, v in inputs],
+        "changedPropIds": [f"{inputs[0][0]}.{inputs[0][1]}"],
+        "state": [{"id": "session-id", "property": "data", "value": None}],
+    }
+    if figure_state is not None:
+        graph_id = output.strip(".").split(".")[0]
+        body["state"].append({"id": graph_id, "property": "figure", "value": figure_state})
+    return json.dumps(body)
+
+
+def render(client, output, inputs):
+    graph_id = output.strip(".").split(".")[0]
+    outputs = [
+        {"id": o.split(".")[0], "property": o.split(".")[1].split("@")[0]}
+        for o in output.strip(".").split("...")
+    ]
+    body = json.loads(request_body(output, inputs))
+    body["outputs"] = outputs
+    data = client.post("/_dash-update-component", json=body).get_json()
+    # A background callback answers with its job; poll it as the browser does
+    job = {"cacheKey": data.get("cacheKey"), "job": data.get("job")}
+    while "response" not in data:
+        time.sleep(BACKGROUND_POLL_INTERVAL / 1000)
+        data = client.post("/_dash-update-component", query_string=job, json=body).get_json()
+    return data["response"][graph_id]["figure"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("gene1", type=str)
+    parser.add_argument("gene2", type=str)
+    args = parser.parse_args()
+
+    datasets = fetch_datasets()
+    comp_output = next(k for k in app.callback_map if "gene-comparison-plot.figure" in k)
+
+    cases = [
+        ("comparison", comp_output, [
+            ("gene-comparison-dropdown-1", "value", args.gene1),
+            ("gene-comparison-dropdown-2", "value", args.gene2),
+            ("dataset-radio", "value", datasets),
+            ("tabs", "active_tab", "gene-comparison"),
+            ("ter-input", "value", 0),
+            ("y-axis-radio-comparison", "value", "linear"),
+        ]),
+    ]
+
+    client = app.server.test_client()
+    print(f"{'callback':<25}{'with figure':>15}{'without':>12}{'saved':>8}")
+    for name, output, inputs in cases:
+        figure = render(client, output, inputs)
+        with_state = len(request_body(output, inputs, figure))
+        without = len(request_body(output, inputs))
+        print(f"{name:<25}{with_state:>13} B{without:>10} B{100 * (1 - without / with_state):>7.1f}%")
+
+
+if __name__ == "__main__":
+    main()
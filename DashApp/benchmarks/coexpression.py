@@ -0,0 +1,69 @@
+"""
+Time the co-expression search on a transcriptome-sized matrix.
+
+Scores one gene against every row of a synthetic float32 expression matrix
+(60,000 genes by default, with its sort index built as for a sidecar) with
+data.coexpression.score_genes, and against a sample of rows with one scipy
+call per gene to estimate what a per-gene loop over the whole matrix would take.
+
+Run from DashApp/:
+    python -m benchmarks.coexpression --genes 60000 --samples 1000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from data.coexpression import COEXPRESSION_METHODS, score_genes
+from data.expression_matrix import ExpressionMatrix, sort_index
+
+# Rows scored with scipy to extrapolate the per-gene loop
+SCIPY_SAMPLE_ROWS = 500
+
+
+def synthetic_matrix(n_genes, n_samples, missing, seed=0):
+    rng = np.random.default_rng(seed)
+    tpm = rng.lognormal(2, 1.5, (n_genes, n_samples)).astype(np.float32)
+    tpm[rng.random((n_genes, n_samples)) < missing] = np.nan
+    order, ties = sort_index(tpm)
+    return ExpressionMatrix(pd.Index([f"GENE{i}" for i in range(n_genes)]), tpm, order, ties)
+
+
+def scipy_loop(matrix, samples, method):
+    correlate = stats.spearmanr if method == "spearman" else stats.pearsonr
+    query = matrix.tpm[0, samples].astype(np.float64)
+    for row in range(1, SCIPY_SAMPLE_ROWS + 1):
+        values = matrix.tpm[row, samples].astype(np.float64)
+        present = ~np.isnan(values)
+        x, y = query[present], values[present]
+        if method == "pearson_log2":
+            x, y = np.log2(x + 1), np.log2(y + 1)
+        correlate(x, y)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--genes", type=int, default=60000)
+    parser.add_argument("--samples", type=int, default=1000)
+    parser.add_argument("--missing", type=float, default=0.01, help="Fraction of missing values")
+    args = parser.parse_args()
+
+    matrix = synthetic_matrix(args.genes, args.samples, args.missing)
+    samples = np.flatnonzero(~np.isnan(matrix.tpm[0]))
+    print(f"{args.genes} genes x {len(samples)} samples")
+    print(f"{'method':<15}{'fused':>12}{'scipy loop (est.)':>20}")
+    for method in COEXPRESSION_METHODS:
+        start = time.perf_counter()
+        score_genes(matrix, 0, samples, method, 25)
+        fused = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scipy_loop(matrix, samples, method)
+        loop = (time.perf_counter() - start) * args.genes / SCIPY_SAMPLE_ROWS
+        print(f"{method:<15}{fused:>10.2f} s{loop:>18.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Measure the cost of building the gene comparison scatter.
+
+Builds the figure for synthetic cohorts of increasing size the way the
+callback used to (SVG markers with outlines, every hover column per point)
+and with components.plots.comparison_scatter (WebGL markers without outlines
+above PLOT_WEBGL_THRESHOLD points, shared hover text folded into the
+template), and reports build-plus-serialise time and JSON size.
+
+Run from DashApp/:
+    python -m benchmarks.comparison_scatter
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from components.plots import comparison_scatter, use_webgl
+
+
+def synthetic_cohort(n_samples, n_datasets=3, seed=0):
+    rng = np.random.default_rng(seed)
+    datasets = rng.integers(0, n_datasets, n_samples)
+    data = pd.DataFrame({
+        "SampleId": [f"S{i:06d}" for i in range(n_samples)],
+        "GENE1_TPM": rng.lognormal(3, 1.5, n_samples),
+        "GENE2_TPM": rng.lognormal(2, 1.5, n_samples),
+        "DatasetName": [f"DS_{d}" for d in datasets],
+        # Per-dataset metadata, as in most cohorts
+        "SubsetName": [f"Subset {d}" for d in datasets],
+        "TissueName": np.array(["Bladder", "Ureter", "Renal pelvis"])[datasets % 3],
+        "Gender": rng.choice(["Male", "Female"], n_samples),
+    })
+    return data
+
+
+def previous_scatter(data, x, y, hover_data):
+    # The callback's figure before comparison_scatter
+    fig = px.scatter(data, x=x, y=y, color="DatasetName", hover_data=hover_data,
+                     opacity=0.7, size_max=10)
+    fig.update_traces(
+        marker=dict(size=8, opacity=0.7, line=dict(width=1, color='DarkSlateGrey')),
+        selector=dict(mode='markers')
+    )
+    return fig
+
+
+def measure(build, data, repeats):
+    hover_data = {column: True for column in data.columns if column != "DatasetName"}
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        payload = build(data, "GENE1_TPM", "GENE2_TPM", hover_data).to_json()
+        timings.append(time.perf_counter() - start)
+    return min(timings), len(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'samples':>8}{'renderer':>10}{'before':>12}{'after':>12}{'before':>12}{'after':>12}")
+    for n_samples in args.sizes:
+        data = synthetic_cohort(n_samples)
+        before_time, before_size = measure(previous_scatter, data, args.repeats)
+        after_time, after_size = measure(comparison_scatter, data, args.repeats)
+        renderer = "webgl" if use_webgl(n_samples) else "svg"
+        print(f"{n_samples:>8}{renderer:>10}{1000 * before_time:>9.1f} ms{1000 * after_time:>9.1f} ms"
+              f"{before_size / 1024:>9.0f} KB{after_size / 1024:>9.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
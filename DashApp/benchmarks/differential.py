@@ -0,0 +1,60 @@
+"""
+Time differential expression on a transcriptome-sized matrix.
+
+Compares two groups of samples for every row of a synthetic float32
+expression matrix (60,000 genes by default) with
+data.differential.differential_expression_for, and a sample of rows with one
+scipy ttest_ind and mannwhitneyu call per gene to estimate what a per-gene
+loop over the whole matrix would take.
+
+Run from DashApp/:
+    python -m benchmarks.differential --genes 60000 --samples 1000
+"""
+import argparse
+import time
+
+import numpy as np
+from scipy import stats
+
+from benchmarks.coexpression import synthetic_matrix
+from data.differential import differential_expression_for
+
+# Rows tested with scipy to extrapolate the per-gene loop
+SCIPY_SAMPLE_ROWS = 500
+
+
+def scipy_loop(matrix, samples_a, samples_b):
+    for row in range(SCIPY_SAMPLE_ROWS):
+        a = np.log2(matrix.tpm[row, samples_a].astype(np.float64) + 1)
+        b = np.log2(matrix.tpm[row, samples_b].astype(np.float64) + 1)
+        a, b = a[~np.isnan(a)], b[~np.isnan(b)]
+        stats.ttest_ind(a, b, equal_var=False)
+        stats.mannwhitneyu(a, b, method="asymptotic")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--genes", type=int, default=60000)
+    parser.add_argument("--samples", type=int, default=1000)
+    parser.add_argument("--missing", type=float, default=0.01, help="Fraction of missing values")
+    args = parser.parse_args()
+
+    matrix = synthetic_matrix(args.genes, args.samples, args.missing)
+    # Rounded TPM values, so the rank test has ties to resolve
+    matrix.tpm[:] = np.round(matrix.tpm, 1)
+    samples_a = np.arange(0, args.samples // 2)
+    samples_b = np.arange(args.samples // 2, args.samples)
+    print(f"{args.genes} genes, {len(samples_a)} vs {len(samples_b)} samples")
+
+    start = time.perf_counter()
+    differential_expression_for(matrix, samples_a, samples_b)
+    fused = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scipy_loop(matrix, samples_a, samples_b)
+    loop = (time.perf_counter() - start) * args.genes / SCIPY_SAMPLE_ROWS
+    print(f"fused {fused:.2f} s, scipy loop (est.) {loop:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
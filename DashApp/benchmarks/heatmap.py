@@ -0,0 +1,53 @@
+"""
+Time the stages of a clustered gene heatmap.
+
+For gene lists of increasing length over a synthetic float32 expression
+matrix, reports the time data.heatmap.heatmap_matrix spends reading the
+genes' values and clustering genes and samples, and the time taken to
+serialise the figure.
+
+Run from DashApp/:
+    python -m benchmarks.heatmap --samples 3000 --lists 100 500 2000
+"""
+import argparse
+import time
+from unittest import mock
+
+import numpy as np
+
+from benchmarks.coexpression import synthetic_matrix
+from components.plots import heatmap_figure
+from data import heatmap
+from data.heatmap import HEATMAP_Z_LIMIT, heatmap_matrix
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--genes", type=int, default=60000)
+    parser.add_argument("--samples", type=int, default=3000)
+    parser.add_argument("--lists", type=int, nargs="+", default=[100, 500, 2000])
+    args = parser.parse_args()
+
+    matrix = synthetic_matrix(args.genes, args.samples, 0.01)
+    rng = np.random.default_rng(0)
+    sample_ids = np.array([f"S{i}" for i in range(args.samples)])
+    print(f"{args.samples} samples")
+    print(f"{'genes':>6}{'fetch':>10}{'cluster':>10}{'serialise':>11}{'z array':>10}")
+    # Every sample is selected, from the synthetic matrix
+    with mock.patch.object(heatmap, "get_expression_matrix", return_value=matrix), \
+            mock.patch.object(heatmap, "sample_mask", return_value=np.ones(args.samples, dtype=bool)):
+        for n_genes in args.lists:
+            genes = tuple(matrix.genes[rng.choice(args.genes, n_genes, replace=False)])
+            result = heatmap_matrix(genes, ("synthetic",))
+            start = time.perf_counter()
+            figure = heatmap_figure(result["z"], result["genes"], sample_ids[result["samples"]],
+                                    HEATMAP_Z_LIMIT, "").to_plotly_json()
+            serialise = time.perf_counter() - start
+            size = len(figure["data"][0]["z"]["bdata"])
+            timings = result["timings"]
+            print(f"{n_genes:>6}{timings['fetch']:>8.2f} s{timings['cluster']:>8.2f} s{serialise:>9.2f} s"
+                  f"{size / 1e6:>7.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Compare data.pair_stats.pair_statistics with the scipy calls it replaces.
+
+For synthetic pairs of expression vectors of increasing length, times the
+sequence the comparison callback used to run (pearsonr on TPM, spearmanr,
+pearsonr on log2(TPM + 1) and linregress on the plotted values) against one
+pair_statistics call, and checks that both agree.
+
+Run from DashApp/:
+    python -m benchmarks.pair_stats
+"""
+import argparse
+import time
+
+import numpy as np
+from scipy import stats
+
+from data.pair_stats import pair_statistics
+
+
+def scipy_sequence(x, y):
+    pearson = stats.pearsonr(x, y)
+    spearman = stats.spearmanr(x, y)
+    pearson_log2 = stats.pearsonr(np.log2(x + 1), np.log2(y + 1))
+    fit = stats.linregress(np.log2(x + 1), np.log2(y + 1))
+    return pearson.statistic, spearman.statistic, pearson_log2.statistic, fit.slope, fit.intercept
+
+
+def fused(x, y):
+    result = pair_statistics(x, y)
+    fit = result["fits"]["log2"]
+    return (result["pearson"]["r"], result["spearman"]["r"], result["pearson_log2"]["r"],
+            fit["slope"], fit["intercept"])
+
+
+def best_time(function, x, y, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(x, y)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'samples':>8}{'scipy':>12}{'fused':>12}{'speedup':>9}  agree")
+    for n_samples in args.sizes:
+        # Rounded TPM values, so the rank correlation has ties to resolve
+        x = np.round(rng.lognormal(3, 1.5, n_samples), 1)
+        y = np.round(0.5 * x + rng.lognormal(2, 1.5, n_samples), 1)
+        agree = np.allclose(scipy_sequence(x, y), fused(x, y))
+        before = best_time(scipy_sequence, x, y, args.repeats)
+        after = best_time(fused, x, y, args.repeats)
+        print(f"{n_samples:>8}{1000 * before:>9.3f} ms{1000 * after:>9.3f} ms{before / after:>8.1f}x  {agree}")
+
+
+if __name__ == "__main__":
+    main()
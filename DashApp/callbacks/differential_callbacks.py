@@ -0,0 +1,111 @@
+from dash import html, no_update
+from dash.dependencies import Input, Output, State
+from data.differential import (DIFFERENTIAL_COLUMNS, DIFFERENTIAL_TESTS, MIN_GROUP_SAMPLES,
+                               differential_expression, group_values)
+from data.background_jobs import BACKGROUND_POLL_INTERVAL, analysis_job_manager
+from components.plots import volcano_figure
+from components.tables import differential_table
+from callbacks.gene_callbacks import register_dataset_controls
+
+# Most significant genes listed under the volcano plot
+DIFFERENTIAL_TABLE_ROWS = 50
+
+def register_differential_callbacks(app) -> None:
+    """Register the callbacks of the differential expression page"""
+
+    register_dataset_controls(app, "de-")
+
+    @app.callback(
+        [Output("de-group-a-select", "data"),
+         Output("de-group-a-select", "value"),
+         Output("de-group-b-select", "data"),
+         Output("de-group-b-select", "value")],
+        [Input("de-column-select", "value"),
+         Input("de-dataset-radio", "value"),
+         Input("de-ter-input", "value")],
+        [State("de-group-a-select", "value"),
+         State("de-group-b-select", "value")],
+    )
+    def update_group_options(column: str, selected_datasets: list, ter_threshold: int,
+                             group_a: str, group_b: str):
+        """Offer the values of the grouping column found in the selected samples"""
+        if not column or not selected_datasets:
+            return [], None, [], None
+        counts = group_values(column, tuple(sorted(selected_datasets)), ter_threshold or 0)
+        options = [{"label": f"{value} ({count} samples)", "value": value}
+                   for value, count in counts.items() if count >= MIN_GROUP_SAMPLES]
+        values = [option["value"] for option in options]
+
+        # Keep the current groups where still available, otherwise take the first two values
+        group_a = group_a if group_a in values else next(iter(values), None)
+        group_b = group_b if group_b in values and group_b != group_a else \
+            next((value for value in values if value != group_a), None)
+        return options, group_a, options, group_b
+
+    @app.callback(
+        [Output("differential-volcano-plot", "figure"),
+         Output("differential-results", "children"),
+         Output("error-alert-de", "children"),
+         Output("error-alert-collapse-de", "is_open")],
+        [Input("de-run-button", "n_clicks"),
+         Input("de-test-radio", "value")],
+        [State("de-column-select", "value"),
+         State("de-group-a-select", "value"),
+         State("de-group-b-select", "value"),
+         State("de-dataset-radio", "value"),
+         State("de-ter-input", "value")],
+        prevent_initial_call=True,
+        # Tests of every gene run in the analysis pool, keeping the web workers free
+        background=True,
+        manager=analysis_job_manager,
+        interval=BACKGROUND_POLL_INTERVAL,
+        progress=Output("de-progress", "children"),
+        progress_default="",
+        running=[(Output("de-run-button", "disabled"), True, False),
+                 (Output("de-cancel-button", "disabled"), False, True)],
+        cancel=[Input("de-cancel-button", "n_clicks")],
+    )
+    def update_differential_expression(set_progress, n_clicks: int, test: str, column: str, group_a: str, group_b: str,
+                                       selected_datasets: list, ter_threshold: int):
+        """Compare the two groups for every gene and draw the volcano plot"""
+        if not n_clicks:
+            return no_update, no_update, no_update, no_update
+
+        # Check for required selections
+        if not selected_datasets:
+            message = "Please select at least one dataset"
+            return no_update, None, html.Strong(message), True
+        if not group_a or not group_b:
+            message = "Please select two groups to compare"
+            return no_update, None, html.Strong(message), True
+        if group_a == group_b:
+            message = "Please select two different groups"
+            return no_update, None, html.Strong(message), True
+
+        # Handle None value when the input is empty
+        if ter_threshold is None:
+            ter_threshold = 0
+
+        set_progress(f"Comparing {group_a} with {group_b} for every gene...")
+        try:
+            # Cached by group definition, so switching test reuses the result
+            results = differential_expression(column, group_a, group_b, tuple(sorted(selected_datasets)),
+                                              ter_threshold)
+        except Exception as e:
+            message = f"Error computing differential expression: {str(e)}"
+            return no_update, None, html.Strong(message), True
+
+        if results.empty:
+            message = f"Not enough samples with data in {group_a} and {group_b} with the current filters"
+            return no_update, None, html.Strong(message), True
+
+        test_info = DIFFERENTIAL_TESTS[test]
+        title = f"{DIFFERENTIAL_COLUMNS[column]}: {group_a} vs {group_b} ({test_info['label']})"
+        if ter_threshold > 0:
+            title += f", TER > {ter_threshold}"
+        fig = volcano_figure(results, test_info["adjusted"], title, group_a, group_b)
+
+        top = results.nsmallest(DIFFERENTIAL_TABLE_ROWS, test_info["p"])
+        caption = (f"{len(top)} most significant of {len(results):,} genes tested; "
+                   f"means are of log2(TPM+1), A = {group_a}, B = {group_b}")
+        return fig, differential_table(top, test_info["p"], test_info["adjusted"], caption), "", False
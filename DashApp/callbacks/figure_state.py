@@ -0,0 +1,40 @@
+"""
+Server-side record of the figure each browser session is currently showing.
+
+The plot callbacks no longer receive the current figure from the browser, so
+the pieces needed to update it incrementally (the untransformed trace values
+and the inputs they were built from) are kept in the shared result cache,
+keyed by a per-tab session id.
+"""
+from data.result_cache import result_cache
+
+
+def _key(session_id: str, graph_id: str) -> str:
+    return result_cache.make_key("figure-state", session_id, graph_id)
+
+
+def save_figure_state(session_id: str, graph_id: str, inputs: tuple, **values) -> None:
+    """
+    Remember what a session's graph was built from.
+    Args:
+        session_id: Browser session id, or None to skip
+        graph_id: Id of the dcc.Graph
+        inputs: Callback inputs the figure's data depends on
+        values: Anything needed to patch the figure later
+    """
+    if session_id:
+        result_cache.set(_key(session_id, graph_id), {"inputs": inputs, **values})
+
+
+def load_figure_state(session_id: str, graph_id: str, inputs: tuple):
+    """
+    Return the saved state for a session's graph if it was built from `inputs`.
+    Returns:
+        Dict of saved values, or None if the figure must be rebuilt
+    """
+    if not session_id:
+        return None
+    state = result_cache.get(_key(session_id, graph_id))
+    if state is None or state["inputs"] != inputs:
+        return None
+    return state
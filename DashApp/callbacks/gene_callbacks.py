@@ -1,32 +1,51 @@
-from dash import callback_context, no_update
+from dash import callback_context, no_update, Patch, ClientsideFunction
 from dash.dependencies import Input, Output, State
 import plotly.express as px
 import plotly.graph_objects as go
-from data.fetch_data import fetch_gene_expression_data
+import plotly.colors
+from data.fetch_data import fetch_gene_expression_data, TRANSFORMS
+from data.gene_search import search_genes
+from data.columnar import encode_array, encode_frame
+from data.result_cache import result_cache
+from data.group_summary import GroupedValues, KDE_MIN_POINTS, STRIP_MAX_POINTS, SUMMARY_THRESHOLD, subsample
+from data.group_stats import group_stats
+from data.pair_stats import pair_statistics
+from data.coexpression import COEXPRESSION_METHODS, top_coexpressed
+from data.neighbours import NEIGHBOUR_METHODS, fetch_neighbours, has_neighbours
+from data.heatmap import HEATMAP_MAX_GENES, HEATMAP_Z_LIMIT, heatmap_matrix, parse_gene_list, resolve_genes
+from data.sample_metadata import get_sample_metadata
+from data.background_jobs import BACKGROUND_POLL_INTERVAL, analysis_job_manager, checkpoint, supersedable, supersede_earlier
+from components.dropdowns import MAX_VISUALIZATION_GENES
+from components.plots import apply_common_styling, comparison_scatter, expression_plot_layout, heatmap_figure, use_webgl
+from components.tables import coexpression_table, neighbour_panel
+from callbacks.figure_state import load_figure_state, save_figure_state
 from typing import Dict, Any, Tuple
+from flask import has_request_context
+import time
 import numpy as np
-from scipy import stats
 from dash import html
 import pandas as pd
 
-def register_callbacks(app) -> None:
-    """Register all callbacks for the application"""
+def register_dataset_controls(app, id_prefix: str = "") -> None:
+    """Register the option loading and Select All / Clear buttons of a dataset_radio(id_prefix)"""
     
-    @app.callback(
-        Output("ter-value-display", "children"),
-        Input("ter-input", "value")
+    # Load dataset names from the hashed options asset, cached by the browser
+    app.clientside_callback(
+        """
+        async function(url) {
+            const response = await fetch(url);
+            const datasets = await response.json();
+            return datasets.map(dataset => ({label: dataset, value: dataset}));
+        }
+        """,
+        Output(f"{id_prefix}dataset-radio", "options"),
+        Input(f"{id_prefix}dataset-options-url", "data"),
     )
-    def update_ter_display(value):
-        """Update the displayed TER threshold value"""
-        # Handle None value when the input is empty
-        if value is None:
-            value = 0
-        return f"TER >= {value}"
     
     @app.callback(
-        Output("dataset-radio", "value"),
-        [Input("select-all-datasets", "n_clicks"), Input("clear-datasets", "n_clicks")],
-        State("dataset-radio", "options"),
+        Output(f"{id_prefix}dataset-radio", "value"),
+        [Input(f"{id_prefix}select-all-datasets", "n_clicks"), Input(f"{id_prefix}clear-datasets", "n_clicks")],
+        State(f"{id_prefix}dataset-radio", "options"),
         prevent_initial_call=True
     )
     def handle_dataset_controls(select_all_clicks, clear_clicks, options):
@@ -35,11 +54,63 @@ def register_callbacks(app) -> None:
             return no_update
             
         button_id = ctx.triggered[0]["prop_id"].split(".")[0]
-        if button_id == "select-all-datasets":
+        if button_id == f"{id_prefix}select-all-datasets":
             return [option["value"] for option in options]
-        elif button_id == "clear-datasets":
+        elif button_id == f"{id_prefix}clear-datasets":
             return []
         return no_update
+
+def register_callbacks(app) -> None:
+    """Register all callbacks for the application"""
+    
+    @app.callback(
+        Output("ter-value-display", "children"),
+        Input("ter-input", "value")
+    )
+    def update_ter_display(value):
+        """Update the displayed TER threshold value"""
+        # Handle None value when the input is empty
+        if value is None:
+            value = 0
+        return f"TER >= {value}"
+    
+    # Give each browser tab an id the first time the dashboard loads
+    app.clientside_callback(
+        """
+        function(timestamp, sessionId) {
+            if (sessionId) {
+                return window.dash_clientside.no_update;
+            }
+            if (window.crypto && window.crypto.randomUUID) {
+                return window.crypto.randomUUID();
+            }
+            return Date.now().toString(36) + Math.random().toString(36).slice(2);
+        }
+        """,
+        Output("session-id", "data"),
+        Input("session-id", "modified_timestamp"),
+        State("session-id", "data"),
+    )
+    
+    def register_gene_search(dropdown_id):
+        @app.callback(
+            Output(dropdown_id, "data"),
+            Input(dropdown_id, "searchValue"),
+            State(dropdown_id, "value"),
+        )
+        def update_gene_options(search_value, selected):
+            """Offer the genes matching the typed text, keeping the current selection"""
+            # Multi-select dropdowns hold a list of genes, the others a single gene
+            selected = selected if isinstance(selected, list) else [selected] if selected else []
+            genes = search_genes(search_value)
+            genes = [gene for gene in selected if gene not in genes] + genes
+            return [{"label": gene, "value": gene} for gene in genes]
+    
+    for dropdown_id in ["gene-dropdown", "gene-comparison-dropdown-1", "gene-comparison-dropdown-2",
+                        "coexpression-gene-dropdown"]:
+        register_gene_search(dropdown_id)
+    
+    register_dataset_controls(app)
     
     @app.callback(
         [Output("error-alert-viz", "children"), 
@@ -82,28 +153,33 @@ def register_callbacks(app) -> None:
         
         return no_update, no_update, no_update, no_update
     
-    def apply_common_styling(fig):
-        """Apply common styling to all plots"""
-        fig.update_layout(
-            plot_bgcolor="white",
-            height=600,
-            margin=dict(l=50, r=50, t=80, b=50)
-        )
-        fig.update_yaxes(rangemode="tozero")
-        
-        for axis in [fig.update_xaxes, fig.update_yaxes]:
-            axis(
-                gridcolor='rgba(0,0,0,0.05)',
-                gridwidth=1,
-                linecolor='rgba(0,0,0,0.2)',
-                linewidth=1
-            )
-        
-        return fig
+    def only_triggered_by(ctx, component_id: str) -> bool:
+        """True if `component_id` is the only input that changed"""
+        return [t['prop_id'].split('.')[0] for t in ctx.triggered] == [component_id]
+    
+    def trace_rows(fig, groups: pd.Series) -> list:
+        """Row positions of `groups` plotted by each colour trace of a px figure"""
+        groups = groups.to_numpy()
+        return [np.flatnonzero(groups == trace.name) for trace in fig.data]
+    
+    def regression_line(fit, max_val):
+        """Least-squares line over [0, max_val] and its equation for the title"""
+        x_reg = np.array([0, max_val])
+        y_reg = fit["intercept"] + fit["slope"] * x_reg
+        regression_text = f"(y = {fit['slope']:.2f}x + {fit['intercept']:.2f}, R² = {fit['r_squared']:.2f})"
+        return x_reg, y_reg, regression_text
+    
+    # Joins gene and group names when groups are split per gene (as in assets/expression_plot.js)
+    GROUP_SEPARATOR = " · "
+    
+    # Hover columns sent with the visualization rows
+    hover_cols = ['GeneName', 'DatasetName', 'SubsetName', 'TissueName',
+                  'SubstrateType', 'Gender', 'Stage', 'Status',
+                  'NhuDifferentiation', 'SampleId', 'TER']
     
     @app.callback(
         output=[
-            Output("gene-expression-plot", "figure"),
+            Output("viz-data", "data"),
             Output("loading-indicator", "children"),
             Output("error-alert-viz", "children", allow_duplicate=True),
             Output("error-alert-collapse-viz", "is_open", allow_duplicate=True),
@@ -111,25 +187,25 @@ def register_callbacks(app) -> None:
         inputs=[
             Input("gene-dropdown", "value"),
             Input("dataset-radio", "value"),
-            Input("xaxis-dropdown", "value"),
-            Input("plot-type-radio", "value"),
             Input("tabs", "active_tab"),
             Input("ter-input", "value"),
-            Input("y-axis-radio-viz", "value")
         ],
-        state=[State("gene-expression-plot", "figure")],
+        state=[State("session-id", "data")],
         prevent_initial_call=True,
     )
+    @supersedable
     def update_plot(
-        selected_genes: str,
+        selected_genes: list,
         selected_datasets: list,
-        x_axis: str,
-        plot_type: str,
         active_tab: str,
         ter_threshold: int,
-        y_axis_type: str,
-        current_figure: Dict[str, Any]
+        session_id: str
     ) -> Tuple[Dict[str, Any], str, str, bool]:
+        """
+        Send the rows for the selected genes, datasets and TER threshold to the
+        browser. Plot type, x-axis and y-axis scale are applied client-side
+        (assets/expression_plot.js), so changing them needs no request.
+        """
         ctx = callback_context
         if not ctx.triggered or active_tab != "gene-visualization" and ctx.triggered[0]['prop_id'].split('.')[0] != "tabs":
             return no_update, no_update, no_update, no_update
@@ -138,86 +214,332 @@ def register_callbacks(app) -> None:
         if ctx.triggered[0]['prop_id'].split('.')[0] == "tabs" and active_tab == "gene-comparison":
             return no_update, no_update, no_update, no_update
         
+        # Earlier requests of this session still running stop at their next stage
+        supersede_earlier(session_id, "viz-data")
+        
         # Check for required selections
         if not selected_genes:
-            return {}, "", html.Strong("Please select at least one gene"), True
+            return None, "", html.Strong("Please select at least one gene"), True
+        if len(selected_genes) > MAX_VISUALIZATION_GENES:
+            message = f"Please select at most {MAX_VISUALIZATION_GENES} genes"
+            return no_update, "", html.Strong(message), True
         if not selected_datasets:
-            return {}, "", html.Strong("Please select at least one dataset"), True
+            return None, "", html.Strong("Please select at least one dataset"), True
             
         # Handle None value when the input is empty   
         if ter_threshold is None:
             ter_threshold = 0
             
         try:
-            # Fetch data
-            data = fetch_gene_expression_data((selected_genes,), tuple(selected_datasets))
-            
-            if data.empty:
-                return {}, "", html.Strong("No data available for the selected combination"), True
-            
-            # Ensure TER is numeric
-            if 'TER' in data.columns:
-                data['TER'] = pd.to_numeric(data['TER'], errors='coerce')
-            
-            # Filter by TER threshold
+            viz_data = visualization_rows(tuple(dict.fromkeys(selected_genes)), tuple(sorted(selected_datasets)),
+                                          ter_threshold)
+        except Exception as e:
+            # Keep the last good rows, so the browser's figure stays as drawn
+            return no_update, "", html.Strong(f"Error generating plot: {str(e)}"), True
+        
+        if viz_data is None:
             if ter_threshold > 0:
-                filtered_data = data[data['TER'] > ter_threshold].copy()
-                if filtered_data.empty:
-                    return {}, "", html.Strong(f"No data available with TER > {ter_threshold}"), True
-                data = filtered_data
-            
-            # Fill any nulls in x_axis column with 'Unknown', including when all values are null
-            if x_axis in data.columns:
-                data[x_axis] = data[x_axis].fillna('Unknown')
-                
-            # Drop any rows with null TPM values as they can't be plotted
-            if 'TPM' in data.columns:
-                data = data.dropna(subset=['TPM'])
-                if data.empty:
-                    return {}, "", html.Strong("No non-null TPM values available for the selected data"), True
-            
-            # Common hover data for all plot types
-            hover_cols = ['GeneName', 'DatasetName', 'SubsetName', 'TissueName',
-                          'SubstrateType', 'Gender', 'Stage', 'Status',
-                          'NhuDifferentiation', 'SampleId', 'TER']
+                return None, "", html.Strong(f"No data available with TER > {ter_threshold}"), True
+            return None, "", html.Strong("No data available for the selected combination"), True
+        return viz_data, "", "", False
+    
+    def genes_label(genes) -> str:
+        """Plot title text naming the selected genes"""
+        return ", ".join(genes) if len(genes) <= 3 else f"{len(genes)} genes"
+    
+    def gene_grouped(genes, x_axis: str) -> bool:
+        """Whether groups are split per gene, as 'GENE · group', for several genes"""
+        return len(genes) > 1 and x_axis != 'GeneName'
+    
+    @result_cache.memoize("visualization-rows")
+    def visualization_rows(genes: tuple, selected_datasets: tuple, ter_threshold: int):
+        """
+        Encoded rows for the selected genes over normalized inputs (datasets
+        sorted), shared by every worker through the result cache.
+        Returns:
+            Columnar dict for the "viz-data" store, or None if no rows match
+        """
+        # Fetch plottable rows of every gene at once: filtered by dataset and
+        # TER threshold, without null TPM values
+        data = fetch_gene_expression_data(genes, selected_datasets, ter_threshold)
+        if data.empty:
+            return None
+        
+        viz_data = {
+            "gene": genes_label(genes),
+            "genes": list(genes),
+            "ter": ter_threshold,
+            "total": len(data),
+            # Inputs the server needs to draw overview and summary plots
+            "key": [list(genes), list(selected_datasets), ter_threshold],
+        }
+        # Large selections are summarised server-side; the browser only gets
+        # a capped sample of the points to draw. The budget is over the rows
+        # of all genes together. Strip plots of them fetch their rows
+        # separately (strip_rows), only when that view is chosen.
+        if len(data) > SUMMARY_THRESHOLD:
+            data = data.iloc[subsample(len(data))]
+            viz_data["summary"] = True
+        checkpoint("encode")
+        viz_data.update(encode_rows(data))
+        return viz_data
+    
+    def encode_rows(data: pd.DataFrame) -> Dict[str, Any]:
+        """TPM and hover columns of rows, encoded for the browser"""
+        return {
+            # Strip plots of many samples are drawn with WebGL in the browser
+            "webgl": use_webgl(len(data)),
+            "tpm": encode_array(data['TPM'].to_numpy()),
+            "columns": encode_frame(data, hover_cols),
+        }
+    
+    @result_cache.memoize("strip-rows")
+    def strip_rows(genes: tuple, selected_datasets: tuple, ter_threshold: int):
+        """
+        Encoded rows for a strip plot of a summarised selection: every row,
+        sampled down only above PLOT_STRIP_MAX_POINTS.
+        Returns:
+            Columnar dict for the "viz-strip-data" store, or None if no rows match
+        """
+        data = fetch_gene_expression_data(genes, selected_datasets, ter_threshold)
+        if data.empty:
+            return None
+        strip_data = {"key": [list(genes), list(selected_datasets), ter_threshold]}
+        if len(data) > STRIP_MAX_POINTS:
+            data = data.iloc[subsample(len(data), STRIP_MAX_POINTS)]
+        checkpoint("encode")
+        strip_data.update(encode_rows(data))
+        return strip_data
+    
+    # Draws raw rows in the browser, or asks for a server-side summary or
+    # for the full rows of a summarised selection's strip plot
+    app.clientside_callback(
+        ClientsideFunction(namespace="plots", function_name="renderExpression"),
+        Output("gene-expression-plot", "figure"),
+        Output("viz-summary-request", "data"),
+        Output("viz-strip-request", "data"),
+        Input("viz-data", "data"),
+        Input("plot-type-radio", "value"),
+        Input("xaxis-dropdown", "value"),
+        Input("y-axis-radio-viz", "value"),
+        Input("viz-strip-data", "data"),
+        State("viz-base-layout", "data"),
+    )
+    
+    @app.callback(
+        output=[
+            Output("viz-strip-data", "data"),
+            Output("error-alert-viz", "children", allow_duplicate=True),
+            Output("error-alert-collapse-viz", "is_open", allow_duplicate=True),
+        ],
+        inputs=[Input("viz-strip-request", "data")],
+        state=[State("session-id", "data")],
+        prevent_initial_call=True,
+    )
+    @supersedable
+    def update_strip_rows(request: dict, session_id: str) -> Tuple[Dict[str, Any], str, bool]:
+        """Send the rows for a strip plot of a summarised selection"""
+        if not request:
+            return no_update, no_update, no_update
+        supersede_earlier(session_id, "viz-strip-data")
+        genes, selected_datasets, ter_threshold = request["key"]
+        try:
+            strip_data = strip_rows(tuple(genes), tuple(selected_datasets), ter_threshold)
+        except Exception as e:
+            return no_update, html.Strong(f"Error generating plot: {str(e)}"), True
+        return strip_data, no_update, no_update
+    
+    @app.callback(
+        output=[
+            Output("gene-expression-plot", "figure", allow_duplicate=True),
+            Output("error-alert-viz", "children", allow_duplicate=True),
+            Output("error-alert-collapse-viz", "is_open", allow_duplicate=True),
+        ],
+        inputs=[Input("viz-summary-request", "data")],
+        state=[State("session-id", "data")],
+        prevent_initial_call=True,
+    )
+    @supersedable
+    def update_summary_plot(request: dict, session_id: str) -> Tuple[Dict[str, Any], str, bool]:
+        """Draw overview plots, and box or violin plots of large selections, from precomputed statistics"""
+        if not request:
+            return no_update, no_update, no_update
+        supersede_earlier(session_id, "gene-expression-plot")
+        genes, selected_datasets, ter_threshold = request["key"]
+        try:
+            if request["plotType"] == "overview":
+                figure = overview_figure(tuple(genes), tuple(selected_datasets), ter_threshold,
+                                         request["xAxis"], request["yAxisType"])
+            else:
+                figure = summary_figure(tuple(genes), tuple(selected_datasets), ter_threshold,
+                                        request["xAxis"], request["plotType"], request["yAxisType"])
+        except Exception as e:
+            return no_update, html.Strong(f"Error generating plot: {str(e)}"), True
+        return figure, "", False
+    
+    def overview_figure(genes: tuple, selected_datasets: tuple, ter_threshold: int,
+                        x_axis: str, y_axis_type: str) -> go.Figure:
+        """
+        Box plot per (x-axis group, dataset) drawn from group statistics alone,
+        with whiskers spanning the full range of each group
+        """
+        stats = group_stats(genes, selected_datasets, x_axis, ter_threshold, y_axis_type)
+        
+        # Order groups by their total, as 'total ascending' does for the raw
+        # plot; split per gene, groups are kept together in selection order
+        order = pd.DataFrame({
+            "Gene": stats["GeneName"].map({gene: i for i, gene in enumerate(genes)}),
+            "Total": stats["Mean"] * stats["SampleCount"],
+        })
+        sort_keys = ["Total"]
+        if gene_grouped(genes, x_axis):
+            stats["GroupValue"] = stats["GeneName"] + GROUP_SEPARATOR + stats["GroupValue"].astype(str)
+            sort_keys = ["Gene", "Total"]
+        order = order.groupby(stats["GroupValue"]).agg({"Gene": "first", "Total": "sum"})
+        
+        fig = go.Figure(layout=expression_plot_layout())
+        for dataset, rows in stats.groupby("DatasetName", sort=True):
+            fig.add_trace(go.Box(
+                x=rows["GroupValue"], q1=rows["Q1"], median=rows["Median"], q3=rows["Q3"],
+                lowerfence=rows["Min"], upperfence=rows["Max"], mean=rows["Mean"],
+                customdata=rows["SampleCount"], name=dataset, legendgroup=dataset,
+                offsetgroup=dataset, alignmentgroup='True',
+                hovertemplate=(f"DatasetName={dataset}<br>{x_axis}=%{{x}}<br>"
+                               "n=%{customdata}<extra></extra>")
+            ))
+        
+        plot_title = f"Expression of {genes_label(genes)} by {x_axis}"
+        if ter_threshold > 0:
+            plot_title += f" (TER > {ter_threshold})"
+        plot_title += f" - overview of {stats['SampleCount'].sum():,} samples"
+        fig.update_layout(
+            title=plot_title,
+            xaxis=dict(title_text=x_axis, categoryorder='array',
+                       categoryarray=order.sort_values(sort_keys, kind='stable').index.tolist()),
+            boxmode='overlay' if x_axis == 'DatasetName' else 'group'
+        )
+        return fig
+    
+    @result_cache.memoize("summary-figure")
+    def summary_figure(genes: tuple, selected_datasets: tuple, ter_threshold: int,
+                       x_axis: str, plot_type: str, y_axis_type: str) -> dict:
+        """
+        Box or violin plot with one precomputed box/KDE per (x-axis group, dataset),
+        overlaid with a capped sample of the points. Violin plots draw groups
+        of fewer than KDE_MIN_POINTS samples as boxes.
 
-            #Update y-axis
-            transforms = {
-                'linear': lambda x: x,
-                'log10': lambda x: np.log10(x+1),
-                'log2': lambda x: np.log2(x+1)
-            }
-            transform = transforms[y_axis_type]
-            data['TPM'] = transform(data['TPM'])
+        Groups are placed on a numeric axis (labelled with the group names) so
+        violins can be drawn as filled KDE outlines. Groups are ordered by
+        total expression, as 'total ascending' does for the raw plot; split
+        per gene, groups are kept together in gene selection order.
+        """
+        data = fetch_gene_expression_data(genes, selected_datasets, ter_threshold, y_axis_type)
+        checkpoint("figure")
+        tpm = data['TPM'].to_numpy()
+        
+        # Group codes; missing x values form their own 'Unknown' group
+        x_codes, x_labels = pd.factorize(data[x_axis])
+        x_labels = list(x_labels.astype(object))
+        if (x_codes < 0).any():
+            x_codes = np.where(x_codes < 0, len(x_labels), x_codes)
+            x_labels.append('Unknown')
+        group_genes = np.zeros(len(x_labels), dtype=int)
+        if gene_grouped(genes, x_axis):
+            # One group per (gene, x value) found, in gene-major order
+            gene_codes = data['GeneName'].cat.codes.to_numpy().astype(np.int64)
+            x_codes, groups = pd.factorize(gene_codes * len(x_labels) + x_codes, sort=True)
+            group_genes = groups // len(x_labels)
+            x_labels = [f"{genes[g]}{GROUP_SEPARATOR}{x_labels[x]}"
+                        for g, x in zip(group_genes, groups % len(x_labels))]
+        d_codes, datasets = pd.factorize(data['DatasetName'])
+        n_x, n_d = len(x_labels), len(datasets)
+        
+        totals = np.bincount(x_codes, weights=tpm, minlength=n_x)
+        x_position = np.empty(n_x)
+        x_position[np.lexsort((totals, group_genes))] = np.arange(n_x)
+        
+        # Datasets share each group's slot side by side, unless they are the groups
+        slots = 1 if x_axis == 'DatasetName' else n_d
+        slot_width = 0.8 / slots
+        dataset_offset = np.zeros(n_d) if slots == 1 else -0.4 + (np.arange(n_d) + 0.5) * slot_width
+        
+        grouped = GroupedValues(tpm, x_codes * n_d + d_codes, n_x * n_d)
+        stats_by_group = grouped.box_stats()
+        if plot_type == "violin":
+            grid, density = grouped.kde()
+        
+        sample_rows = subsample(len(data))
+        rng = np.random.default_rng(0)
+        jitter = rng.uniform(-0.35, 0.35, len(sample_rows)) * slot_width
+        colors = px.colors.qualitative.Plotly
+        
+        fig = go.Figure(layout=expression_plot_layout())
+        for d, dataset in enumerate(datasets):
+            color = colors[d % len(colors)]
+            groups = np.arange(n_x) * n_d + d
+            groups = groups[stats_by_group["count"][groups] > 0]
+            centers = x_position[groups // n_d] + dataset_offset[d]
             
-            # Create plot with dynamic x-axis and plot type
             if plot_type == "violin":
-                fig = px.violin(data, x=x_axis, y='TPM', color="DatasetName", 
-                                points="all", hover_data=hover_cols)
-            elif plot_type == "box":
-                fig = px.box(data, x=x_axis, y='TPM', color="DatasetName", 
-                             points="all", hover_data=hover_cols)
-            else:  # strip/swarm plot (default)
-                fig = px.strip(data, x=x_axis, y='TPM', color="DatasetName", 
-                               hover_data=hover_cols)
-
-            # Update layout
-            plot_title = f"Expression of {(selected_genes)} by {x_axis}"
-            if ter_threshold > 0:
-                plot_title += f" (TER > {ter_threshold})"
-                
-            fig.update_layout(
-                title=plot_title,
-                xaxis_title=x_axis,
-                yaxis_title="TPM (Transcripts Per Million)",
-                xaxis={'categoryorder': 'total ascending'},
-                legend_title_text="Dataset"
-            )
+                # One closed KDE outline per group, separated by gaps; groups
+                # too small for a KDE are drawn as narrow boxes instead, so
+                # they show even when none of their points are sampled
+                shaped = stats_by_group["count"][groups] >= KDE_MIN_POINTS
+                small = groups[~shaped]
+                if len(small):
+                    fig.add_trace(go.Box(
+                        x=centers[~shaped], width=0.3 * slot_width,
+                        q1=stats_by_group["q1"][small], median=stats_by_group["median"][small],
+                        q3=stats_by_group["q3"][small], lowerfence=stats_by_group["lowerfence"][small],
+                        upperfence=stats_by_group["upperfence"][small],
+                        marker_color=color, name=dataset, legendgroup=dataset, showlegend=False
+                    ))
+                groups, centers = groups[shaped], centers[shaped]
+                half_width = 0.45 * slot_width * density[groups] / density[groups].max(axis=1, keepdims=True)
+                outline_x = np.hstack([centers[:, None] - half_width, (centers[:, None] + half_width)[:, ::-1],
+                                       np.full((len(groups), 1), np.nan)])
+                outline_y = np.hstack([grid[groups], grid[groups][:, ::-1], np.full((len(groups), 1), np.nan)])
+                r, g, b = plotly.colors.hex_to_rgb(color)
+                fig.add_trace(go.Scatter(
+                    x=outline_x.ravel(), y=outline_y.ravel(), mode='lines', fill='toself',
+                    line=dict(color=color, width=1), fillcolor=f"rgba({r},{g},{b},0.5)",
+                    name=dataset, legendgroup=dataset, hoverinfo='skip'
+                ))
+            else:
+                fig.add_trace(go.Box(
+                    x=centers, width=0.8 * slot_width,
+                    q1=stats_by_group["q1"][groups], median=stats_by_group["median"][groups],
+                    q3=stats_by_group["q3"][groups], lowerfence=stats_by_group["lowerfence"][groups],
+                    upperfence=stats_by_group["upperfence"][groups],
+                    marker_color=color, name=dataset, legendgroup=dataset
+                ))
             
-            return apply_common_styling(fig), "", "", False
-            
-        except Exception as e:
-            return current_figure or {}, "", html.Strong(f"Error generating plot: {str(e)}"), True
+            points = sample_rows[d_codes[sample_rows] == d]
+            scatter = go.Scattergl if use_webgl(len(sample_rows)) else go.Scatter
+            fig.add_trace(scatter(
+                x=x_position[x_codes[points]] + dataset_offset[d] + jitter[d_codes[sample_rows] == d],
+                y=tpm[points], mode='markers',
+                marker=dict(color=color, size=4, opacity=0.6),
+                customdata=np.column_stack([data['SampleId'].to_numpy()[points],
+                                            np.asarray(x_labels, dtype=object)[x_codes[points]]]),
+                hovertemplate=(f"DatasetName={dataset}<br>{x_axis}=%{{customdata[1]}}<br>"
+                               "TPM=%{y}<br>SampleId=%{customdata[0]}<extra></extra>"),
+                name=dataset, legendgroup=dataset, showlegend=False
+            ))
+        
+        plot_title = f"Expression of {genes_label(genes)} by {x_axis}"
+        if ter_threshold > 0:
+            plot_title += f" (TER > {ter_threshold})"
+        plot_title += f" - summary of {len(data):,} samples, {len(sample_rows):,} shown"
+        ordered_labels = [str(x_labels[i]) for i in np.argsort(x_position)]
+        fig.update_layout(
+            title=plot_title,
+            boxmode='overlay',
+            xaxis=dict(title_text=x_axis, type='linear', tickmode='array',
+                       tickvals=list(range(n_x)), ticktext=ordered_labels,
+                       range=[-0.5, n_x - 0.5], zeroline=False)
+        )
+        return fig.to_plotly_json()
     
     @app.callback(
         output=[
@@ -233,11 +555,12 @@ def register_callbacks(app) -> None:
             Input("ter-input", "value"),
             Input("y-axis-radio-comparison","value")
         ],
-        state=[State("gene-comparison-plot", "figure")],
+        state=[State("session-id", "data")],
         prevent_initial_call=True,
     )
+    @supersedable
     def update_comparison_plot(gene1: str, gene2: str, selected_datasets: list, 
-        active_tab: str, ter_threshold: int, y_axis_type: str, current_figure: Dict[str, Any]) -> Tuple[Dict[str, Any], str, bool]:
+        active_tab: str, ter_threshold: int, y_axis_type: str, session_id: str) -> Tuple[Dict[str, Any], str, bool]:
         ctx = callback_context
         if not ctx.triggered or active_tab != "gene-comparison" and ctx.triggered[0]['prop_id'].split('.')[0] != "tabs":
             return no_update, no_update, no_update
@@ -246,6 +569,9 @@ def register_callbacks(app) -> None:
         if ctx.triggered[0]['prop_id'].split('.')[0] == "tabs" and active_tab == "gene-visualization":
             return no_update, no_update, no_update
         
+        # Earlier requests of this session still running stop at their next stage
+        supersede_earlier(session_id, "gene-comparison-plot")
+        
         # Check for required selections
         if not gene1 or not gene2:
             missing = "first" if not gene1 else "second"
@@ -261,208 +587,396 @@ def register_callbacks(app) -> None:
         # Handle None value when the input is empty
         if ter_threshold is None:
             ter_threshold = 0
+        
+        selected_datasets = tuple(sorted(selected_datasets))
+        figure_inputs = (gene1, gene2, selected_datasets, ter_threshold)
+        transform = TRANSFORMS[y_axis_type]
+        
+        # A scale change keeps the samples and correlations; only the point
+        # coordinates, regression line and its equation in the title change
+        if only_triggered_by(ctx, "y-axis-radio-comparison"):
+            state = load_figure_state(session_id, "gene-comparison-plot", figure_inputs)
+            if state is not None:
+                x_values = transform(state["x"])
+                y_values = transform(state["y"])
+                patch = Patch()
+                for i, rows in enumerate(state["rows"]):
+                    patch["data"][i]["x"] = x_values[rows]
+                    patch["data"][i]["y"] = y_values[rows]
+                if len(x_values) > 1:
+                    max_val = max(x_values.max(), y_values.max())
+                    x_reg, y_reg, regression_text = regression_line(state["fits"][y_axis_type], max_val)
+                    patch["data"][len(state["rows"])]["x"] = x_reg
+                    patch["data"][len(state["rows"])]["y"] = y_reg
+                    patch["layout"]["title"]["text"] = f"{state['title']} - {regression_text}"
+                return patch, "", False
             
         try:
-            # Fetch and prepare data
-            data = fetch_gene_expression_data((gene1, gene2), tuple(selected_datasets))
-            
-            if data.empty:
-                message = "No data available for the selected combination"
-                return create_empty_comparison_plot(gene1, gene2, message, ter_threshold), html.Strong(message), True
-            
-            # Ensure TER is numeric
-            if 'TER' in data.columns:
-                data['TER'] = pd.to_numeric(data['TER'], errors='coerce')
-             
-            # Filter by TER threshold
+            figure, message, state = comparison_figure(
+                gene1, gene2, selected_datasets, ter_threshold, y_axis_type
+            )
+        except Exception as e:
+            message = f"Error generating comparison plot: {str(e)}"
+            return create_empty_comparison_plot(gene1, gene2, message, ter_threshold), html.Strong(message), True
+        
+        if message:
+            return figure, html.Strong(message), True
+        if state is not None:
+            save_figure_state(session_id, "gene-comparison-plot", figure_inputs, **state)
+        return figure, "", False
+    
+    @result_cache.memoize("comparison-figure")
+    def comparison_figure(gene1: str, gene2: str, selected_datasets: tuple,
+                          ter_threshold: int, y_axis_type: str) -> tuple:
+        """
+        Build the comparison plot for normalized inputs (datasets sorted).
+
+        Results are kept in the shared result cache, so a repeated view is
+        served by every worker without touching pandas or plotly.
+        Returns:
+            (figure dict, error message or None, figure state for y-axis patches or None)
+        """
+        transform = TRANSFORMS[y_axis_type]
+        
+        # Fetch and prepare data, filtered by dataset and TER threshold
+        data = fetch_gene_expression_data((gene1, gene2), selected_datasets, ter_threshold)
+        
+        if data.empty:
             if ter_threshold > 0:
-                filtered_data = data[data['TER'] > ter_threshold].copy()
-                if filtered_data.empty:
-                    message = f"No data available with TER > {ter_threshold}"
-                    return create_empty_comparison_plot(gene1, gene2, message, ter_threshold), html.Strong(message), True
-                data = filtered_data
-            
-            # Process data for scatter plot
-            gene1_data = data[data['GeneName'] == gene1].copy()
-            gene2_data = data[data['GeneName'] == gene2].copy()
-            
-            # Check for empty datasets after filtering
-            if gene1_data.empty:
-                message = f"No data available for {gene1} with the current filters"
-                return create_empty_comparison_plot(gene1, gene2, message, ter_threshold), html.Strong(message), True
-            if gene2_data.empty:
-                message = f"No data available for {gene2} with the current filters"
-                return create_empty_comparison_plot(gene1, gene2, message, ter_threshold), html.Strong(message), True
-            
-            # Drop any rows with null TPM values
-            gene1_data = gene1_data.dropna(subset=['TPM'])
-            gene2_data = gene2_data.dropna(subset=['TPM'])
-            
-            if gene1_data.empty:
-                message = f"No non-null TPM values available for {gene1}"
-                return create_empty_comparison_plot(gene1, gene2, message, ter_threshold), html.Strong(message), True
-            if gene2_data.empty:
-                message = f"No non-null TPM values available for {gene2}"
-                return create_empty_comparison_plot(gene1, gene2, message, ter_threshold), html.Strong(message), True
-            
-            gene1_count = len(gene1_data)
-            gene2_count = len(gene2_data)
-            
-            # Define metadata columns for hover data
-            metadata_columns = ['DatasetName', 'SubsetName', 'TissueName', 'SubstrateType', 
-                                'Gender', 'Stage', 'Status', 'NhuDifferentiation', 'TER']
-            available_metadata = [col for col in metadata_columns if col in data.columns]
-            
-            gene1_data = gene1_data.rename(columns={'TPM': f'{gene1}_TPM'})
-            gene2_data = gene2_data.rename(columns={'TPM': f'{gene2}_TPM'})
-            
-            if 'SampleId' not in gene1_data.columns:
-                message = "Sample ID information is not available for proper gene comparison"
-                return create_empty_comparison_plot(gene1, gene2, message, ter_threshold), html.Strong(message), True
-            
-            # Prepare data for merge
-            gene1_cols = ['SampleId'] + available_metadata + [f'{gene1}_TPM']
-            gene2_cols = ['SampleId'] + [f'{gene2}_TPM']
-            
-            gene1_data = gene1_data[gene1_cols].drop_duplicates('SampleId')
-            gene2_data = gene2_data[gene2_cols].drop_duplicates('SampleId')
-            
-            # Merge the dataframes on SampleId
-            merged_data = gene1_data.merge(gene2_data, on='SampleId', how='inner')
-            matched_count = len(merged_data)
+                message = f"No data available with TER > {ter_threshold}"
+            else:
+                message = "No data available for the selected combination"
+            return create_empty_comparison_plot(gene1, gene2, message, ter_threshold).to_plotly_json(), message, None
+        
+        # Define metadata columns for hover data
+        metadata_columns = ['DatasetName', 'SubsetName', 'TissueName', 'SubstrateType', 
+                            'Gender', 'Stage', 'Status', 'NhuDifferentiation', 'TER']
+        available_metadata = [col for col in metadata_columns if col in data.columns]
+        
+        # Split into one frame per gene, selecting only the columns needed for the merge
+        is_gene1 = (data['GeneName'] == gene1).to_numpy()
+        is_gene2 = (data['GeneName'] == gene2).to_numpy()
+        gene1_data = data.loc[is_gene1, ['SampleIndex', 'SampleId'] + available_metadata + ['TPM']]
+        gene2_data = data.loc[is_gene2, ['SampleIndex', 'TPM']]
+        
+        # Check for empty datasets after filtering
+        if gene1_data.empty:
+            message = f"No data available for {gene1} with the current filters"
+            return create_empty_comparison_plot(gene1, gene2, message, ter_threshold).to_plotly_json(), message, None
+        if gene2_data.empty:
+            message = f"No data available for {gene2} with the current filters"
+            return create_empty_comparison_plot(gene1, gene2, message, ter_threshold).to_plotly_json(), message, None
+        
+        gene1_count = len(gene1_data)
+        gene2_count = len(gene2_data)
+        
+        gene1_data = gene1_data.rename(columns={'TPM': f'{gene1}_TPM'}).drop_duplicates('SampleIndex')
+        gene2_data = gene2_data.rename(columns={'TPM': f'{gene2}_TPM'}).drop_duplicates('SampleIndex')
+        
+        # Merge the dataframes on the integer sample index
+        merged_data = gene1_data.merge(gene2_data, on='SampleIndex', how='inner')
+        matched_count = len(merged_data)
+        
+        if merged_data.empty:
+            diag_message = f"Found {gene1_count} samples for {gene1}, {gene2_count} samples for {gene2}, and 0 matching samples."
+            message = f"No matching samples found for both genes. {diag_message}"
+            return create_empty_comparison_plot(gene1, gene2, message, ter_threshold).to_plotly_json(), message, None
             
-            if merged_data.empty:
-                diag_message = f"Found {gene1_count} samples for {gene1}, {gene2_count} samples for {gene2}, and 0 matching samples."
-                message = f"No matching samples found for both genes. {diag_message}"
-                return create_empty_comparison_plot(gene1, gene2, message, ter_threshold), html.Strong(message), True
-                
-            # Create scatter plot
-            col1 = f'{gene1}_TPM'
-            col2 = f'{gene2}_TPM'
-            hover_data = {'SampleId': True, col1: True, col2: True}
-            for col in available_metadata:
-                if col in merged_data.columns:
-                    hover_data[col] = True
+        # Create scatter plot
+        col1 = f'{gene1}_TPM'
+        col2 = f'{gene2}_TPM'
+        hover_data = {'SampleId': True, col1: True, col2: True}
+        for col in available_metadata:
+            if col in merged_data.columns:
+                hover_data[col] = True
 
-            x_values = merged_data[col1].values
-            y_values = merged_data[col2].values
-            
-            #print(f"x_values: {x_values}")
-            #print(f"y_values: {y_values}")
+        checkpoint("figure")
+        
+        # Correlations, and the regression fit for every axis scale, in one pass
+        linear_x = merged_data[col1].to_numpy()
+        linear_y = merged_data[col2].to_numpy()
+        statistics = pair_statistics(linear_x, linear_y)
+
+        #Update y-axis
+        merged_data[col1] = transform(merged_data[col1])
+        merged_data[col2] = transform(merged_data[col2])
+        
+        fig = comparison_scatter(merged_data, col1, col2, hover_data)
+        
+        # Update layout
+        plot_title = f"Gene Comparison: {gene1} vs {gene2}"
+        if ter_threshold > 0:
+            plot_title += f" (TER > {ter_threshold})"
             
-            # Calculate Pearson correlation
-            pearson_corr, p_value = stats.pearsonr(x_values, y_values)
+        fig.update_layout(
+            title=plot_title,
+            xaxis_title=f"{gene1} Expression (TPM)",
+            yaxis_title=f"{gene2} Expression (TPM)",
+            legend_title_text="Dataset"
+        )
+        
+        # Find max value for axis ranges
+        max_val = max(
+            merged_data[col1].max(), 
+            merged_data[col2].max()
+        )
+        
+        # Rows of the merged data drawn by each dataset's trace, before the regression line
+        if "DatasetName" in merged_data.columns:
+            rows = trace_rows(fig, merged_data["DatasetName"])
+        else:
+            rows = [np.arange(len(merged_data))]
+        
+        # Add regression line if there are enough data points
+        if len(merged_data) > 1:
             
-            # Calculate Spearman correlation
-            spearman_corr, spearman_p = stats.spearmanr(x_values, y_values)
-
-            # Calculate Pearson correlation for log2(TPM+1)
-            log_x = np.log2(x_values + 1)
-            log_y = np.log2(y_values + 1)
-            pearson_corr_log, p_value_log = stats.pearsonr(log_x, log_y)
-
-            #Update y-axis
-            transforms = {
-                'linear': lambda x: x,
-                'log10': lambda x: np.log10(x+1),
-                'log2': lambda x: np.log2(x+1)
-            }
-            transform = transforms[y_axis_type]
-            merged_data[col1] = transform(merged_data[col1])
-            merged_data[col2] = transform(merged_data[col2])
+            # Standard regression line calculation
+            x_reg, y_reg, regression_text = regression_line(statistics["fits"][y_axis_type], max_val)
             
-            fig = px.scatter(
-                merged_data, 
-                x=col1,
-                y=col2,
-                color="DatasetName" if "DatasetName" in merged_data.columns else None,
-                hover_data=hover_data,
-                opacity=0.7,
-                size_max=10
+            fig.add_trace(
+                go.Scatter(
+                    x=x_reg,
+                    y=y_reg,
+                    mode='lines',
+                    line=dict(color='rgba(255,0,0,0.7)', width=2),
+                    name='Regression Line'
+                )
             )
             
-            # Update layout
-            plot_title = f"Gene Comparison: {gene1} vs {gene2}"
-            if ter_threshold > 0:
-                plot_title += f" (TER > {ter_threshold})"
-                
-            fig.update_layout(
-                title=plot_title,
-                xaxis_title=f"{gene1} Expression (TPM)",
-                yaxis_title=f"{gene2} Expression (TPM)",
-                legend_title_text="Dataset"
+            # Create a string with all correlation information
+            correlation_text = (
+                f"Pearson: {statistics['pearson']['r']:.3f}, "
+                f"Pearson log2(TPM+1): {statistics['pearson_log2']['r']:.3f}, "
+                f"Spearman: {statistics['spearman']['r']:.3f}"
             )
             
-            # Update marker properties
-            fig.update_traces(
-                marker=dict(
-                    size=8,
-                    opacity=0.7,
-                    line=dict(width=1, color='DarkSlateGrey')
-                ),
-                selector=dict(mode='markers')
-            )
+            # Add regression equation and correlation coefficients to title
+            fig.update_layout(title=f"{plot_title} - {regression_text}")
             
-            # Find max value for axis ranges
-            max_val = max(
-                merged_data[col1].max(), 
-                merged_data[col2].max()
+            # Add correlation coefficients as an annotation at the bottom of the plot
+            fig.add_annotation(
+                xref="paper", yref="paper",
+                x=0.5, y=0,
+                text=correlation_text,
+                showarrow=False,
+                font=dict(size=12),
+                bgcolor="rgba(255,255,255,0.8)",
+                bordercolor="rgba(0,0,0,0.2)",
+                borderwidth=1,
+                borderpad=4,
+                align="center"
             )
-            
-            # Add regression line if there are enough data points
-            if len(merged_data) > 1:
-                
-                x_values = merged_data[col1].values
-                y_values = merged_data[col2].values
+        
+        # What a later y-axis scale change needs to patch this figure
+        state = None
+        if all(len(r) == len(trace.x) for r, trace in zip(rows, fig.data)):
+            state = dict(x=linear_x, y=linear_y, rows=rows, title=plot_title, fits=statistics["fits"])
+        
+        return apply_common_styling(fig).to_plotly_json(), None, state
 
-                # Standard regression line calculation
-                slope, intercept, r_value, p_value, std_err = stats.linregress(x_values, y_values)
-                r_squared = r_value**2
-                
-                # Add regression line
-                x_reg = np.array([0, max_val])
-                y_reg = intercept + slope * x_reg
-                
-                fig.add_trace(
-                    go.Scatter(
-                        x=x_reg,
-                        y=y_reg,
-                        mode='lines',
-                        line=dict(color='rgba(255,0,0,0.7)', width=2),
-                        name='Regression Line'
-                    )
-                )
-                
-                # Create a string with all correlation information
-                correlation_text = (
-                    f"Pearson: {pearson_corr:.3f}, "
-                    f"Pearson log2(TPM+1): {pearson_corr_log:.3f}, "
-                    f"Spearman: {spearman_corr:.3f}"
-                )
-                
-                # Add regression equation and correlation coefficients to title
-                regression_text = f"(y = {slope:.2f}x + {intercept:.2f}, R² = {r_squared:.2f})"
-                fig.update_layout(title=f"{plot_title} - {regression_text}")
-                
-                # Add correlation coefficients as an annotation at the bottom of the plot
-                fig.add_annotation(
-                    xref="paper", yref="paper",
-                    x=0.5, y=0,
-                    text=correlation_text,
-                    showarrow=False,
-                    font=dict(size=12),
-                    bgcolor="rgba(255,255,255,0.8)",
-                    bordercolor="rgba(0,0,0,0.2)",
-                    borderwidth=1,
-                    borderpad=4,
-                    align="center"
-                )
-            
-            return apply_common_styling(fig), "", False
-                
+    # The tab check and required selections are handled here, in the web
+    # worker, so only searches to run reach the analysis pool
+    @app.callback(
+        [Output("coexpression-request", "data"),
+         Output("coexpression-results", "children", allow_duplicate=True),
+         Output("error-alert-coexp", "children", allow_duplicate=True),
+         Output("error-alert-collapse-coexp", "is_open", allow_duplicate=True)],
+        [Input("coexpression-gene-dropdown", "value"),
+         Input("coexpression-method-radio", "value"),
+         Input("coexpression-count-dropdown", "value"),
+         Input("dataset-radio", "value"),
+         Input("tabs", "active_tab"),
+         Input("ter-input", "value")],
+        State("coexpression-request", "data"),
+        prevent_initial_call=True,
+    )
+    def request_coexpression(gene: str, method: str, top: str, selected_datasets: list, active_tab: str,
+                             ter_threshold: int, last_request: dict):
+        """Start a co-expression search for the current selection, unless it is the one shown"""
+        if active_tab != "gene-coexpression":
+            return no_update, no_update, no_update, no_update
+        
+        # Check for required selections
+        if not gene:
+            message = "Please select a gene"
+            return None, html.P(message, className="text-muted"), html.Strong(message), True
+        if not selected_datasets:
+            message = "Please select at least one dataset"
+            return None, html.P(message, className="text-muted"), html.Strong(message), True
+        
+        # Handle None value when the input is empty
+        if ter_threshold is None:
+            ter_threshold = 0
+        
+        request = {"gene": gene, "method": method, "top": int(top),
+                   "datasets": sorted(selected_datasets), "ter": ter_threshold}
+        if request == last_request:
+            return no_update, no_update, no_update, no_update
+        return request, no_update, no_update, no_update
+    
+    @app.callback(
+        [Output("coexpression-results", "children"),
+         Output("error-alert-coexp", "children"),
+         Output("error-alert-collapse-coexp", "is_open")],
+        Input("coexpression-request", "data"),
+        prevent_initial_call=True,
+        # Whole-transcriptome searches have their own pool
+        background=True,
+        manager=analysis_job_manager,
+        interval=BACKGROUND_POLL_INTERVAL,
+        progress=Output("coexpression-progress", "children"),
+        progress_default="",
+    )
+    def update_coexpression(set_progress, request: dict):
+        """List the genes most correlated with the selected gene across the whole transcriptome"""
+        if not request:
+            return no_update, no_update, no_update
+        gene, method, top = request["gene"], request["method"], request["top"]
+        selected_datasets, ter_threshold = request["datasets"], request["ter"]
+        
+        set_progress(f"Correlating {gene} with every gene...")
+        try:
+            results = top_coexpressed(gene, tuple(selected_datasets), ter_threshold, method, top)
         except Exception as e:
-            message = f"Error generating comparison plot: {str(e)}"
-            return create_empty_comparison_plot(gene1, gene2, message, ter_threshold), html.Strong(message), True
+            message = f"Error searching co-expressed genes: {str(e)}"
+            return html.P(message, className="text-muted"), html.Strong(message), True
+        
+        if results.empty:
+            message = f"Not enough samples with data for {gene} with the current filters"
+            return html.P(message, className="text-muted"), html.Strong(message), True
+        
+        caption = f"Genes most correlated with {gene} ({COEXPRESSION_METHODS[method]})"
+        if ter_threshold > 0:
+            caption += f", TER > {ter_threshold}"
+        return coexpression_table(results, caption), "", False
+
+    @app.callback(
+        Output("neighbour-results", "children"),
+        [Input("coexpression-gene-dropdown", "value"),
+         Input("coexpression-method-radio", "value"),
+         Input("coexpression-count-dropdown", "value"),
+         Input("tabs", "active_tab")],
+    )
+    def update_neighbours(gene: str, method: str, top: str, active_tab: str):
+        """Show the selected gene's precomputed neighbours in every dataset"""
+        if active_tab != "gene-coexpression":
+            return no_update
+        if not gene or not has_neighbours():
+            return None
+        if method not in NEIGHBOUR_METHODS:
+            labels = " and ".join(COEXPRESSION_METHODS[m] for m in NEIGHBOUR_METHODS)
+            return html.P(f"Precomputed neighbours are available for {labels}", className="small text-muted")
+        
+        neighbours = fetch_neighbours(gene, method, int(top))
+        if neighbours.empty:
+            return html.P(f"No precomputed neighbours for {gene}", className="small text-muted")
+        caption = (f"Genes most correlated with {gene} ({COEXPRESSION_METHODS[method]}) within each dataset, "
+                   "computed over all samples when the database was built")
+        return neighbour_panel(neighbours, caption)
+
+    # As for co-expression, the tab check and required selections are
+    # handled in the web worker; the button's clicks are part of the request,
+    # so drawing again (say after a cancel) runs even for unchanged inputs
+    @app.callback(
+        [Output("heatmap-request", "data"),
+         Output("heatmap-timing", "children", allow_duplicate=True),
+         Output("error-alert-heatmap", "children", allow_duplicate=True),
+         Output("error-alert-collapse-heatmap", "is_open", allow_duplicate=True)],
+        [Input("heatmap-button", "n_clicks"),
+         Input("heatmap-cluster-checklist", "value"),
+         Input("dataset-radio", "value"),
+         Input("tabs", "active_tab"),
+         Input("ter-input", "value")],
+        [State("heatmap-genes-input", "value"),
+         State("heatmap-request", "data")],
+        prevent_initial_call=True,
+    )
+    def request_heatmap(n_clicks: int, cluster: list, selected_datasets: list, active_tab: str,
+                        ter_threshold: int, gene_text: str, last_request: dict):
+        """Start drawing the heatmap for the current inputs, unless it is the one shown"""
+        if active_tab != "gene-heatmap" or not n_clicks:
+            return no_update, no_update, no_update, no_update
+        
+        # Check for required selections
+        names = parse_gene_list(gene_text)
+        if not names:
+            return no_update, None, html.Strong("Please enter at least one gene"), True
+        if len(names) > HEATMAP_MAX_GENES:
+            message = f"Please enter at most {HEATMAP_MAX_GENES:,} genes ({len(names):,} entered)"
+            return no_update, None, html.Strong(message), True
+        if not selected_datasets:
+            return no_update, None, html.Strong("Please select at least one dataset"), True
+        
+        # Handle None values when the inputs are empty
+        if ter_threshold is None:
+            ter_threshold = 0
+        
+        request = {"clicks": n_clicks, "names": names, "cluster": cluster or [],
+                   "datasets": sorted(selected_datasets), "ter": ter_threshold}
+        if request == last_request:
+            return no_update, no_update, no_update, no_update
+        return request, no_update, no_update, no_update
+    
+    @app.callback(
+        [Output("gene-heatmap-plot", "figure"),
+         Output("heatmap-timing", "children"),
+         Output("error-alert-heatmap", "children"),
+         Output("error-alert-collapse-heatmap", "is_open")],
+        Input("heatmap-request", "data"),
+        prevent_initial_call=True,
+        background=True,
+        interval=BACKGROUND_POLL_INTERVAL,
+        progress=Output("heatmap-progress", "children"),
+        progress_default="",
+        running=[(Output("heatmap-button", "disabled"), True, False),
+                 (Output("heatmap-cancel-button", "disabled"), False, True)],
+        cancel=[Input("heatmap-cancel-button", "n_clicks")],
+    )
+    def update_heatmap(set_progress, request: dict):
+        """Draw the z-scores of a pasted gene list over the selected samples, clustered"""
+        if not request:
+            return no_update, no_update, no_update, no_update
+        cluster, selected_datasets, ter_threshold = request["cluster"], request["datasets"], request["ter"]
+        
+        genes, unknown = resolve_genes(request["names"])
+        if not genes:
+            return no_update, None, html.Strong("None of the entered genes were found"), True
+        
+        set_progress(f"Clustering {len(genes):,} genes...")
+        try:
+            result = heatmap_matrix(tuple(genes), tuple(selected_datasets), ter_threshold,
+                                    "rows" in cluster, "columns" in cluster)
+        except Exception as e:
+            return no_update, None, html.Strong(f"Error building heatmap: {str(e)}"), True
+        
+        if not len(result["samples"]):
+            return no_update, None, html.Strong("No samples match the current filters"), True
+        
+        title = f"Expression z-scores of {len(genes):,} genes over {len(result['samples']):,} samples"
+        if ter_threshold > 0:
+            title += f" (TER > {ter_threshold})"
+        set_progress("Drawing the heatmap...")
+        start = time.perf_counter()
+        sample_ids = get_sample_metadata()["SampleId"].to_numpy()[result["samples"]].astype(str)
+        figure = heatmap_figure(result["z"], result["genes"], sample_ids, HEATMAP_Z_LIMIT, title).to_plotly_json()
+        timings = dict(result["timings"], serialise=time.perf_counter() - start)
+        
+        # Stage timings, also reported as Server-Timing headers when Dash runs
+        # in debug mode and the callback runs in the request
+        if has_request_context():
+            for name, seconds in timings.items():
+                callback_context.record_timing(f"heatmap-{name}", seconds)
+        notes = [f"Fetch {1000 * timings['fetch']:.0f} ms, clustering {1000 * timings['cluster']:.0f} ms, "
+                 f"serialisation {1000 * timings['serialise']:.0f} ms."]
+        if "columns" in cluster and not result["columns_clustered"]:
+            notes.append("Too many samples to cluster; samples are in database order.")
+        
+        # Genes not found don't stop the heatmap, but are listed
+        message, show_message = "", False
+        if unknown:
+            shown = ", ".join(unknown[:20]) + (f" and {len(unknown) - 20:,} more" if len(unknown) > 20 else "")
+            message, show_message = html.Strong(f"Genes not found: {shown}"), True
+        return figure, " ".join(notes), message, show_message
 
     def create_empty_comparison_plot(gene1, gene2, message, ter_threshold=None):
         """Helper function to create an empty comparison plot with appropriate labels"""
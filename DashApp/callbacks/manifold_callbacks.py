@@ -0,0 +1,82 @@
+from dash import html, no_update
+from dash.dependencies import Input, Output
+import pandas as pd
+from data.manifold import MANIFOLD_METHODS, MIN_MANIFOLD_SAMPLES, sample_embedding
+from data.sample_metadata import CATEGORICAL_COLUMNS, get_sample_metadata
+from data.background_jobs import BACKGROUND_POLL_INTERVAL, analysis_job_manager
+from components.plots import manifold_figure
+from callbacks.gene_callbacks import register_dataset_controls
+
+def register_manifold_callbacks(app) -> None:
+    """Register the callbacks of the manifold page"""
+
+    register_dataset_controls(app, "mf-")
+
+    @app.callback(
+        [Output("manifold-embedding", "data"),
+         Output("error-alert-manifold", "children"),
+         Output("error-alert-collapse-manifold", "is_open")],
+        [Input("mf-dataset-radio", "value"),
+         Input("mf-ter-input", "value"),
+         Input("manifold-method-radio", "value")],
+        # Embeddings read the whole matrix, so they run in the analysis pool
+        background=True,
+        manager=analysis_job_manager,
+        interval=BACKGROUND_POLL_INTERVAL,
+        progress=Output("manifold-progress", "children"),
+        progress_default="",
+    )
+    def update_embedding(set_progress, selected_datasets: list, ter_threshold: int, method: str):
+        """Embed the selected samples, naming the embedding for the plot to draw"""
+        # Check for required selections
+        if not selected_datasets:
+            message = "Please select at least one dataset"
+            return no_update, html.Strong(message), True
+
+        # Handle None value when the input is empty
+        if ter_threshold is None:
+            ter_threshold = 0
+
+        set_progress(f"Computing the {MANIFOLD_METHODS[method]} embedding...")
+        key = [sorted(selected_datasets), ter_threshold, method]
+        try:
+            # Cached per dataset selection, so the plot reads it back at once
+            embedding = sample_embedding(tuple(key[0]), ter_threshold, method)
+        except Exception as e:
+            message = f"Error computing the embedding: {str(e)}"
+            return no_update, html.Strong(message), True
+
+        if embedding is None:
+            message = f"At least {MIN_MANIFOLD_SAMPLES} samples are needed with the current filters"
+            return no_update, html.Strong(message), True
+        return key, "", False
+
+    @app.callback(
+        Output("manifold-plot", "figure"),
+        [Input("manifold-embedding", "data"),
+         Input("manifold-dimensions-radio", "value"),
+         Input("manifold-colour-dropdown", "value")],
+        prevent_initial_call=True,
+    )
+    def update_manifold(key: list, dimensions: int, colour: str):
+        """Draw the computed embedding, coloured by a metadata column; recolouring needs no job"""
+        if not key:
+            return no_update
+        selected_datasets, ter_threshold, method = key
+        embedding = sample_embedding(tuple(selected_datasets), ter_threshold, method)
+
+        data = get_sample_metadata().iloc[embedding["samples"]].reset_index(drop=True)
+        for column in CATEGORICAL_COLUMNS:
+            data[column] = data[column].astype(str).where(data[column].notna(), "Unknown")
+        coordinates = pd.DataFrame(embedding["coordinates"],
+                                   columns=[f"Component{i + 1}" for i in range(embedding["coordinates"].shape[1])])
+        data = pd.concat([data, coordinates], axis=1)
+
+        if embedding["explained_variance"] is not None:
+            axis_titles = [f"PC{i + 1} ({share:.1%})" for i, share in enumerate(embedding["explained_variance"])]
+        else:
+            axis_titles = [f"Component {i + 1}" for i in range(coordinates.shape[1])]
+        title = f"{MANIFOLD_METHODS[method]} of {len(data):,} samples over {embedding['genes']:,} variable genes"
+        if ter_threshold > 0:
+            title += f" (TER > {ter_threshold})"
+        return manifold_figure(data, colour, dimensions, axis_titles, title).to_plotly_json()
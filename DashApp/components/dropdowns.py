@@ -1,19 +1,30 @@
 from dash import dcc
 import dash_bootstrap_components as dbc
 import dash_mantine_components as dmc
-from data.fetch_names import fetch_gene_names
 
-def gene_dropdown():
-    gene_names = fetch_gene_names()  # Fetch the gene names from the database
-    return dmc.Select(
-        id="gene-dropdown",
-        data=[{"label": gene, "value": gene} for gene in gene_names],
+# Most genes plotted side by side on the visualization tab
+MAX_VISUALIZATION_GENES = 20
+
+def gene_select(component_id, placeholder, multiple=False):
+    # Options are filled in by the gene search callback as the user types,
+    # rather than shipping the full gene list with the layout
+    select = dmc.MultiSelect if multiple else dmc.Select
+    extra = {"maxValues": MAX_VISUALIZATION_GENES} if multiple else {}
+    return select(
+        id=component_id,
+        data=[],
         searchable=True,
+        debounce=150,
         limit=50,
-        placeholder="Select genes...",
+        placeholder=placeholder,
+        nothingFoundMessage="Type to search genes",
         clearable=True,
+        **extra,
     )
 
+def gene_dropdown():
+    return gene_select("gene-dropdown", "Select genes...", multiple=True)
+
 def xaxis_dropdown():
     options = [
         {"label": "Gene Name", "value": "GeneName"},
@@ -36,23 +47,37 @@ def xaxis_dropdown():
     )
 
 def gene_comparison_dropdown_1():
-    gene_names = fetch_gene_names()
+    return gene_select("gene-comparison-dropdown-1", "Select first gene...")
+
+def gene_comparison_dropdown_2():
+    return gene_select("gene-comparison-dropdown-2", "Select second gene...")
+
+def coexpression_gene_dropdown():
+    return gene_select("coexpression-gene-dropdown", "Select a gene...")
+
+def coexpression_count_dropdown():
     return dmc.Select(
-        id="gene-comparison-dropdown-1",
-        data=[{"label": gene, "value": gene} for gene in gene_names],
-        searchable=True,
-        limit=50,
-        placeholder="Select first gene...",
-        clearable=True,
+        id="coexpression-count-dropdown",
+        data=[{"label": str(n), "value": str(n)} for n in [10, 25, 50, 100]],
+        value="25",
+        clearable=False,
     )
 
-def gene_comparison_dropdown_2():
-    gene_names = fetch_gene_names()
+def manifold_colour_dropdown():
+    options = [
+        {"label": "Dataset", "value": "DatasetName"},
+        {"label": "Dataset Subset", "value": "SubsetName"},
+        {"label": "Tissue", "value": "TissueName"},
+        {"label": "NHU", "value": "NhuDifferentiation"},
+        {"label": "Substrate", "value": "SubstrateType"},
+        {"label": "Gender", "value": "Gender"},
+        {"label": "Tumor Stage", "value": "Stage"},
+        {"label": "Vital Status", "value": "Status"},
+        {"label": "TER", "value": "TER"}
+    ]
     return dmc.Select(
-        id="gene-comparison-dropdown-2",
-        data=[{"label": gene, "value": gene} for gene in gene_names],
-        searchable=True,
-        limit=50,
-        placeholder="Select second gene...",
-        clearable=True,
+        id="manifold-colour-dropdown",
+        data=options,
+        value="DatasetName",
+        clearable=False,
     )
@@ -1,9 +1,249 @@
-from dash import dcc
+import os
+import re
+from dash import dcc, html
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+# Point count above which scatter-type traces are drawn with WebGL
+WEBGL_THRESHOLD = int(os.getenv('PLOT_WEBGL_THRESHOLD', 1000))
+
+# Adjusted p-value and absolute log2 fold change a volcano plot highlights genes beyond
+VOLCANO_FDR = 0.05
+VOLCANO_LOG2FC = 1
+
+_CUSTOMDATA_FIELD = re.compile(r"%\{customdata\[(\d+)\]\}")
+
+def use_webgl(n_points):
+    """Whether a plot of `n_points` markers should be drawn with WebGL"""
+    return n_points > WEBGL_THRESHOLD
+
+def compact_hover(fig):
+    """
+    Shrink per-point hover data: customdata columns holding the same text for
+    every point of a trace (e.g. metadata shared by a whole dataset) are
+    written into that trace's hovertemplate once instead of per point.
+    Text with braces stays in customdata, as the template would read
+    "%{...}" in it as a field
+    """
+    for trace in fig.data:
+        if trace.customdata is None or not trace.hovertemplate:
+            continue
+        customdata = pd.DataFrame(trace.customdata)
+        constant = {}
+        for j in customdata.columns:
+            values = customdata[j]
+            if values.map(type).eq(str).all() and values.nunique() == 1:
+                value = values.iloc[0]
+                if "{" not in value and "}" not in value:
+                    constant[j] = value
+        if not constant:
+            continue
+        kept = [j for j in customdata.columns if j not in constant]
+        index = {j: i for i, j in enumerate(kept)}
+
+        def field(match):
+            j = int(match.group(1))
+            return constant[j] if j in constant else f"%{{customdata[{index[j]}]}}"
+
+        trace.hovertemplate = _CUSTOMDATA_FIELD.sub(field, trace.hovertemplate)
+        trace.customdata = customdata[kept].to_numpy() if kept else None
+    return fig
+
+def comparison_scatter(data, x, y, hover_data):
+    """
+    Scatter plot of two genes' expression coloured by dataset, switching to
+    WebGL markers without outlines above WEBGL_THRESHOLD points
+    """
+    webgl = use_webgl(len(data))
+    fig = px.scatter(
+        data,
+        x=x,
+        y=y,
+        color="DatasetName" if "DatasetName" in data.columns else None,
+        hover_data=hover_data,
+        opacity=0.7,
+        size_max=10,
+        render_mode="webgl" if webgl else "svg"
+    )
+    
+    # Update marker properties
+    fig.update_traces(
+        marker=dict(
+            size=8,
+            opacity=0.7,
+            line=dict(width=0 if webgl else 1, color='DarkSlateGrey')
+        ),
+        selector=dict(mode='markers')
+    )
+    return compact_hover(fig)
+
+def volcano_figure(results, adjusted_column, title, group_a, group_b):
+    """
+    Volcano plot of a differential expression result, one WebGL point per gene
+    Args:
+        results: DataFrame with GeneName, Log2FoldChange and `adjusted_column`
+        adjusted_column: Column of adjusted p-values plotted on the y-axis
+        title: Plot title
+        group_a, group_b: Names of the groups compared (fold change is A over B)
+    """
+    log2fc = results["Log2FoldChange"].to_numpy()
+    adjusted = results[adjusted_column].to_numpy()
+    # Adjusted p-values can underflow to 0; plot those at the smallest positive double
+    score = -np.log10(np.maximum(adjusted, np.finfo(float).tiny))
+    significant = (adjusted < VOLCANO_FDR) & (np.abs(log2fc) >= VOLCANO_LOG2FC)
+
+    fig = go.Figure()
+    for name, mask, color in [
+        ("Not significant", ~significant, "rgba(150,150,150,0.5)"),
+        (f"Higher in {group_a}", significant & (log2fc > 0), "#d62728"),
+        (f"Higher in {group_b}", significant & (log2fc < 0), "#1f77b4"),
+    ]:
+        fig.add_trace(go.Scattergl(
+            x=log2fc[mask],
+            y=score[mask],
+            text=results["GeneName"].to_numpy()[mask],
+            mode="markers",
+            name=f"{name} ({mask.sum():,})",
+            marker=dict(size=6, color=color),
+            hovertemplate="<b>%{text}</b><br>log2 fold change: %{x:.3f}<br>-log10 adjusted p: %{y:.2f}<extra></extra>",
+        ))
+    fig.add_hline(y=-np.log10(VOLCANO_FDR), line_dash="dash", line_color="rgba(0,0,0,0.3)")
+    for x in (-VOLCANO_LOG2FC, VOLCANO_LOG2FC):
+        fig.add_vline(x=x, line_dash="dash", line_color="rgba(0,0,0,0.3)")
+    fig.update_layout(
+        title=title,
+        xaxis_title=f"log2 fold change ({group_a} / {group_b})",
+        yaxis_title="-log10 adjusted p-value",
+        legend=dict(title_text=""),
+    )
+    return apply_common_styling(fig)
+
+def manifold_figure(data, colour, dimensions, axis_titles, title):
+    """
+    Scatter plot of embedded samples, in 2D (WebGL above WEBGL_THRESHOLD points) or 3D
+    Args:
+        data: DataFrame with Component1..Component3, SampleId, DatasetName and `colour` columns
+        colour: Column the points are coloured by
+        dimensions: 2 or 3
+        axis_titles: Titles of the three components' axes
+        title: Plot title
+    """
+    hover_data = {column: True for column in ["SampleId", "DatasetName"] if column != colour}
+    if dimensions == 3:
+        fig = px.scatter_3d(data, x="Component1", y="Component2", z="Component3", color=colour,
+                            hover_data=hover_data, opacity=0.8)
+        fig.update_traces(marker=dict(size=3))
+        fig.update_layout(scene=dict(xaxis_title=axis_titles[0], yaxis_title=axis_titles[1],
+                                     zaxis_title=axis_titles[2]))
+    else:
+        fig = px.scatter(data, x="Component1", y="Component2", color=colour, hover_data=hover_data,
+                         opacity=0.8, render_mode="webgl" if use_webgl(len(data)) else "svg")
+        fig.update_traces(marker=dict(size=7))
+        fig.update_layout(xaxis_title=axis_titles[0], yaxis_title=axis_titles[1])
+    fig.update_layout(title=title, legend=dict(itemsizing="constant"))
+    fig = apply_common_styling(compact_hover(fig))
+    # Embedding coordinates are centred on 0
+    fig.update_yaxes(rangemode="normal")
+    return fig
+
+# Most rows or columns a heatmap labels individually
+HEATMAP_MAX_LABELS = 100
+
+def heatmap_figure(z, genes, sample_ids, z_limit, title):
+    """
+    Expression heatmap drawn as a single trace, z-scores sent as one float32 array
+    Args:
+        z: float32 array of shape (genes, samples)
+        genes: Gene names of the rows
+        sample_ids: SampleId of the columns
+        z_limit: Colour scale range (+/-)
+        title: Plot title
+    """
+    fig = go.Figure(go.Heatmap(
+        z=z,
+        x=sample_ids,
+        y=genes,
+        zmin=-z_limit,
+        zmax=z_limit,
+        colorscale="RdBu_r",
+        colorbar=dict(title=dict(text="z-score")),
+        hovertemplate="%{y}<br>%{x}<br>z-score: %{z:.2f}<extra></extra>",
+    ))
+    fig.update_layout(
+        title=title,
+        height=max(600, min(12 * len(genes) + 200, 1400)),
+        margin=dict(l=50, r=50, t=80, b=50),
+        plot_bgcolor="white",
+    )
+    # Categorical axes, kept in the clustered order
+    fig.update_xaxes(type="category", showticklabels=len(sample_ids) <= HEATMAP_MAX_LABELS, title="Samples")
+    fig.update_yaxes(type="category", showticklabels=len(genes) <= HEATMAP_MAX_LABELS, autorange="reversed")
+    return fig
+
+def apply_common_styling(fig):
+    """Apply common styling to all plots"""
+    fig.update_layout(
+        plot_bgcolor="white",
+        height=600,
+        margin=dict(l=50, r=50, t=80, b=50)
+    )
+    fig.update_yaxes(rangemode="tozero")
+
+    for axis in [fig.update_xaxes, fig.update_yaxes]:
+        axis(
+            gridcolor='rgba(0,0,0,0.05)',
+            gridwidth=1,
+            linecolor='rgba(0,0,0,0.2)',
+            linewidth=1
+        )
+
+    return fig
+
+def expression_plot_layout():
+    # Styled layout (including the Plotly template) the browser draws the
+    # gene expression plot into; traces, title and x-axis title are added client-side
+    fig = go.Figure()
+    fig.update_layout(
+        yaxis_title="TPM (Transcripts Per Million)",
+        xaxis={'categoryorder': 'total ascending'},
+        legend=dict(title_text="Dataset", tracegroupgap=0)
+    )
+    return apply_common_styling(fig).to_dict()["layout"]
 
 def gene_expression_plot():
-    # This component will render the gene expression plot
-    return dcc.Graph(id="gene-expression-plot")
+    # This component will render the gene expression plot, drawn in the browser
+    # from the rows held in "viz-data"
+    return html.Div([
+        dcc.Store(id="viz-data"),
+        dcc.Store(id="viz-summary-request"),
+        dcc.Store(id="viz-strip-request"),
+        dcc.Store(id="viz-strip-data"),
+        dcc.Store(id="viz-base-layout", data=expression_plot_layout()),
+        dcc.Graph(id="gene-expression-plot")
+    ])
 
 def gene_comparison_plot():
     # Component for rendering the gene comparison scatter plot
     return dcc.Graph(id="gene-comparison-plot")
+
+def differential_volcano_plot():
+    # Volcano plot of the differential expression page
+    return dcc.Graph(id="differential-volcano-plot")
+
+def manifold_plot():
+    # Sample embedding plot of the manifold page, drawn from the embedding
+    # named in "manifold-embedding" once it has been computed
+    return html.Div([
+        dcc.Store(id="manifold-embedding"),
+        dcc.Graph(id="manifold-plot")
+    ])
+
+def gene_heatmap_plot():
+    # Component for rendering the clustered gene heatmap, with the inputs
+    # of the heatmap last requested
+    return html.Div([
+        dcc.Store(id="heatmap-request"),
+        dcc.Graph(id="gene-heatmap-plot")
+    ])
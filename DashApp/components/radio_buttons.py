@@ -1,17 +1,19 @@
 from dash import dcc, html
 import dash_bootstrap_components as dbc
 import dash_mantine_components as dmc
-from data.fetch_names import fetch_datasets
+from data.options_asset import dataset_options_url
+from data.coexpression import COEXPRESSION_METHODS
 
-def dataset_radio():
-    datasets = fetch_datasets()  # Fetch dataset names from the database
-    radio_options = [{"label": dataset, "value": dataset} for dataset in datasets]
-    
+def dataset_radio(id_prefix=""):
+    # id_prefix keeps the ids unique when another page has its own dataset selection
     return html.Div([
+        # Dataset names are loaded in the browser from a long-lived cached asset
+        dcc.Store(id=f"{id_prefix}dataset-options-url", data=dataset_options_url()),
+        
         # Dataset checklist
         dcc.Checklist(
-            id="dataset-radio",
-            options=radio_options,
+            id=f"{id_prefix}dataset-radio",
+            options=[],
             value=[],  # No default value
             labelStyle={'display': 'block', 'margin-bottom': '10px'},
             className="dataset-radio-group mb-3"
@@ -21,7 +23,7 @@ def dataset_radio():
         dbc.ButtonGroup([
             dbc.Button(
                 "Select All Datasets",
-                id="select-all-datasets",
+                id=f"{id_prefix}select-all-datasets",
                 n_clicks=0,
                 color="primary",
                 outline=True,
@@ -30,7 +32,7 @@ def dataset_radio():
             ),
             dbc.Button(
                 "Clear Selection",
-                id="clear-datasets",
+                id=f"{id_prefix}clear-datasets",
                 n_clicks=0,
                 color="secondary",
                 outline=True,
@@ -39,7 +41,7 @@ def dataset_radio():
         ], className="mb-3")
     ])
 
-def ter_radio():
+def ter_radio(id_prefix=""):
 
     return html.Div([
         # TER radio buttons
@@ -50,7 +52,7 @@ def ter_radio():
                 {"label": "tight barrier >= 1000Ω.cm^2", "value": 1000},
             ],
             value=0,
-            id="ter-input",
+            id=f"{id_prefix}ter-input",
         ),
     ])
 
@@ -87,3 +89,15 @@ def y_axis_radio_comparison():
             className="mb-2 small"
         ),
     ])
+
+def coexpression_method_radio():
+
+    return html.Div([
+        # Correlation measure radio buttons
+        dbc.RadioItems(
+            options=[{"label": label, "value": value} for value, label in COEXPRESSION_METHODS.items()],
+            value="pearson_log2",
+            id="coexpression-method-radio",
+            className="mb-2 small"
+        ),
+    ])
@@ -0,0 +1,119 @@
+from dash import html, dcc
+import dash_bootstrap_components as dbc
+from data.neighbours import ALL_DATASETS_SCOPE
+
+def coexpression_results():
+    # Container the co-expression table is rendered into, with the inputs
+    # of the search last requested
+    return html.Div([
+        dcc.Store(id="coexpression-request"),
+        html.Div(id="coexpression-results", className="p-2")
+    ])
+
+def coexpression_table(results, caption):
+    """
+    Table of the genes most correlated with the selected gene
+    Args:
+        results: DataFrame with GeneName, Correlation, PValue and Samples columns
+        caption: Text describing the search shown above the table
+    """
+    header = html.Thead(html.Tr([
+        html.Th("#", scope="col"),
+        html.Th("Gene", scope="col"),
+        html.Th("Correlation", scope="col"),
+        html.Th("p-value", scope="col"),
+        html.Th("Samples", scope="col"),
+    ]))
+    body = html.Tbody([
+        html.Tr([
+            html.Td(rank),
+            html.Td(row.GeneName, className="fw-bold"),
+            html.Td(f"{row.Correlation:.3f}"),
+            html.Td(f"{row.PValue:.2e}"),
+            html.Td(f"{row.Samples:,}"),
+        ])
+        for rank, row in enumerate(results.itertuples(index=False), start=1)
+    ])
+    return html.Div([
+        html.P(caption, className="small text-muted mb-2"),
+        dbc.Table([header, body], striped=True, hover=True, size="sm", className="mb-0"),
+    ])
+
+def neighbour_results():
+    # Container the precomputed neighbour lists are rendered into
+    return html.Div(id="neighbour-results", className="mt-3")
+
+def neighbour_panel(neighbours, caption):
+    """
+    Card with one small table of precomputed neighbours per dataset
+    Args:
+        neighbours: DataFrame with Scope, Rank, GeneName and Correlation columns
+        caption: Text describing the lists shown above the tables
+    """
+    columns = []
+    # All datasets first, then each dataset by name
+    for name in sorted(neighbours["Scope"].unique(), key=lambda name: (name != ALL_DATASETS_SCOPE, name)):
+        rows = neighbours[neighbours["Scope"] == name]
+        columns.append(dbc.Col([
+            html.H6("All datasets" if name == ALL_DATASETS_SCOPE else name, className="fw-bold small"),
+            dbc.Table([
+                html.Thead(html.Tr([
+                    html.Th("#", scope="col"),
+                    html.Th("Gene", scope="col"),
+                    html.Th("Correlation", scope="col"),
+                ])),
+                html.Tbody([
+                    html.Tr([html.Td(row.Rank), html.Td(row.GeneName), html.Td(f"{row.Correlation:.3f}")])
+                    for row in rows.itertuples(index=False)
+                ]),
+            ], striped=True, size="sm"),
+        ], md=4))
+    return dbc.Card([
+        dbc.CardHeader("Precomputed neighbours by dataset", className="p-2 fw-bold"),
+        dbc.CardBody([
+            html.P(caption, className="small text-muted mb-2"),
+            dbc.Row(columns),
+        ], className="p-2"),
+    ])
+
+def differential_results():
+    # Container the top differentially expressed genes are rendered into
+    return html.Div(id="differential-results", className="p-2")
+
+def differential_table(results, p_column, adjusted_column, caption):
+    """
+    Table of the most significant differentially expressed genes
+    Args:
+        results: DataFrame with GeneName, MeanA, MeanB, Log2FoldChange, CountA and
+            CountB columns and the p-value columns named below
+        p_column: Column of p-values to show
+        adjusted_column: Column of the matching adjusted p-values
+        caption: Text describing the comparison shown above the table
+    """
+    header = html.Thead(html.Tr([
+        html.Th("#", scope="col"),
+        html.Th("Gene", scope="col"),
+        html.Th("log2 fold change", scope="col"),
+        html.Th("Mean A", scope="col"),
+        html.Th("Mean B", scope="col"),
+        html.Th("p-value", scope="col"),
+        html.Th("Adjusted p", scope="col"),
+        html.Th("Samples", scope="col"),
+    ]))
+    body = html.Tbody([
+        html.Tr([
+            html.Td(rank),
+            html.Td(row["GeneName"], className="fw-bold"),
+            html.Td(f"{row['Log2FoldChange']:.3f}"),
+            html.Td(f"{row['MeanA']:.2f}"),
+            html.Td(f"{row['MeanB']:.2f}"),
+            html.Td(f"{row[p_column]:.2e}"),
+            html.Td(f"{row[adjusted_column]:.2e}"),
+            html.Td(f"{row['CountA']:,} / {row['CountB']:,}"),
+        ])
+        for rank, (_, row) in enumerate(results.iterrows(), start=1)
+    ])
+    return html.Div([
+        html.P(caption, className="small text-muted mb-2"),
+        dbc.Table([header, body], striped=True, hover=True, size="sm", className="mb-0"),
+    ])
@@ -0,0 +1,584 @@
+"""
+Local background callback manager: a process pool with jobs tracked on disk.
+
+Dash background callbacks return at once with a job id, and the browser
+polls for progress and the result. Jobs run in a process pool owned by each
+gunicorn worker, so heavy analyses no longer hold a web worker. Job state,
+progress and results are kept in a small SQLite database under CACHE_DIR,
+so a poll can be answered by either worker.
+
+There are two pools: job_manager, the app's default, and
+analysis_job_manager for whole-transcriptome analyses (passed as `manager`
+to those callbacks), so a queue of long analyses never delays the others.
+Callbacks that only read a few genes stay synchronous and skip the polling.
+
+A job whose inputs match one that is still queued or running is not started
+again; the new caller subscribes to the running job and both receive its
+result. Cancelling (the browser superseding a job, or a cancel input) drops
+one subscriber, and the job is cancelled once none are left: queued jobs are
+skipped, running ones stop at their next checkpoint (see checkpoint) or
+progress report.
+
+Callbacks can also version their requests per browser session (see
+supersede_earlier), in a background job or a synchronous callback marked
+supersedable: each request for an output records when it was submitted,
+and an older request still running for the same session and output stops
+at its next checkpoint, so quick clicking through genes only finishes the
+last request. Per-callback counters of completed, skipped and stopped
+requests, where they stopped and the time they had used give an estimate
+of the work saved.
+"""
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import contextvars
+import functools
+import hashlib
+import logging
+import multiprocessing
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+# Private Dash modules, as used by Dash's own managers; pinned with dash in pyproject.toml
+from dash._callback_context import context_value
+from dash._utils import AttributeDict
+from dash.background_callback._proxy_set_props import ProxySetProps
+from dash.background_callback.managers import BaseBackgroundCallbackManager
+from dash.exceptions import PreventUpdate
+
+from data.result_cache import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Pool processes running background callbacks, per gunicorn worker
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', 2))
+
+# Pool processes running whole-transcriptome analyses, per gunicorn worker
+BACKGROUND_ANALYSIS_WORKERS = int(os.getenv('BACKGROUND_ANALYSIS_WORKERS', 1))
+
+# Milliseconds between the browser's polls for a job's progress and result
+BACKGROUND_POLL_INTERVAL = int(os.getenv('BACKGROUND_POLL_INTERVAL', 250))
+
+# Seconds after which finished or abandoned jobs are removed
+BACKGROUND_JOB_EXPIRE = int(os.getenv('BACKGROUND_JOB_EXPIRE', 3600))
+
+# Jobs are transient; a database of another layout is replaced
+_SCHEMA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS Job (
+    JobId TEXT PRIMARY KEY,
+    Name TEXT NOT NULL,
+    CacheKey TEXT NOT NULL,
+    DedupKey TEXT NOT NULL,
+    State TEXT NOT NULL,
+    Owner INTEGER NOT NULL,
+    Pid INTEGER,
+    Subscribers INTEGER NOT NULL DEFAULT 1,
+    Cancelled INTEGER NOT NULL DEFAULT 0,
+    Progress BLOB,
+    SetProps BLOB,
+    Result BLOB,
+    Created REAL NOT NULL,
+    Updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS JobCacheKey ON Job (CacheKey);
+CREATE INDEX IF NOT EXISTS JobDedupKey ON Job (DedupKey, State);
+CREATE TABLE IF NOT EXISTS Request (
+    Session TEXT NOT NULL,
+    Output TEXT NOT NULL,
+    Submitted REAL NOT NULL,
+    PRIMARY KEY (Session, Output)
+);
+CREATE TABLE IF NOT EXISTS Counter (
+    Name TEXT PRIMARY KEY,
+    Value INTEGER NOT NULL
+);
+"""
+
+# Job states; only queued and running jobs can be joined or cancelled
+_ACTIVE_STATES = ("queued", "running")
+
+# Callback functions by their Dash key, inherited by the forked pool processes
+_JOB_FUNCTIONS = {}
+
+# Managers by their SQLite file, for the pool processes to find their own
+_MANAGERS = {}
+
+# Stored result of a job that leaves its outputs unchanged
+_NO_UPDATE = {"_dash_no_update": "_dash_no_update"}
+
+# Job run by the current pool process, for checkpoint()
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+# (session, output, submission time) of the current versioned request
+_current_request = contextvars.ContextVar("current_request", default=None)
+
+# Whether a synchronous callback marked supersedable is running
+_supersedable_call = contextvars.ContextVar("supersedable_call", default=False)
+
+
+class JobCancelled(BaseException):
+    """
+    Raised at a checkpoint of a job that has been cancelled or superseded.
+    Like asyncio.CancelledError it is not an Exception, so it passes through
+    the error handling of callbacks to the job runner.
+    """
+
+    def __init__(self, stage: str = ""):
+        super().__init__(stage)
+        self.stage = stage
+
+
+def checkpoint(stage: str = "") -> None:
+    """
+    Stop the calling request here if its background job has been cancelled,
+    or a newer request of the same session has superseded it.
+    Args:
+        stage: Name of the work done so far, counted when a job stops here
+    """
+    job = _current_job.get()
+    if job is not None and job.manager.is_cancelled(job.job_id):
+        raise JobCancelled(stage)
+    request = _current_request.get()
+    if request is not None and (job.manager if job else job_manager).is_superseded(*request):
+        raise JobCancelled(stage)
+
+
+def supersede_earlier(session_id: str, output: str) -> None:
+    """
+    Make the calling request the latest for `output` in a browser session.
+
+    Requests are ordered by when they were submitted (a background job's
+    submission, or now for a synchronous callback), so a job that starts
+    late still yields to a newer request. Earlier requests for the same
+    session and output stop at their next checkpoint. Does nothing outside
+    a background job or supersedable callback, or without a session id.
+    """
+    job = _current_job.get()
+    if (job is None and not _supersedable_call.get()) or not session_id:
+        return
+    submitted = job.submitted if job else time.time()
+    _current_request.set((session_id, output, submitted))
+    (job.manager if job else job_manager).register_request(session_id, output, submitted)
+
+
+def supersedable(fn):
+    """
+    Decorator for a synchronous callback calling supersede_earlier: when a
+    newer request stops it at a checkpoint, it returns no update, and its
+    outcome is counted in job_manager's per-callback stats.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.time()
+        marked = _supersedable_call.set(True)
+        request = _current_request.set(None)
+        try:
+            output = fn(*args, **kwargs)
+        except JobCancelled as cancelled:
+            job_manager.count_stop(fn.__name__, cancelled.stage, time.time() - started)
+            raise PreventUpdate
+        finally:
+            _current_request.reset(request)
+            _supersedable_call.reset(marked)
+        job_manager.count_completed(fn.__name__, time.time() - started)
+        return output
+    return wrapper
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _run_job(manager_path: str, background_key: str, job_id: str, args, context: dict) -> None:
+    """Pool entry point: run a registered callback as job `job_id` of the manager at `manager_path`."""
+    fn, progress = _JOB_FUNCTIONS[background_key]
+    _MANAGERS[manager_path].run_job(job_id, fn, progress, args, context)
+
+
+class _RunningJob:
+    """Progress, set_props and cancellation of one job inside a pool process."""
+
+    def __init__(self, manager, job_id: str, name: str, submitted: float):
+        self.manager = manager
+        self.job_id = job_id
+        self.name = name
+        self.submitted = submitted
+        self.started = time.time()
+
+    def set_progress(self, value) -> None:
+        checkpoint("progress")
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+        self.manager.update_job(self.job_id, Progress=pickle.dumps(list(value)))
+
+    def set_props(self, component_id, props) -> None:
+        self.manager.update_job(self.job_id, SetProps=pickle.dumps({component_id: props}))
+
+
+class LocalJobManager(BaseBackgroundCallbackManager):
+    """
+    Background callback manager running jobs in a local process pool.
+
+    Args:
+        path: SQLite file holding job state, progress and results
+        workers: Pool processes per web worker
+        expire: Seconds after which finished or abandoned jobs are removed
+    """
+
+    def __init__(self, path: str, workers: int, expire: int = BACKGROUND_JOB_EXPIRE):
+        self.path = path
+        self.workers = workers
+        self.expire = expire
+        self._local = threading.local()
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        _MANAGERS[path] = self
+        super().__init__(None)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+                conn.executescript("DROP TABLE IF EXISTS Job; DROP TABLE IF EXISTS Request; "
+                                   "DROP TABLE IF EXISTS Counter;")
+                conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _count(conn: sqlite3.Connection, name: str, amount: int = 1) -> None:
+        conn.execute(
+            "INSERT INTO Counter (Name, Value) VALUES (?, ?) "
+            "ON CONFLICT(Name) DO UPDATE SET Value = Value + excluded.Value",
+            (name, amount)
+        )
+
+    def _executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        """This worker's pool, created on first use so it is forked after every callback is registered."""
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("fork")
+                )
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    # Dash manager interface
+
+    def make_job_fn(self, fn, progress, key=None):
+        _JOB_FUNCTIONS[key] = (fn, progress)
+        return functools.partial(_run_job, self.path, key)
+
+    def call_job_fn(self, key, job_fn, args, context):
+        # Callbacks can depend on which input fired, so only identical triggers share a job
+        triggered = [t["prop_id"] for t in context.get("triggered_inputs", [])]
+        dedup_key = hashlib.sha256(repr((key, triggered)).encode("utf-8")).hexdigest()
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM Job WHERE Updated < ?", (now - self.expire,))
+            conn.execute("DELETE FROM Request WHERE Submitted < ?", (now - self.expire,))
+            row = conn.execute(
+                "SELECT JobId FROM Job WHERE DedupKey = ? AND Cancelled = 0 AND State IN (?, ?)",
+                (dedup_key, *_ACTIVE_STATES)
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE Job SET Subscribers = Subscribers + 1 WHERE JobId = ?", (row[0],))
+                self._count(conn, "deduplicated")
+                return row[0]
+            job_id = uuid.uuid4().hex
+            # job_fn is make_job_fn's partial, holding the callback's key
+            name = _JOB_FUNCTIONS[job_fn.args[1]][0].__name__
+            conn.execute(
+                "INSERT INTO Job (JobId, Name, CacheKey, DedupKey, State, Owner, Created, Updated) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, name, key, dedup_key, os.getpid(), now, now)
+            )
+            self._count(conn, "submitted")
+
+        try:
+            future = self._executor().submit(job_fn, job_id, args, dict(context))
+        except BrokenProcessPool:
+            # A pool process died (killed or out of memory); start a new pool
+            with self._pool_lock:
+                self._pool = None
+            future = self._executor().submit(job_fn, job_id, args, dict(context))
+        future.add_done_callback(functools.partial(self._job_done, job_id))
+        return job_id
+
+    def _job_done(self, job_id: str, future) -> None:
+        """Record jobs that ended without storing a result, such as a crashed pool process."""
+        if future.cancelled() or future.exception() is None:
+            return
+        error = future.exception()
+        logger.error("Background job %s failed: %s", job_id, error)
+        self._finish(job_id, "done", {"background_callback_error": {"msg": str(error), "tb": ""}})
+
+    def job_running(self, job):
+        if not job:
+            return False
+        row = self._connection().execute(
+            "SELECT State, Owner, Pid FROM Job WHERE JobId = ?", (job,)
+        ).fetchone()
+        if row is None or row[0] not in _ACTIVE_STATES:
+            return False
+        # Jobs of a worker or pool process that has died will never finish
+        state, owner, pid = row
+        return _process_alive(pid if state == "running" else owner)
+
+    def terminate_job(self, job):
+        if not job:
+            return
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE Job SET Subscribers = Subscribers - 1, Updated = ? WHERE JobId = ? AND State IN (?, ?)",
+                (time.time(), job, *_ACTIVE_STATES)
+            )
+            cancelled = conn.execute(
+                "UPDATE Job SET Cancelled = 1 WHERE JobId = ? AND Subscribers <= 0 AND Cancelled = 0 "
+                "AND State IN (?, ?)",
+                (job, *_ACTIVE_STATES)
+            ).rowcount
+            if cancelled:
+                self._count(conn, "cancelled")
+
+    def terminate_unhealthy_job(self, job):
+        if job and not self.job_running(job):
+            row = self._connection().execute("SELECT State FROM Job WHERE JobId = ?", (job,)).fetchone()
+            if row is not None and row[0] in _ACTIVE_STATES:
+                self._finish(job, "cancelled", None)
+                return True
+        return False
+
+    def get_progress(self, key):
+        row = self._connection().execute(
+            "SELECT Progress FROM Job WHERE CacheKey = ? AND Progress IS NOT NULL "
+            "ORDER BY Updated DESC LIMIT 1",
+            (key,)
+        ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def result_ready(self, key):
+        row = self._connection().execute(
+            "SELECT 1 FROM Job WHERE CacheKey = ? AND State = 'done'", (key,)
+        ).fetchone()
+        return row is not None
+
+    def get_result(self, key, job):
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT Result FROM Job WHERE JobId = ? AND State = 'done'", (job,)
+            ).fetchone()
+            if row is None:
+                return self.UNDEFINED
+            # Every subscriber reads the result once; the last one removes the job
+            conn.execute("UPDATE Job SET Subscribers = Subscribers - 1 WHERE JobId = ?", (job,))
+            conn.execute("DELETE FROM Job WHERE JobId = ? AND Subscribers <= 0", (job,))
+        return pickle.loads(row[0])
+
+    def get_updated_props(self, key):
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT JobId, SetProps FROM Job WHERE CacheKey = ? AND SetProps IS NOT NULL "
+                "ORDER BY Updated DESC LIMIT 1",
+                (key,)
+            ).fetchone()
+            if row is None:
+                return {}
+            conn.execute("UPDATE Job SET SetProps = NULL WHERE JobId = ?", (row[0],))
+        return pickle.loads(row[1])
+
+    def clear_cache_entry(self, key):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM Job WHERE CacheKey = ? AND State NOT IN (?, ?)", (key, *_ACTIVE_STATES))
+
+    # Job side, inside a pool process
+
+    def is_cancelled(self, job_id: str) -> bool:
+        row = self._connection().execute("SELECT Cancelled FROM Job WHERE JobId = ?", (job_id,)).fetchone()
+        return row is None or bool(row[0])
+
+    def register_request(self, session_id: str, output: str, submitted: float) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT Submitted FROM Request WHERE Session = ? AND Output = ?", (session_id, output)
+            ).fetchone()
+            if row is not None and row[0] < submitted:
+                self._count(conn, "superseded")
+            conn.execute(
+                "INSERT INTO Request (Session, Output, Submitted) VALUES (?, ?, ?) "
+                "ON CONFLICT(Session, Output) DO UPDATE SET Submitted = MAX(Submitted, excluded.Submitted)",
+                (session_id, output, submitted)
+            )
+
+    def is_superseded(self, session_id: str, output: str, submitted: float) -> bool:
+        row = self._connection().execute(
+            "SELECT Submitted FROM Request WHERE Session = ? AND Output = ?", (session_id, output)
+        ).fetchone()
+        return row is not None and row[0] > submitted
+
+    def count_stop(self, name: str, stage: str, seconds: float) -> None:
+        """Count a request stopped at `stage` after `seconds` of work."""
+        conn = self._connection()
+        with conn:
+            self._count(conn, f"stopped:{name}")
+            self._count(conn, f"stopped:{name}:{stage or 'start'}")
+            self._count(conn, f"stopped_ms:{name}", int(1000 * seconds))
+
+    def count_completed(self, name: str, seconds: float) -> None:
+        """Count a request that ran to the end in `seconds`."""
+        conn = self._connection()
+        with conn:
+            self._count(conn, f"completed:{name}")
+            self._count(conn, f"completed_ms:{name}", int(1000 * seconds))
+
+    def update_job(self, job_id: str, **columns) -> None:
+        assignments = ", ".join(f"{name} = ?" for name in columns)
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                f"UPDATE Job SET {assignments}, Updated = ? WHERE JobId = ?",
+                (*columns.values(), time.time(), job_id)
+            )
+
+    def _finish(self, job_id: str, state: str, result) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "UPDATE Job SET State = ?, Result = ?, Updated = ? WHERE JobId = ?",
+                (state, None if result is None else pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL),
+                 time.time(), job_id)
+            )
+            if state == "done":
+                self._count(conn, "completed")
+
+    def run_job(self, job_id: str, fn, progress: bool, args, context: dict) -> None:
+        """Run a callback as job `job_id` and store its outcome, unless it was cancelled first."""
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            started = conn.execute(
+                "UPDATE Job SET State = 'running', Pid = ?, Updated = ? "
+                "WHERE JobId = ? AND State = 'queued' AND Cancelled = 0",
+                (os.getpid(), time.time(), job_id)
+            ).rowcount
+        name, submitted = conn.execute("SELECT Name, Created FROM Job WHERE JobId = ?", (job_id,)).fetchone() \
+            or ("", time.time())
+        if not started:
+            self._finish(job_id, "cancelled", None)
+            with conn:
+                self._count(conn, f"skipped:{name}")
+            return
+
+        job = _RunningJob(self, job_id, name, submitted)
+
+        def run():
+            callback_context = AttributeDict(**context)
+            callback_context.ignore_register_page = False
+            callback_context.updated_props = ProxySetProps(job.set_props)
+            context_value.set(callback_context)
+            _current_job.set(job)
+            maybe_progress = [job.set_progress] if progress else []
+            try:
+                if isinstance(args, dict):
+                    output = fn(*maybe_progress, **args)
+                elif isinstance(args, (list, tuple)):
+                    output = fn(*maybe_progress, *args)
+                else:
+                    output = fn(*maybe_progress, args)
+            except JobCancelled as cancelled:
+                self.count_stop(name, cancelled.stage, time.time() - job.started)
+                if self.is_cancelled(job_id):
+                    self._finish(job_id, "cancelled", None)
+                else:
+                    # Superseded by a newer request; a browser still polling gets no update
+                    self.update_job(job_id, State="done", Result=pickle.dumps(_NO_UPDATE))
+                return
+            except PreventUpdate:
+                output = _NO_UPDATE
+            except Exception as err:  # pylint: disable=broad-except
+                output = {"background_callback_error": {"msg": str(err), "tb": traceback.format_exc()}}
+            self._finish(job_id, "done", output)
+            self.count_completed(name, time.time() - job.started)
+
+        contextvars.copy_context().run(run)
+
+    def stats(self) -> dict:
+        """Job counters and the jobs currently queued or running, across all workers."""
+        conn = self._connection()
+        counters = dict(conn.execute("SELECT Name, Value FROM Counter").fetchall())
+        states = dict(conn.execute("SELECT State, COUNT(*) FROM Job GROUP BY State").fetchall())
+        return {
+            "submitted": counters.get("submitted", 0),
+            "deduplicated": counters.get("deduplicated", 0),
+            "completed": counters.get("completed", 0),
+            "cancelled": counters.get("cancelled", 0),
+            "superseded": counters.get("superseded", 0),
+            "queued": states.get("queued", 0),
+            "running": states.get("running", 0),
+            "workers": self.workers,
+            "callbacks": self._callback_stats(counters),
+        }
+
+    @staticmethod
+    def _callback_stats(counters: dict) -> dict:
+        """
+        Per-callback outcomes: jobs completed, skipped before starting and
+        stopped at a checkpoint (by stage), with the seconds they used. The
+        work saved is estimated from the mean time of a completed job.
+        """
+        names = {name.split(":")[1] for name in counters
+                 if name.startswith(("completed:", "skipped:", "stopped:"))}
+        callbacks = {}
+        for name in sorted(names):
+            completed = counters.get(f"completed:{name}", 0)
+            skipped = counters.get(f"skipped:{name}", 0)
+            stopped = counters.get(f"stopped:{name}", 0)
+            mean = counters.get(f"completed_ms:{name}", 0) / 1000 / completed if completed else 0.0
+            used = counters.get(f"stopped_ms:{name}", 0) / 1000
+            prefix = f"stopped:{name}:"
+            callbacks[name] = {
+                "completed": completed,
+                "mean_seconds": round(mean, 3),
+                "skipped": skipped,
+                "stopped": stopped,
+                "stopped_at": {key[len(prefix):]: value for key, value in counters.items()
+                               if key.startswith(prefix)},
+                "seconds_before_stop": round(used, 3),
+                "estimated_seconds_saved": round(max((skipped + stopped) * mean - used, 0.0), 3),
+            }
+        return callbacks
+
+
+job_manager = LocalJobManager(os.path.join(CACHE_DIR, "jobs.sqlite"), BACKGROUND_WORKERS)
+
+analysis_job_manager = LocalJobManager(os.path.join(CACHE_DIR, "analysis_jobs.sqlite"), BACKGROUND_ANALYSIS_WORKERS)
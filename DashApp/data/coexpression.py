@@ -0,0 +1,246 @@
+"""
+Genes whose expression follows a chosen gene across the selected samples.
+
+Every gene is scored against the query gene in one sweep over the expression
+matrix: the matrix columns for the selected samples are transformed (log2 or
+ranks) and centred per gene, and the correlations of a block of genes are then
+one matrix-vector product with the centred query instead of one pearsonr call
+per gene. Samples without a value for a gene are left out of that gene's
+correlation only, as when two genes are compared directly. (For Spearman the
+query gene keeps its ranks over all selected samples, so such genes' rank
+correlations are a close approximation rather than exact.)
+
+Spearman ranks come from the matrix's stored sort index when it has one: a
+gene's ranks among the selected samples are the running count of selected
+samples along its stored order, which is linear in the number of samples
+instead of a sort of every row on every request.
+"""
+import numpy as np
+import pandas as pd
+
+from data.background_jobs import checkpoint
+from data.expression_matrix import get_expression_matrix
+from data.pair_stats import average_ranks, correlation_pvalue
+from data.result_cache import result_cache
+from data.sample_metadata import sample_mask
+
+# Correlation measures offered, by the value each is computed on
+COEXPRESSION_METHODS = {
+    "pearson_log2": "Pearson, log2(TPM+1)",
+    "pearson": "Pearson, TPM",
+    "spearman": "Spearman",
+}
+
+# Genes scored per block, bounding the memory used by the transformed copy
+COEXPRESSION_BLOCK_ROWS = 4096
+
+# Genes ranked per block from the stored sort index, kept small enough for
+# the block's temporaries to stay in cache
+RANK_BLOCK_ROWS = 1024
+
+# Fewest shared samples for a gene to be scored
+MIN_SHARED_SAMPLES = 3
+
+
+def _prepare(matrix, start: int, stop: int, samples: np.ndarray, method: str) -> tuple:
+    """
+    Matrix rows start:stop over the given samples, transformed for the method.
+    Returns:
+        Tuple of (block with missing entries set to 0, flat indices of those entries)
+    """
+    block = np.take(matrix.tpm[start:stop], samples, axis=1)
+    missing = np.flatnonzero(np.isnan(block))
+    block.flat[missing] = 0
+    return _transform(block, missing, method), missing
+
+
+def _transform(block: np.ndarray, missing: np.ndarray, method: str) -> np.ndarray:
+    # Transform values in place for the method, keeping missing entries at 0
+    if method == "pearson_log2":
+        # log2(x + 1) is log1p(x) scaled, which leaves correlations unchanged
+        return np.log1p(block, out=block)
+    if method == "spearman":
+        # NaN sorts last, so present values get ranks 1..n of their own
+        block.flat[missing] = np.nan
+        ranks = average_ranks(block).astype(block.dtype)
+        ranks.flat[missing] = 0
+        return ranks
+    return block
+
+
+def correlate_rows(block: np.ndarray, missing: np.ndarray, query: np.ndarray) -> tuple:
+    """
+    Pearson correlation of each row of `block` with `query`.
+    Args:
+        block: float array of shape (genes, samples), 0 where missing;
+            overwritten with its centred values
+        missing: Flat indices of the missing entries
+        query: float array of shape (samples,) without missing values
+    Returns:
+        Tuple of (correlation, number of shared samples) per row
+    """
+    n_rows, n_samples = block.shape
+    missing_rows, missing_columns = np.divmod(missing, n_samples)
+    counts = n_samples - np.bincount(missing_rows, minlength=n_rows)
+
+    # Centre each gene on the mean of its own samples, keeping missing ones at
+    # 0; the rows then sum to 0, so the products need no query mean correction
+    means = block.sum(axis=1, dtype=np.float64) / np.maximum(counts, 1)
+    block -= means.astype(block.dtype)[:, None]
+    block.flat[missing] = 0
+    query = query - query.mean()
+    products = block @ query.astype(block.dtype)
+    sum_squares = np.einsum("ij,ij->i", block, block)
+
+    # The query's spread over just the samples each gene has values for
+    query_sum = -np.bincount(missing_rows, weights=query[missing_columns], minlength=n_rows)
+    query_squares = query @ query - np.bincount(missing_rows, weights=query[missing_columns] ** 2,
+                                                minlength=n_rows)
+    query_squares -= query_sum ** 2 / np.maximum(counts, 1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correlation = products / np.sqrt(sum_squares * query_squares)
+    correlation = np.clip(correlation, -1.0, 1.0)
+    correlation[counts < MIN_SHARED_SAMPLES] = np.nan
+    return correlation, counts
+
+
+def _squares_to(n: np.ndarray) -> np.ndarray:
+    # Sum of k^2 for k = 1..n
+    return n * (n + 1) * (2 * n + 1) / 6
+
+
+def correlate_ranks(order: np.ndarray, ties: np.ndarray, query: np.ndarray) -> tuple:
+    """
+    Spearman correlation of each row with the query, from the rows' sort index.
+
+    A row's ranks among the selected samples it has values for are the running
+    count of those samples along its order; runs of equal values are then
+    given their average rank, at a cost proportional to their length.
+    Args:
+        order: Rows of ExpressionMatrix.order
+        ties: Runs of equal values in `order`, as (row within `order`, start, stop)
+        query: float32 array of shape (samples + 1,) holding the query's ranks
+            at the selected samples and 0 elsewhere, including the last entry
+            (the missing values' place in `order`)
+    Returns:
+        Tuple of (correlation, number of shared samples) per row
+    """
+    n_rows, n_samples = order.shape
+    values = query[order]
+    # Counting down the samples axis of the transposed view adds a whole row
+    # of counts at a time. Ranks fit the order's own integer type, and sums of
+    # products of ranks and query ranks (whole or half numbers) are exact
+    ranks = np.cumsum(values.T > 0, axis=0, dtype=order.dtype).T
+    counts = ranks[:, -1].astype(np.int64)
+    n = counts.astype(np.float64)
+    rank_squares = _squares_to(n)
+    products = np.einsum("ij,ij->i", ranks, values, dtype=np.float64)
+    if len(ties):
+        # Each run is a contiguous slice of its row. Its selected samples take
+        # the average of the ranks they were counted at: swap their sum of
+        # rank x query rank, and of squared ranks, for that average's
+        rows, starts, stops = ties.T
+        lengths = stops - starts
+        first = rows * n_samples + starts
+        offsets = np.cumsum(lengths) - lengths
+        elements = np.repeat(first - offsets, lengths) + np.arange(lengths.sum())
+        flat_ranks = ranks.ravel()
+        run_values = values.ravel()[elements].astype(np.float64)
+        run_sum = np.add.reduceat(run_values, offsets)
+        run_weighted = np.add.reduceat(flat_ranks[elements] * run_values, offsets)
+        before = flat_ranks[first].astype(np.float64) - (run_values[offsets] > 0)
+        last = flat_ranks[first + lengths - 1].astype(np.float64)
+        in_run = last - before
+        average = before + (in_run + 1) / 2
+        products += np.bincount(rows, weights=average * run_sum - run_weighted, minlength=n_rows)
+        rank_squares += np.bincount(rows, weights=in_run * average ** 2
+                                    - (_squares_to(last) - _squares_to(before)), minlength=n_rows)
+
+    # The query's spread over just the samples each row has values for
+    query_sum = values.sum(axis=1, dtype=np.float64)
+    query_squares = np.einsum("ij,ij->i", values, values, dtype=np.float64)
+    mean_rank = (n + 1) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = products - mean_rank * query_sum
+        rank_spread = rank_squares - n * mean_rank ** 2
+        query_spread = query_squares - query_sum ** 2 / np.maximum(n, 1)
+        correlation = covariance / np.sqrt(rank_spread * query_spread)
+    correlation = np.clip(correlation, -1.0, 1.0)
+    correlation[counts < MIN_SHARED_SAMPLES] = np.nan
+    return correlation, counts
+
+
+def score_genes(matrix, gene_row: int, samples: np.ndarray, method: str, top: int) -> pd.DataFrame:
+    """
+    Rank every gene of an expression matrix by correlation with one of its rows.
+    Args:
+        matrix: ExpressionMatrix
+        gene_row: Matrix row of the query gene
+        samples: Sample columns to use, all with a value for the query gene
+        method: Key of COEXPRESSION_METHODS
+        top: Number of genes to return
+    Returns:
+        DataFrame with GeneName, Correlation, PValue and Samples columns,
+        strongest first
+    """
+    query = _prepare(matrix, gene_row, gene_row + 1, samples, method)[0][0].astype(np.float64)
+    ranked = method == "spearman" and matrix.order is not None
+    if ranked:
+        # Query ranks at the selected samples, 0 at the others and at the missing entry
+        query_ranks = np.zeros(matrix.order.shape[1] + 1, dtype=np.float32)
+        query_ranks[samples] = query
+    block_rows = RANK_BLOCK_ROWS if ranked else COEXPRESSION_BLOCK_ROWS
+    n_genes = len(matrix.genes)
+    correlation = np.empty(n_genes)
+    counts = np.empty(n_genes, dtype=np.int64)
+    for start in range(0, n_genes, block_rows):
+        # A cancelled or superseded request stops between blocks
+        checkpoint("correlation")
+        stop = min(start + block_rows, n_genes)
+        if ranked:
+            ties = matrix.ties[slice(*np.searchsorted(matrix.ties[:, 0], [start, stop]))]
+            ties = ties - np.array([start, 0, 0])
+            correlation[start:stop], counts[start:stop] = correlate_ranks(
+                matrix.order[start:stop], ties, query_ranks)
+        else:
+            block, missing = _prepare(matrix, start, stop, samples, method)
+            correlation[start:stop], counts[start:stop] = correlate_rows(block, missing, query)
+    correlation[gene_row] = np.nan
+
+    scored = np.flatnonzero(~np.isnan(correlation))
+    top = min(top, len(scored))
+    best = scored[np.argpartition(-correlation[scored], top - 1)[:top]] if top else scored[:0]
+    best = best[np.argsort(-correlation[best], kind="stable")]
+    return pd.DataFrame({
+        "GeneName": np.asarray(matrix.genes[best], dtype=object),
+        "Correlation": correlation[best],
+        "PValue": correlation_pvalue(correlation[best], counts[best]),
+        "Samples": counts[best],
+    })
+
+
+@result_cache.memoize("coexpression")
+def top_coexpressed(gene: str, datasets: tuple, ter_threshold: float = 0,
+                    method: str = "pearson_log2", top: int = 25) -> pd.DataFrame:
+    """
+    Genes most positively correlated with `gene` over the selected samples.
+    Args:
+        gene: Query gene name
+        datasets: Dataset names to include
+        ter_threshold: Only use samples with TER above this value (0 uses all)
+        method: Key of COEXPRESSION_METHODS
+        top: Number of genes to return
+    Returns:
+        DataFrame as from score_genes, empty if the gene has too few values
+        in the selection
+    """
+    matrix = get_expression_matrix()
+    rows = matrix.gene_rows((gene,))
+    samples = np.empty(0, dtype=np.int64)
+    if len(rows):
+        has_value = ~np.isnan(np.asarray(matrix.tpm[rows[0]]))
+        samples = np.flatnonzero(sample_mask(datasets, ter_threshold) & has_value)
+    if len(samples) < MIN_SHARED_SAMPLES:
+        return pd.DataFrame({"GeneName": [], "Correlation": [], "PValue": [], "Samples": []})
+    return score_genes(matrix, rows[0], samples, method, top)
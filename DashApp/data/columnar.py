@@ -0,0 +1,39 @@
+"""
+Compact columnar encoding of fetched rows for browser-side stores.
+
+Numeric arrays are sent as base64 little-endian buffers, in the same
+{"dtype", "bdata"} form Plotly uses for typed arrays, and categorical columns
+as their categories plus integer codes (-1 for null). The browser decodes
+them back into typed arrays (see assets/expression_plot.js).
+"""
+import base64
+
+import numpy as np
+import pandas as pd
+
+
+def encode_array(values: np.ndarray) -> dict:
+    """Encode a numeric array as a base64 typed-array spec."""
+    values = np.ascontiguousarray(values)
+    values = values.astype(values.dtype.newbyteorder("<"), copy=False)
+    return {"dtype": values.dtype.str[1:], "bdata": base64.b64encode(values.tobytes()).decode("ascii")}
+
+
+def encode_column(column: pd.Series) -> dict:
+    """
+    Encode one column.
+    Returns:
+        {"categories": [...], "codes": array} for categorical columns,
+        {"values": array} (float64, NaN for null) otherwise
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return {
+            "categories": column.cat.categories.tolist(),
+            "codes": encode_array(column.cat.codes.to_numpy()),
+        }
+    return {"values": encode_array(column.to_numpy(dtype=np.float64, na_value=np.nan))}
+
+
+def encode_frame(data: pd.DataFrame, columns) -> dict:
+    """Encode the given columns of a DataFrame, keyed by column name."""
+    return {column: encode_column(data[column]) for column in columns}
@@ -0,0 +1,214 @@
+"""
+Differential expression between two groups of samples, for every gene.
+
+Groups are defined by a sample metadata column (e.g. TissueName = Bladder
+versus TissueName = Ureter) within the selected datasets and TER threshold.
+Genes are processed in blocks of the expression matrix with the two groups'
+columns side by side, and every statistic is a reduction along the sample
+axis: per-group means and variances give the log2 fold change and Welch's t
+test, and one rank transform of the block gives the Mann-Whitney U test.
+Missing values are left out of a gene's statistics only. p-values follow
+scipy.stats.ttest_ind(equal_var=False) and, for U, scipy.stats.mannwhitneyu
+with its normal approximation (tie and continuity corrected); both are then
+adjusted with Benjamini-Hochberg.
+"""
+import numpy as np
+import pandas as pd
+from scipy import special
+
+from data.background_jobs import checkpoint
+from data.expression_matrix import get_expression_matrix
+from data.result_cache import result_cache
+from data.sample_metadata import get_sample_metadata, sample_mask
+
+# Sample metadata columns groups can be defined on, with their labels
+DIFFERENTIAL_COLUMNS = {
+    "TissueName": "Tissue",
+    "NhuDifferentiation": "NHU",
+    "SubstrateType": "Substrate",
+    "Gender": "Gender",
+    "Stage": "Tumor Stage",
+    "Status": "Vital Status",
+    "SubsetName": "Dataset Subset",
+    "DatasetName": "Dataset",
+}
+
+# Tests offered, with the result columns holding their p-values
+DIFFERENTIAL_TESTS = {
+    "welch": {"label": "Welch's t-test", "p": "TPValue", "adjusted": "TAdjusted"},
+    "mann_whitney": {"label": "Mann-Whitney U", "p": "UPValue", "adjusted": "UAdjusted"},
+}
+
+# Genes tested per block, bounding the memory used by the ranked copy
+DIFFERENTIAL_BLOCK_ROWS = 4096
+
+# Fewest samples with a value in each group for a gene to be tested
+MIN_GROUP_SAMPLES = 2
+
+
+def group_values(column: str, datasets: tuple, ter_threshold: float = 0) -> pd.Series:
+    """Number of selected samples with each value of `column`, by value."""
+    samples = get_sample_metadata()
+    values = samples[column][sample_mask(datasets, ter_threshold)]
+    counts = values.value_counts(sort=False)
+    return counts[counts > 0].sort_index()
+
+
+def group_samples(column: str, value: str, datasets: tuple, ter_threshold: float = 0) -> np.ndarray:
+    """SampleIndex of the selected samples whose `column` equals `value`."""
+    samples = get_sample_metadata()
+    mask = sample_mask(datasets, ter_threshold) & (samples[column] == value).to_numpy()
+    return np.flatnonzero(mask)
+
+
+def benjamini_hochberg(p_values: np.ndarray) -> np.ndarray:
+    """Benjamini-Hochberg adjusted p-values; NaN entries stay NaN and are not counted."""
+    adjusted = np.full(len(p_values), np.nan)
+    tested = np.flatnonzero(~np.isnan(p_values))
+    order = tested[np.argsort(p_values[tested], kind="stable")]
+    scaled = p_values[order] * len(order) / np.arange(1, len(order) + 1)
+    adjusted[order] = np.minimum(np.minimum.accumulate(scaled[::-1])[::-1], 1.0)
+    return adjusted
+
+
+def _rank_sums(values: np.ndarray, n_first: int) -> tuple:
+    """
+    Rank statistics of each row, from a single sort of the row.
+    Args:
+        values: float array of shape (genes, samples), NaN where missing
+        n_first: Number of leading columns whose ranks are summed
+    Returns:
+        Tuple of (sum of the average ranks of the first n_first columns,
+        sum of t^3 - t over runs of t tied values) per row
+    """
+    n_rows, n = values.shape
+    # Missing values sort last as +inf (sorting is much slower with NaN), so
+    # the present values of a row take its first `present` sorted positions
+    missing = np.isnan(values)
+    present = n - np.count_nonzero(missing, axis=1)
+    values = np.where(missing, np.inf, values)
+    order = np.argsort(values, axis=1)
+    ordered = np.take_along_axis(values, order, axis=1)
+    position = np.arange(n)
+    is_missing = position >= present[:, None]
+
+    # Runs of equal values, numbered across all rows; missing values form runs
+    # of one, which add nothing to the tie term
+    starts_run = np.ones((n_rows, n), dtype=bool)
+    starts_run[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    starts_run |= is_missing
+    run = np.cumsum(starts_run.ravel()) - 1
+    run_sizes = np.bincount(run).astype(np.float64)
+    run_rank = np.tile(position, n_rows)[starts_run.ravel()] + (run_sizes + 1) / 2
+    run_row = np.repeat(np.arange(n_rows), n)[starts_run.ravel()]
+    ties = np.bincount(run_row, weights=run_sizes ** 3 - run_sizes, minlength=n_rows)
+
+    in_first = (order < n_first) & ~is_missing
+    rank_sum = np.where(in_first, run_rank[run].reshape(n_rows, n), 0).sum(axis=1)
+    return rank_sum, ties
+
+
+def _log2_moments(tpm: np.ndarray) -> tuple:
+    # Count, mean and sample variance of each row's present log2(TPM + 1) values
+    values = tpm.astype(np.float64)
+    missing = np.flatnonzero(np.isnan(values))
+    values.flat[missing] = 0
+    values += 1
+    np.log2(values, out=values)
+    count = values.shape[1] - np.bincount(missing // values.shape[1], minlength=len(values))
+    mean = values.sum(axis=1) / count
+    values -= mean[:, None]
+    values.flat[missing] = 0
+    return count, mean, np.einsum("ij,ij->i", values, values) / (count - 1)
+
+
+def compare_block(tpm: np.ndarray, n_a: int) -> dict:
+    """
+    Test each row's group A values against its group B values.
+    Args:
+        tpm: TPM array of shape (genes, samples), NaN where missing, with
+            the n_a group A samples first and the group B samples after them
+        n_a: Number of group A samples
+    Returns:
+        Dict of per-gene arrays: MeanA, MeanB (of log2(TPM + 1)),
+        Log2FoldChange, TStatistic, TPValue, UStatistic, UPValue, CountA, CountB
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        count_a, mean_a, var_a = _log2_moments(tpm[:, :n_a])
+        count_b, mean_b, var_b = _log2_moments(tpm[:, n_a:])
+        tested = (count_a >= MIN_GROUP_SAMPLES) & (count_b >= MIN_GROUP_SAMPLES)
+
+        # Welch's t test with the Welch-Satterthwaite degrees of freedom
+        se_a, se_b = var_a / count_a, var_b / count_b
+        t = (mean_a - mean_b) / np.sqrt(se_a + se_b)
+        df = (se_a + se_b) ** 2 / (se_a ** 2 / (count_a - 1) + se_b ** 2 / (count_b - 1))
+        t_p = 2 * special.stdtr(df, -np.abs(t))
+
+        # Mann-Whitney U from the rank sum of A within A and B together; log2
+        # keeps the order of the values, so TPM is ranked directly
+        rank_sum_a, ties = _rank_sums(tpm, n_a)
+        u = rank_sum_a - count_a * (count_a + 1) / 2
+        n = count_a + count_b
+        expected = count_a * count_b / 2
+        spread = np.sqrt(count_a * count_b / 12 * ((n + 1) - ties / (n * (n - 1))))
+        z = (np.abs(u - expected) - 0.5) / spread
+        u_p = np.minimum(2 * special.ndtr(-z), 1.0)
+
+    t_p[~tested | ~np.isfinite(t)] = np.nan
+    u_p[~tested | ~(spread > 0)] = np.nan
+    return {
+        "MeanA": mean_a,
+        "MeanB": mean_b,
+        "Log2FoldChange": mean_a - mean_b,
+        "TStatistic": np.where(tested, t, np.nan),
+        "TPValue": t_p,
+        "UStatistic": np.where(tested, u, np.nan),
+        "UPValue": u_p,
+        "CountA": count_a,
+        "CountB": count_b,
+    }
+
+
+def differential_expression_for(matrix, samples_a: np.ndarray, samples_b: np.ndarray) -> pd.DataFrame:
+    """
+    Compare two sample groups for every gene of an expression matrix.
+    Returns:
+        DataFrame with GeneName, the compare_block columns and TAdjusted /
+        UAdjusted (Benjamini-Hochberg), one row per gene tested
+    """
+    samples = np.concatenate([samples_a, samples_b])
+    blocks = []
+    n_genes = len(matrix.genes)
+    for start in range(0, n_genes, DIFFERENTIAL_BLOCK_ROWS):
+        # A cancelled or superseded request stops between blocks
+        checkpoint("tests")
+        rows = matrix.tpm[start:min(start + DIFFERENTIAL_BLOCK_ROWS, n_genes)]
+        blocks.append(pd.DataFrame(compare_block(np.take(rows, samples, axis=1), len(samples_a))))
+    results = pd.concat(blocks, ignore_index=True)
+    results.insert(0, "GeneName", np.asarray(matrix.genes, dtype=object))
+    results = results[results["TPValue"].notna() | results["UPValue"].notna()].reset_index(drop=True)
+    results["TAdjusted"] = benjamini_hochberg(results["TPValue"].to_numpy())
+    results["UAdjusted"] = benjamini_hochberg(results["UPValue"].to_numpy())
+    return results
+
+
+@result_cache.memoize("differential-expression")
+def differential_expression(column: str, value_a: str, value_b: str, datasets: tuple,
+                            ter_threshold: float = 0) -> pd.DataFrame:
+    """
+    Differential expression of every gene between two groups of samples.
+    Args:
+        column: Sample metadata column defining the groups (a key of DIFFERENTIAL_COLUMNS)
+        value_a: Value of `column` for group A
+        value_b: Value of `column` for group B
+        datasets: Dataset names to draw samples from
+        ter_threshold: Only use samples with TER above this value (0 uses all)
+    Returns:
+        DataFrame as from differential_expression_for (log2 fold change is
+        A over B), empty if either group has too few samples
+    """
+    samples_a = group_samples(column, value_a, datasets, ter_threshold)
+    samples_b = group_samples(column, value_b, datasets, ter_threshold)
+    if len(samples_a) < MIN_GROUP_SAMPLES or len(samples_b) < MIN_GROUP_SAMPLES:
+        return pd.DataFrame({"GeneName": []})
+    return differential_expression_for(get_expression_matrix(), samples_a, samples_b)
@@ -0,0 +1,261 @@
+"""
+Dense, memory-mapped gene x sample TPM matrix.
+
+The long GeneExpression table is pivoted once into a float32 `.npy` sidecar
+stored next to the SQLite file. Every worker memory-maps the same file, so the
+matrix pages are shared through the OS page cache and a gene lookup becomes a
+row index plus a column mask instead of a SQL join.
+
+The sidecar is built ahead of time: by db-generation/build_database.sh once
+a new database is published, and at container start before gunicorn forks
+(`python -m data.expression_matrix`). A worker only builds it itself, on
+first use, if neither has run for the current database.
+
+Alongside the values, the sidecar stores every gene's samples in ascending
+order of expression and the runs of equal values in that order, so rank
+statistics over any selection of samples need no sorting at request time
+(see data.coexpression).
+
+Matrix columns are ordered by SampleKey, matching the row positions of the
+sample metadata table (see data.sample_metadata).
+"""
+import fcntl
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from db.connection import DATABASE_PATH, database_version, get_db_connection, per_database_version
+
+# Directory for the sidecar files; defaults to the database's own directory
+MATRIX_DIR = os.getenv('EXPRESSION_MATRIX_DIR')
+
+# Rows of GeneExpression read per chunk while building the sidecar
+BUILD_CHUNK_ROWS = 1_000_000
+
+# Genes sorted per chunk while building the sort index
+SORT_CHUNK_GENES = 4096
+
+# Layout of the sidecar files; older ones are rebuilt
+SIDECAR_FORMAT = 2
+
+
+class ExpressionMatrix:
+    """
+    Gene x sample TPM values.
+
+    Attributes:
+        genes: Index mapping gene name to matrix row
+        tpm: float32 array of shape (genes, samples), NaN where no value exists
+        order: Sort index of every row (see sort_index), or None if not built
+        ties: Runs of equal values in `order` (see sort_index), or None
+    """
+
+    def __init__(self, genes: pd.Index, tpm: np.ndarray, order: np.ndarray = None, ties: np.ndarray = None):
+        self.genes = genes
+        self.tpm = tpm
+        self.order = order
+        self.ties = ties
+
+    def gene_rows(self, genes) -> np.ndarray:
+        """Matrix rows for the given gene names, skipping unknown genes."""
+        rows = self.genes.get_indexer(list(genes))
+        return rows[rows >= 0]
+
+    def gene_slice(self, gene: str) -> pd.DataFrame:
+        """
+        Non-null TPM values of one gene across all samples.
+        Args:
+            gene: Gene name
+        Returns:
+            DataFrame with TPM and SampleIndex columns (empty for unknown genes)
+        """
+        return self.gene_slices((gene,))[0]
+
+    def gene_slices(self, genes) -> list:
+        """
+        Slices (as from gene_slice) of several genes, read in one gather of their rows.
+        Args:
+            genes: Gene names
+        Returns:
+            List of DataFrames with TPM and SampleIndex columns, in the order of `genes`
+        """
+        rows = self.genes.get_indexer(list(genes))
+        block = self.tpm[rows[rows >= 0]]
+        slices, position = [], 0
+        for row in rows:
+            if row < 0:
+                slices.append(pd.DataFrame({"TPM": np.empty(0), "SampleIndex": np.empty(0, dtype=np.int32)}))
+                continue
+            values = block[position]
+            position += 1
+            index = np.flatnonzero(~np.isnan(values)).astype(np.int32)
+            slices.append(pd.DataFrame({"TPM": values[index].astype(np.float64), "SampleIndex": index}))
+        return slices
+
+
+def sort_index(tpm: np.ndarray, first_row: int = 0) -> tuple:
+    """
+    Samples of each row in ascending order of value, and the runs of equal values.
+    Args:
+        tpm: Block of matrix rows
+        first_row: Matrix row of the block's first row
+    Returns:
+        Tuple of (order: the columns of each row by value, missing values last
+        and given as the number of columns; ties: int64 array of (row, start,
+        stop) for every run of two or more equal values in `order`)
+    """
+    n_samples = tpm.shape[1]
+    order = np.argsort(tpm, axis=1)
+    values = np.take_along_axis(tpm, order, axis=1)
+    order = order.astype(np.uint16 if n_samples < np.iinfo(np.uint16).max else np.uint32)
+    order[np.isnan(values)] = n_samples
+
+    # +1 where a run of equal neighbours starts and -1 past its end (NaN never equals)
+    equal = np.zeros((len(tpm), n_samples + 1), dtype=np.int8)
+    equal[:, 1:n_samples] = values[:, 1:] == values[:, :-1]
+    edges = np.diff(equal, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    stops = np.nonzero(edges == -1)[1] + 1
+    return order, np.column_stack([rows + first_row, starts, stops]).astype(np.int64)
+
+
+def _sidecar_paths() -> tuple:
+    directory = MATRIX_DIR or os.path.dirname(os.path.abspath(DATABASE_PATH))
+    stem = os.path.splitext(os.path.basename(DATABASE_PATH))[0]
+    base = os.path.join(directory, f"{stem}.expression")
+    return f"{base}.npy", f"{base}.json", f"{base}.lock"
+
+
+def _index_paths(npy_path: str) -> tuple:
+    base = npy_path[:-len(".npy")]
+    return f"{base}.order.npy", f"{base}.ties.npy"
+
+
+def _load_sidecar(npy_path: str) -> tuple:
+    """Memory maps of the matrix and its sort index, and the tie runs."""
+    order_path, ties_path = _index_paths(npy_path)
+    return np.load(npy_path, mmap_mode="r"), np.load(order_path, mmap_mode="r"), np.load(ties_path)
+
+
+def _fill_matrix(tpm: np.ndarray, gene_keys: pd.Index, sample_keys: pd.Index) -> None:
+    """Scatter every GeneExpression row into its (gene, sample) cell."""
+    tpm[:] = np.nan
+    query = "SELECT GeneKey, SampleKey, TPM FROM GeneExpression"
+    for chunk in pd.read_sql_query(query, get_db_connection(), chunksize=BUILD_CHUNK_ROWS):
+        rows = gene_keys.get_indexer(chunk["GeneKey"])
+        cols = sample_keys.get_indexer(chunk["SampleKey"])
+        known = (rows >= 0) & (cols >= 0)
+        tpm[rows[known], cols[known]] = chunk["TPM"].to_numpy()[known]
+
+
+def build_sidecar(version: str, gene_keys: pd.Index, sample_keys: pd.Index) -> tuple:
+    """
+    Write the TPM matrix sidecar and its sort index for the current database, and map them.
+
+    Workers serialise on a lock file, and every file is written under a
+    temporary name and renamed into place before the metadata, so a
+    half-written sidecar is never mapped.
+    Returns:
+        Tuple of (read-only memory maps of the matrix and its sort index, tie runs)
+    """
+    npy_path, meta_path, lock_path = _sidecar_paths()
+    order_path, ties_path = _index_paths(npy_path)
+    with open(lock_path, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if _sidecar_version(meta_path) != version:
+            suffix = f".{os.getpid()}.tmp.npy"
+            shape = (len(gene_keys), len(sample_keys))
+            tpm = np.lib.format.open_memmap(npy_path + suffix, mode="w+", dtype=np.float32, shape=shape)
+            _fill_matrix(tpm, gene_keys, sample_keys)
+            order, ties = None, []
+            for start in range(0, len(gene_keys), SORT_CHUNK_GENES):
+                block_order, block_ties = sort_index(tpm[start:start + SORT_CHUNK_GENES], start)
+                if order is None:
+                    order = np.lib.format.open_memmap(order_path + suffix, mode="w+",
+                                                      dtype=block_order.dtype, shape=shape)
+                order[start:start + len(block_order)] = block_order
+                ties.append(block_ties)
+            if order is None:
+                order = np.lib.format.open_memmap(order_path + suffix, mode="w+", dtype=np.uint16, shape=shape)
+            np.save(ties_path + suffix, np.concatenate(ties) if ties else np.empty((0, 3), dtype=np.int64))
+            for array in (tpm, order):
+                array.flush()
+            del tpm, order
+            for path in (npy_path, order_path, ties_path):
+                os.replace(path + suffix, path)
+            with open(meta_path, "w") as f:
+                json.dump({"version": version, "format": SIDECAR_FORMAT,
+                           "genes": len(gene_keys), "samples": len(sample_keys)}, f)
+            logging.info(f"Built expression matrix sidecar {npy_path}")
+    return _load_sidecar(npy_path)
+
+
+def _sidecar_version(meta_path: str):
+    """Database version the sidecar was built for, or None if absent or of another format."""
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta.get("version") if meta.get("format") == SIDECAR_FORMAT else None
+
+
+def _matrix_keys() -> tuple:
+    """Gene names, GeneKeys (matrix rows) and SampleKeys (matrix columns) of the current database."""
+    conn = get_db_connection()
+    gene_df = pd.read_sql_query("SELECT GeneKey, GeneName FROM Gene ORDER BY GeneKey", conn)
+    sample_df = pd.read_sql_query("SELECT SampleKey FROM Sample ORDER BY SampleKey", conn)
+    return pd.Index(gene_df["GeneName"]), pd.Index(gene_df["GeneKey"]), pd.Index(sample_df["SampleKey"])
+
+
+def prepare_sidecar() -> str:
+    """
+    Build the sidecar for the current database unless it is already up to date.
+    Returns:
+        Path of the matrix file
+    """
+    version = database_version()
+    npy_path, meta_path, _ = _sidecar_paths()
+    if _sidecar_version(meta_path) != version:
+        _, gene_keys, sample_keys = _matrix_keys()
+        build_sidecar(version, gene_keys, sample_keys)
+    return npy_path
+
+
+@per_database_version
+def get_expression_matrix() -> ExpressionMatrix:
+    """
+    Return the process-wide expression matrix for the current database,
+    building the sidecar if it is missing or stale (normally it has been
+    built beforehand, see prepare_sidecar).
+
+    Falls back to an in-process array when the sidecar directory is not
+    writable (e.g. a read-only volume mount).
+    """
+    version = database_version()
+    gene_names, gene_keys, sample_keys = _matrix_keys()
+
+    npy_path, meta_path, _ = _sidecar_paths()
+    if _sidecar_version(meta_path) == version:
+        tpm, order, ties = _load_sidecar(npy_path)
+    else:
+        logging.warning("Expression matrix sidecar missing or stale, building it on first use")
+        try:
+            tpm, order, ties = build_sidecar(version, gene_keys, sample_keys)
+        except OSError as e:
+            # Without the sort index, rank statistics sort the rows they use
+            logging.warning(f"Expression matrix sidecar unavailable ({e}), building in memory")
+            tpm = np.empty((len(gene_keys), len(sample_keys)), dtype=np.float32)
+            _fill_matrix(tpm, gene_keys, sample_keys)
+            order, ties = None, None
+
+    return ExpressionMatrix(gene_names, tpm, order, ties)
+
+
+if __name__ == "__main__":
+    # Build the sidecar ahead of the web workers: python -m data.expression_matrix
+    logging.basicConfig(level=logging.INFO)
+    print(prepare_sidecar())
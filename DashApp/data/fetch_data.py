@@ -1,64 +1,95 @@
+import numpy as np
 import pandas as pd
-from db.connection import get_db_connection
-from functools import lru_cache
+from data.background_jobs import checkpoint
+from data.expression_matrix import get_expression_matrix
+from data.result_cache import result_cache
+from data.sample_metadata import attach_metadata, sample_mask
 
-@lru_cache(maxsize=32)
-def fetch_gene_expression_data(selected_genes: tuple, selected_dataset: tuple) -> pd.DataFrame:
+# y-axis transforms applied to TPM values
+TRANSFORMS = {
+    'linear': lambda x: x,
+    'log10': lambda x: np.log10(x+1),
+    'log2': lambda x: np.log2(x+1)
+}
+
+@result_cache.memoize("fetch_gene_slice")
+def fetch_gene_slice(gene: str) -> pd.DataFrame:
+    """
+    Fetch one gene's expression across every sample.
+
+    This is the unit of caching: every dataset selection, TER threshold and
+    tab asking for the gene is served from the same entry. Samples are
+    referenced by SampleIndex only; metadata is attached after filtering.
+    Args:
+        gene: Gene name
+    Returns:
+        DataFrame with TPM and SampleIndex columns
+    """
+    return get_expression_matrix().gene_slice(gene)
+
+def fetch_gene_slices(genes: list) -> list:
+    """
+    Fetch several genes' slices at once, sharing fetch_gene_slice's cache entries.
+
+    Cached genes are read in one cache query; the rest are gathered from the
+    expression matrix together and stored for later single- or multi-gene
+    requests.
+    Args:
+        genes: Gene names
+    Returns:
+        List of DataFrames with TPM and SampleIndex columns, in the order of `genes`
+    """
+    keys = [result_cache.make_key("fetch_gene_slice", gene) for gene in genes]
+    cached = result_cache.get_many(keys)
+    missing = [gene for gene, key in zip(genes, keys) if key not in cached]
+    if missing:
+        for gene, gene_slice in zip(missing, get_expression_matrix().gene_slices(missing)):
+            key = result_cache.make_key("fetch_gene_slice", gene)
+            result_cache.set(key, gene_slice)
+            cached[key] = gene_slice
+    return [cached[key] for key in keys]
+
+def fetch_gene_expression_data(selected_genes: tuple, selected_dataset: tuple,
+                               ter_threshold: float = 0, y_transform: str = 'linear',
+                               required_columns: tuple = ('TPM',)) -> pd.DataFrame:
     """
-    Fetch gene expression data with LRU caching.
+    Fetch plottable gene expression data, filtered in memory from cached
+    per-gene slices (see fetch_gene_slices).
+
+    All filters are combined into one mask, so the result is the only copy
+    made of the cached data. Text metadata columns are categorical and share
+    their categories with the process-wide sample table.
     Args:
         selected_genes: Tuple of gene names
         selected_dataset: Tuple of dataset names
+        ter_threshold: Only keep samples with TER above this value (0 keeps all)
+        y_transform: Key of TRANSFORMS applied to TPM
+        required_columns: Columns that must be non-null for a row to be kept
     Returns:
         DataFrame containing gene expression data
     """
-    conn = get_db_connection()
-    try:
-        query = """
-            SELECT 
-                ge.GeneName,
-                ge.TPM,
-                s.DatasetName,
-                s.SubsetName,
-                s.TissueName,
-                s.SubstrateType,
-                s.Gender,
-                s.Stage,
-                s.Status,
-                s.NhuDifferentiation,
-                s.SampleId,
-                s.TER
-            FROM GeneExpression ge
-            JOIN Sample s ON ge.SampleId = s.SampleId
-            WHERE ge.GeneName IN ({})
-            AND s.DatasetName IN ({})
-        """.format(
-            ', '.join(['?' for _ in selected_genes]),
-            ', '.join(['?' for _ in selected_dataset])
-        )
-        
-        # For large queries, use chunking
-        if len(selected_genes) * len(selected_dataset) > 1000:
-            chunks = []
-            for chunk in pd.read_sql_query(
-                query,
-                conn,
-                params=list(selected_genes) + list(selected_dataset),
-                chunksize=10000
-            ):
-                chunks.append(chunk)
-            df = pd.concat(chunks, ignore_index=True)
-        else:
-            df = pd.read_sql_query(
-                query,
-                conn,
-                params=list(selected_genes) + list(selected_dataset)
-            )
-        
-        return df
-    finally:
-        conn.close()
+    genes = list(dict.fromkeys(selected_genes))
+    slices = fetch_gene_slices(genes)
+    tpm = np.concatenate([s["TPM"].to_numpy() for s in slices])
+    sample_index = np.concatenate([s["SampleIndex"].to_numpy() for s in slices])
+    gene_codes = np.repeat(np.arange(len(genes), dtype=np.int16), [len(s) for s in slices])
+    # A cancelled or superseded request stops between stages
+    checkpoint("fetch")
+
+    # TPM is never null in a slice; every other filter is a per-sample property
+    keep_samples = sample_mask(
+        selected_dataset, ter_threshold, [c for c in required_columns if c != 'TPM']
+    )
+    mask = keep_samples[sample_index]
+    checkpoint("filter")
+
+    data = pd.DataFrame({
+        'GeneName': pd.Categorical.from_codes(gene_codes[mask], categories=genes),
+        'TPM': TRANSFORMS[y_transform](tpm[mask]),
+        'SampleIndex': sample_index[mask],
+    })
+    return attach_metadata(data)
 
-# Helper function to clear the LRU cache
+# Helper function to clear cached expression data
 def clear_cache() -> None:
-    fetch_gene_expression_data.cache_clear()
+    fetch_gene_slice.cache_clear()
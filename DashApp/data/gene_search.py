@@ -0,0 +1,59 @@
+"""
+Server-side gene name search for the gene dropdowns.
+
+The gene list is held once per worker as a case-folded sorted array, so a
+prefix search is two binary searches. Substring matches are only scanned for
+when there are not enough prefix matches to fill the result.
+"""
+from bisect import bisect_left
+
+from data.fetch_names import fetch_gene_names
+from db.connection import per_database_version
+
+# Number of suggestions returned to a dropdown
+SEARCH_LIMIT = 50
+
+
+class GeneIndex:
+    """Sorted, case-insensitive index over gene names."""
+
+    def __init__(self, names):
+        self.names = sorted(names, key=str.casefold)
+        self.keys = [name.casefold() for name in self.names]
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT) -> list:
+        """
+        Find genes matching a typed query.
+        Args:
+            query: Text typed by the user
+            limit: Maximum number of genes to return
+        Returns:
+            Gene names starting with the query (alphabetical, ignoring case),
+            followed by other names containing it
+        """
+        query = (query or "").strip().casefold()
+        if not query:
+            return []
+
+        start = bisect_left(self.keys, query)
+        end = bisect_left(self.keys, query + "\uffff")
+        matches = self.names[start:min(end, start + limit)]
+
+        if len(matches) < limit:
+            for key, name in zip(self.keys, self.names):
+                if query in key and not key.startswith(query):
+                    matches.append(name)
+                    if len(matches) == limit:
+                        break
+        return matches
+
+
+@per_database_version
+def get_gene_index() -> GeneIndex:
+    """Return the process-wide gene index for the current database."""
+    return GeneIndex(fetch_gene_names())
+
+
+def search_genes(query: str, limit: int = SEARCH_LIMIT) -> list:
+    """Gene names matching `query`, best matches first."""
+    return get_gene_index().search(query, limit)
@@ -0,0 +1,114 @@
+"""
+Per-group TPM summaries for the overview plot.
+
+Databases built by db-generation/data_upload.py carry a GeneGroupStats table
+with count, mean, min, quartiles and max of every gene per dataset and value
+of each grouping column, in linear and log2(TPM + 1) space. An overview plot
+is then one indexed range scan per gene, all genes read in one query.
+Selections the table cannot answer (a TER threshold, another x-axis column,
+or an older database) are summarised from the fetched rows with the same
+statistics.
+"""
+import numpy as np
+import pandas as pd
+
+from data.fetch_data import fetch_gene_expression_data
+from data.group_summary import GroupedValues
+from db.connection import get_db_connection, per_database_version
+
+# Sample metadata columns summarised at build time
+GROUP_COLUMNS = [
+    "DatasetName",
+    "SubsetName",
+    "TissueName",
+    "SubstrateType",
+    "Gender",
+    "Stage",
+    "Status",
+    "NhuDifferentiation",
+]
+
+# Statistics per group, in the order of the GeneGroupStats columns
+STAT_COLUMNS = ["Mean", "Min", "Q1", "Median", "Q3", "Max"]
+
+# Prefix of each y-axis transform's columns, and the factor applied to them
+# (log10(x + 1) is log2(x + 1) scaled, and so are its mean and quantiles)
+_TRANSFORM_COLUMNS = {
+    'linear': ("", 1.0),
+    'log2': ("Log2", 1.0),
+    'log10': ("Log2", np.log10(2)),
+}
+
+
+@per_database_version
+def has_group_stats() -> bool:
+    """Whether the current database has the GeneGroupStats table."""
+    row = get_db_connection().execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'GeneGroupStats'"
+    ).fetchone()
+    return row is not None
+
+
+def fetch_group_stats(genes: tuple, datasets: tuple, column: str, y_transform: str = 'linear') -> pd.DataFrame:
+    """
+    Read precomputed group statistics for a set of genes.
+    Args:
+        genes: Gene names
+        datasets: Dataset names to include
+        column: Grouping column (one of GROUP_COLUMNS)
+        y_transform: 'linear', 'log2' or 'log10'
+    Returns:
+        DataFrame with GeneName, DatasetName, GroupValue, SampleCount and STAT_COLUMNS
+    """
+    prefix, scale = _TRANSFORM_COLUMNS[y_transform]
+    selected = ", ".join(f"s.{prefix}{stat} AS {stat}" for stat in STAT_COLUMNS)
+    gene_placeholders = ", ".join("?" * len(genes))
+    placeholders = ", ".join("?" * len(datasets))
+    query = f"""
+        SELECT g.GeneName, s.DatasetName, s.GroupValue, s.SampleCount, {selected}
+        FROM GeneGroupStats s JOIN Gene g ON g.GeneKey = s.GeneKey
+        WHERE g.GeneName IN ({gene_placeholders}) AND s.GroupColumn = ? AND s.DatasetName IN ({placeholders})
+    """
+    stats = pd.read_sql_query(query, get_db_connection(), params=(*genes, column, *datasets))
+    stats[STAT_COLUMNS] *= scale
+    return stats
+
+
+def compute_group_stats(genes: tuple, datasets: tuple, column: str, ter_threshold: float = 0,
+                        y_transform: str = 'linear') -> pd.DataFrame:
+    """Same statistics as fetch_group_stats, computed from the expression rows."""
+    data = fetch_gene_expression_data(genes, datasets, ter_threshold, y_transform)
+    values = data[column]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype(object)
+    value_codes, value_labels = pd.factorize(values.fillna("Unknown"))
+    dataset_codes, dataset_labels = pd.factorize(data["DatasetName"])
+    gene_codes = data["GeneName"].cat.codes.to_numpy().astype(np.int64)
+    gene_labels = np.asarray(data["GeneName"].cat.categories, dtype=object)
+    n_values, n_datasets = len(value_labels), len(dataset_labels)
+
+    grouped = GroupedValues(data["TPM"].to_numpy(),
+                            (gene_codes * n_datasets + dataset_codes) * n_values + value_codes,
+                            len(gene_labels) * n_datasets * n_values)
+    box = grouped.box_stats()
+    groups = np.flatnonzero(box["count"])
+    return pd.DataFrame({
+        "GeneName": gene_labels[groups // (n_datasets * n_values)],
+        "DatasetName": np.asarray(dataset_labels, dtype=object)[groups // n_values % n_datasets],
+        "GroupValue": np.asarray(value_labels, dtype=object)[groups % n_values],
+        "SampleCount": box["count"][groups],
+        "Mean": box["mean"][groups],
+        "Min": box["min"][groups],
+        "Q1": box["q1"][groups],
+        "Median": box["median"][groups],
+        "Q3": box["q3"][groups],
+        "Max": box["max"][groups],
+    })
+
+
+def group_stats(genes: tuple, datasets: tuple, column: str, ter_threshold: float = 0,
+                y_transform: str = 'linear') -> pd.DataFrame:
+    """Group statistics of each gene for the overview plot, from the table where possible."""
+    if ter_threshold == 0 and column in GROUP_COLUMNS and has_group_stats():
+        return fetch_group_stats(genes, datasets, column, y_transform)
+    return compute_group_stats(genes, datasets, column, ter_threshold, y_transform)
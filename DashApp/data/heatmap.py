@@ -0,0 +1,126 @@
+"""
+Clustered expression heatmaps for lists of genes.
+
+All genes of a list are read in one slice of the expression matrix (their
+rows, then the selected sample columns), turned into per-gene z-scores of
+log2(TPM + 1), and ordered by average-linkage hierarchical clustering of the
+genes and/or the samples. Pairwise distances come from one matrix product
+and scipy's linkage builds the merge tree in compiled code; the distances
+cost about genes^2 x samples for the rows and samples^2 x genes for the
+columns.
+"""
+import os
+import re
+import time
+
+import numpy as np
+from scipy.cluster import hierarchy
+from scipy.spatial import distance
+
+from data.background_jobs import checkpoint
+from data.expression_matrix import get_expression_matrix
+from data.sample_metadata import sample_mask
+
+# Most genes a heatmap accepts
+HEATMAP_MAX_GENES = int(os.getenv('HEATMAP_MAX_GENES', 3000))
+
+# Most samples whose columns are clustered; larger selections keep sample order
+HEATMAP_MAX_CLUSTERED_SAMPLES = int(os.getenv('HEATMAP_MAX_CLUSTERED_SAMPLES', 5000))
+
+# z-scores are clipped to this range, which is also the colour scale's
+HEATMAP_Z_LIMIT = 3
+
+_GENE_SEPARATORS = re.compile(r"[\s,;]+")
+
+
+def parse_gene_list(text: str) -> list:
+    """Gene names in pasted text, separated by whitespace, commas or semicolons, without repeats."""
+    names = [name for name in _GENE_SEPARATORS.split(text or "") if name]
+    return list(dict.fromkeys(names))
+
+
+def resolve_genes(names: list) -> tuple:
+    """
+    Match gene names to the expression matrix, ignoring case when there is no exact match.
+    Returns:
+        Tuple of (matrix gene names found, in input order without repeats; names not found)
+    """
+    genes = get_expression_matrix().genes
+    upper = dict(zip(genes.str.upper(), genes))
+    found, missing = [], []
+    for name in names:
+        if name in genes:
+            found.append(name)
+        elif name.upper() in upper:
+            found.append(upper[name.upper()])
+        else:
+            missing.append(name)
+    return list(dict.fromkeys(found)), missing
+
+
+def zscores(tpm: np.ndarray) -> np.ndarray:
+    """Per-row z-scores of log2(TPM + 1), clipped to +/-HEATMAP_Z_LIMIT, with missing values at 0."""
+    values = np.log2(tpm.astype(np.float64) + 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values -= np.nanmean(values, axis=1, keepdims=True)
+        values /= np.nanstd(values, axis=1, keepdims=True)
+    values = np.nan_to_num(values, nan=0.0, posinf=0.0, neginf=0.0)
+    return np.clip(values, -HEATMAP_Z_LIMIT, HEATMAP_Z_LIMIT, out=values)
+
+
+def cluster_order(values: np.ndarray) -> np.ndarray:
+    """Leaf order of the average-linkage (Euclidean) clustering of the rows of `values`."""
+    if len(values) < 3:
+        return np.arange(len(values))
+    # Squared distances from one matrix product (BLAS) rather than pdist's pairwise loop
+    squared = np.einsum("ij,ij->i", values, values)
+    distances = squared[:, None] + squared[None, :] - 2 * values @ values.T
+    np.sqrt(np.maximum(distances, 0, out=distances), out=distances)
+    np.fill_diagonal(distances, 0)
+    condensed = distance.squareform(distances, checks=False)
+    return hierarchy.leaves_list(hierarchy.linkage(condensed, method="average"))
+
+
+def heatmap_matrix(genes: tuple, datasets: tuple, ter_threshold: float = 0,
+                   cluster_rows: bool = True, cluster_columns: bool = True) -> dict:
+    """
+    Clustered z-score matrix of a list of genes over the selected samples.
+    Args:
+        genes: Matrix gene names (see resolve_genes)
+        datasets: Dataset names to include
+        ter_threshold: Only use samples with TER above this value (0 uses all)
+        cluster_rows: Order the genes by clustering
+        cluster_columns: Order the samples by clustering (skipped above
+            HEATMAP_MAX_CLUSTERED_SAMPLES samples)
+    Returns:
+        Dict with the float32 z-scores ("z", genes x samples), the gene names
+        ("genes", in list order unless clustered) and SampleIndex ("samples")
+        in display order, whether the columns were clustered
+        ("columns_clustered") and the seconds spent fetching and clustering
+        ("timings")
+    """
+    start = time.perf_counter()
+    matrix = get_expression_matrix()
+    rows = matrix.gene_rows(genes)
+    samples = np.flatnonzero(sample_mask(datasets, ter_threshold))
+    tpm = np.take(matrix.tpm[rows], samples, axis=1)
+    gene_names = np.asarray(matrix.genes[rows], dtype=object)
+    fetched = time.perf_counter()
+
+    # A cancelled or superseded request stops before each clustering
+    checkpoint("fetch")
+    z = zscores(tpm)
+    row_order = cluster_order(z) if cluster_rows else np.arange(len(rows))
+    checkpoint("row clustering")
+    columns_clustered = cluster_columns and len(samples) <= HEATMAP_MAX_CLUSTERED_SAMPLES
+    column_order = cluster_order(z.T) if columns_clustered else np.arange(len(samples))
+    z = z[np.ix_(row_order, column_order)].astype(np.float32)
+    clustered = time.perf_counter()
+
+    return {
+        "z": z,
+        "genes": gene_names[row_order],
+        "samples": samples[column_order],
+        "columns_clustered": columns_clustered,
+        "timings": {"fetch": fetched - start, "cluster": clustered - fetched},
+    }
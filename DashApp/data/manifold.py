@@ -0,0 +1,194 @@
+"""
+Low-dimensional embeddings of the selected samples.
+
+Samples are embedded from their log2(TPM + 1) values over the most variable
+genes of the selection, read straight from the expression matrix: one pass
+over the matrix finds each gene's variance across the selected samples, and
+only the chosen genes' columns are then gathered. The centred samples x genes
+block is reduced with a randomized truncated SVD (Halko, Martinsson & Tropp),
+which gives the principal components without forming the full decomposition.
+The neighbour-graph embedding connects each sample to its nearest neighbours
+in principal component space and lays the graph out with the leading
+eigenvectors of its (regularised) normalised adjacency matrix, a spectral
+embedding.
+
+Embeddings are memoised per dataset selection, TER threshold and method, so
+changing the colouring or the number of dimensions shown reuses them.
+"""
+import os
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, eigsh
+
+from data.background_jobs import checkpoint
+from data.expression_matrix import get_expression_matrix
+from data.result_cache import result_cache
+from data.sample_metadata import sample_mask
+
+# Embedding methods offered, with their labels
+MANIFOLD_METHODS = {
+    "pca": "PCA",
+    "spectral": "Neighbour graph (spectral)",
+}
+
+# Most variable genes the embedding is computed from
+MANIFOLD_GENES = int(os.getenv('MANIFOLD_GENES', 2000))
+
+# Dimensions returned for every embedding (2D plots use the first two)
+MANIFOLD_DIMENSIONS = 3
+
+# Principal components the neighbour graph is built on
+GRAPH_COMPONENTS = 30
+
+# Neighbours each sample is connected to in the graph
+GRAPH_NEIGHBOURS = 15
+
+# Fewest samples an embedding is computed for
+MIN_MANIFOLD_SAMPLES = 5
+
+# Genes scanned per block when finding the most variable genes
+MANIFOLD_BLOCK_ROWS = 4096
+
+
+def variable_genes(matrix, samples: np.ndarray, n_genes: int) -> np.ndarray:
+    """
+    Rows of the genes whose log2(TPM + 1) varies most over the given samples.
+    Genes need a value in at least half of the samples to be considered.
+    """
+    n_total = len(matrix.genes)
+    variances = np.zeros(n_total)
+    for start in range(0, n_total, MANIFOLD_BLOCK_ROWS):
+        # A cancelled or superseded request stops between blocks
+        checkpoint("variance")
+        stop = min(start + MANIFOLD_BLOCK_ROWS, n_total)
+        block = np.take(matrix.tpm[start:stop], samples, axis=1).astype(np.float64)
+        missing = np.isnan(block)
+        block[missing] = 0
+        np.log1p(block, out=block)
+        count = len(samples) - missing.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = block.sum(axis=1) / count
+            block -= mean[:, None]
+            block[missing] = 0
+            variance = np.einsum("ij,ij->i", block, block) / count
+        variance[count < len(samples) / 2] = 0
+        variances[start:stop] = np.nan_to_num(variance)
+    candidates = np.flatnonzero(variances > 0)
+    n_genes = min(n_genes, len(candidates))
+    best = candidates[np.argpartition(-variances[candidates], n_genes - 1)[:n_genes]] if n_genes else candidates
+    return np.sort(best)
+
+
+def centred_log_values(matrix, rows: np.ndarray, samples: np.ndarray) -> np.ndarray:
+    """Samples x genes log2(TPM + 1) values centred per gene, missing values at the gene mean."""
+    values = np.log2(np.take(matrix.tpm[rows], samples, axis=1).T.astype(np.float64) + 1)
+    values -= np.nanmean(values, axis=0)
+    return np.nan_to_num(values, copy=False)
+
+
+def randomized_svd(values: np.ndarray, n_components: int, oversamples: int = 10,
+                   power_iterations: int = 4, seed: int = 0) -> tuple:
+    """
+    Truncated SVD of a dense matrix from a random projection of its range.
+    Returns:
+        Tuple of (U, S, Vt) with n_components singular vectors and values
+    """
+    rng = np.random.default_rng(seed)
+    n_random = min(n_components + oversamples, min(values.shape))
+    basis = values @ rng.standard_normal((values.shape[1], n_random))
+    # Power iterations sharpen the spectrum; QR between them keeps the basis well conditioned
+    for _ in range(power_iterations):
+        basis = np.linalg.qr(basis)[0]
+        basis = values @ (values.T @ basis)
+    basis = np.linalg.qr(basis)[0]
+    u, s, vt = np.linalg.svd(basis.T @ values, full_matrices=False)
+    u = basis @ u
+    # Fix each component's sign so repeated runs give the same orientation
+    signs = np.sign(u[np.abs(u).argmax(axis=0), np.arange(u.shape[1])])
+    return ((u * signs)[:, :n_components], s[:n_components], (vt * signs[:, None])[:n_components])
+
+
+def spectral_embedding(coordinates: np.ndarray, n_neighbours: int, n_components: int) -> np.ndarray:
+    """
+    Lay out the k-nearest-neighbour graph of `coordinates` with the leading
+    non-trivial eigenvectors of its normalised adjacency matrix.
+
+    Edges are weighted by a Gaussian of the distance scaled to each sample's
+    k-th neighbour, and the graph is regularised by a weak edge between every
+    pair of samples (adjacency + tau/n, tau the mean degree). Without it,
+    well separated groups (typically datasets) form disconnected components
+    whose eigenvectors are constant over each group, collapsing every group
+    to a single point.
+    """
+    n = len(coordinates)
+    n_neighbours = min(n_neighbours, n - 1)
+    squared = np.einsum("ij,ij->i", coordinates, coordinates)
+    distances = squared[:, None] + squared[None, :] - 2 * coordinates @ coordinates.T
+    np.fill_diagonal(distances, np.inf)
+    neighbours = np.argpartition(distances, n_neighbours - 1, axis=1)[:, :n_neighbours]
+    neighbour_distances = np.sqrt(np.maximum(np.take_along_axis(distances, neighbours, axis=1), 0))
+    bandwidth = np.maximum(neighbour_distances.max(axis=1), np.finfo(float).tiny)
+    weights = np.exp(-(neighbour_distances / bandwidth[:, None]) ** 2)
+
+    graph = sparse.csr_matrix((weights.ravel(), (np.repeat(np.arange(n), n_neighbours), neighbours.ravel())),
+                              shape=(n, n))
+    graph = graph.maximum(graph.T)
+    degree = np.asarray(graph.sum(axis=1)).ravel()
+    tau = degree.mean()
+    scale = 1 / np.sqrt(degree + tau)
+
+    # The dense regularisation term is applied as a rank-one update
+    adjacency = LinearOperator((n, n), dtype=np.float64,
+                               matvec=lambda v: scale * (graph @ (scale * v) + tau / n * np.dot(scale, v)))
+    start = np.random.default_rng(0).standard_normal(n)
+    _, vectors = eigsh(adjacency, k=n_components + 1, which="LA", v0=start)
+    # eigsh returns ascending eigenvalues; the largest belongs to the trivial
+    # (degree-weighted constant) eigenvector
+    return scale[:, None] * vectors[:, ::-1][:, 1:] * np.sqrt(n)
+
+
+def embed(matrix, samples: np.ndarray, method: str, n_genes: int = MANIFOLD_GENES) -> dict:
+    """
+    Embed samples of an expression matrix in MANIFOLD_DIMENSIONS dimensions.
+    Args:
+        matrix: ExpressionMatrix
+        samples: Sample columns to embed
+        method: Key of MANIFOLD_METHODS
+        n_genes: Number of most variable genes to use
+    Returns:
+        Dict with the SampleIndex of each point ("samples"), their coordinates
+        ("coordinates", samples x dimensions), the fraction of variance each
+        principal component explains ("explained_variance", PCA only) and
+        the number of genes used ("genes")
+    """
+    rows = variable_genes(matrix, samples, n_genes)
+    values = centred_log_values(matrix, rows, samples)
+    n_components = GRAPH_COMPONENTS if method == "spectral" else MANIFOLD_DIMENSIONS
+    n_components = min(n_components, min(values.shape) - 1)
+    u, s, _ = randomized_svd(values, n_components)
+    coordinates = u * s
+
+    explained = None
+    if method == "spectral":
+        coordinates = spectral_embedding(coordinates, GRAPH_NEIGHBOURS, MANIFOLD_DIMENSIONS)
+    else:
+        explained = s ** 2 / np.einsum("ij,ij->", values, values)
+    return {"samples": samples, "coordinates": coordinates, "explained_variance": explained, "genes": len(rows)}
+
+
+@result_cache.memoize("manifold")
+def sample_embedding(datasets: tuple, ter_threshold: float = 0, method: str = "pca") -> dict:
+    """
+    Embedding of the samples of the selected datasets.
+    Args:
+        datasets: Dataset names to include
+        ter_threshold: Only use samples with TER above this value (0 uses all)
+        method: Key of MANIFOLD_METHODS
+    Returns:
+        Dict as from embed, or None if fewer than MIN_MANIFOLD_SAMPLES are selected
+    """
+    samples = np.flatnonzero(sample_mask(datasets, ter_threshold))
+    if len(samples) < MIN_MANIFOLD_SAMPLES:
+        return None
+    return embed(get_expression_matrix(), samples, method)
@@ -0,0 +1,73 @@
+"""
+Precomputed co-expression neighbours.
+
+Databases built with `data_upload.py --neighbours K` carry a GeneNeighbour
+table holding each gene's K most correlated genes per dataset and over all
+datasets, for Pearson on log2(TPM + 1) and for Spearman. A gene's lists for
+every dataset are one indexed range scan, so they are served without touching
+the expression matrix.
+"""
+import numpy as np
+import pandas as pd
+
+from db.connection import get_db_connection, per_database_version
+
+# Scope value of the neighbours computed over every sample
+ALL_DATASETS_SCOPE = "*"
+
+# Correlation measures the table is built for
+NEIGHBOUR_METHODS = ("pearson_log2", "spearman")
+
+
+@per_database_version
+def has_neighbours() -> bool:
+    """Whether the current database has precomputed neighbours."""
+    row = get_db_connection().execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'GeneNeighbour'"
+    ).fetchone()
+    return row is not None and get_db_connection().execute(
+        "SELECT 1 FROM GeneNeighbour LIMIT 1"
+    ).fetchone() is not None
+
+
+def fetch_neighbours(gene: str, method: str, top: int) -> pd.DataFrame:
+    """
+    Read a gene's precomputed neighbours in every scope.
+    Args:
+        gene: Gene name
+        method: One of NEIGHBOUR_METHODS
+        top: Neighbours to return per scope (at most the number stored)
+    Returns:
+        DataFrame with Scope, Rank (from 1), GeneName and Correlation columns
+    """
+    conn = get_db_connection()
+    rows = conn.execute(
+        """
+        SELECT n.Scope, n.NeighbourKeys, n.Correlations
+        FROM GeneNeighbour n JOIN Gene g ON g.GeneKey = n.GeneKey
+        WHERE g.GeneName = ? AND n.Method = ?
+        """,
+        (gene, method),
+    ).fetchall()
+    scopes, keys, correlations = [], [], []
+    for scope, neighbour_keys, values in rows:
+        neighbour_keys = np.frombuffer(neighbour_keys, dtype="<i4")[:top]
+        scopes.append(np.full(len(neighbour_keys), scope, dtype=object))
+        keys.append(neighbour_keys)
+        correlations.append(np.frombuffer(values, dtype="<f4")[:len(neighbour_keys)])
+    if not rows:
+        return pd.DataFrame({"Scope": [], "Rank": [], "GeneName": [], "Correlation": []})
+
+    keys = np.concatenate(keys)
+    unique_keys = np.unique(keys).tolist()
+    names = dict(conn.execute(
+        f"SELECT GeneKey, GeneName FROM Gene WHERE GeneKey IN ({', '.join('?' * len(unique_keys))})",
+        unique_keys,
+    ).fetchall())
+    neighbours = pd.DataFrame({
+        "Scope": np.concatenate(scopes),
+        "GeneName": [names[key] for key in keys.tolist()],
+        "Correlation": np.concatenate(correlations).astype(np.float64),
+    })
+    neighbours.insert(1, "Rank", neighbours.groupby("Scope").cumcount() + 1)
+    return neighbours
@@ -0,0 +1,47 @@
+"""
+Dataset option list published as a content-hashed static asset.
+
+The URL embeds a hash of the list, so browsers can cache it indefinitely:
+a rebuilt database with different datasets produces a new URL.
+"""
+import hashlib
+import json
+
+from flask import Response, abort
+
+from data.fetch_names import fetch_datasets
+from db.connection import per_database_version
+
+# Browsers may keep a hashed asset for a year without revalidating
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@per_database_version
+def get_dataset_options_asset() -> tuple:
+    """
+    Serialise the dataset list for the current database.
+    Returns:
+        Tuple of (content hash, JSON body)
+    """
+    body = json.dumps(fetch_datasets()).encode()
+    return hashlib.sha256(body).hexdigest()[:16], body
+
+
+def dataset_options_url() -> str:
+    """URL of the current dataset options asset."""
+    digest, _ = get_dataset_options_asset()
+    return f"/options/datasets.{digest}.json"
+
+
+def serve_dataset_options(digest: str) -> Response:
+    current, body = get_dataset_options_asset()
+    if digest != current:
+        abort(404)
+    response = Response(body, mimetype="application/json")
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+def register_options_routes(server) -> None:
+    """Serve the hashed option assets from the Flask server"""
+    server.add_url_rule("/options/datasets.<digest>.json", view_func=serve_dataset_options)
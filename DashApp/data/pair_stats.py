@@ -0,0 +1,141 @@
+"""
+Correlation and regression statistics for paired expression values.
+
+The comparison plot reports Pearson correlation on TPM and on log2(TPM + 1),
+Spearman correlation and a least-squares fit for the current axis scale.
+Rather than one scipy call per statistic, each re-validating and re-scanning
+the same arrays, the linear values, their logs and their ranks are stacked
+and centred sums of squares and products are taken for all of them in one
+pass. Every statistic then follows in closed form: p-values from Student's t
+distribution and Pearson confidence intervals from the Fisher transform, as
+scipy.stats.pearsonr, spearmanr and linregress compute them.
+
+The functions work along the last axis, so one gene can be scored against
+many at once.
+"""
+import numpy as np
+from scipy import special
+
+# log10(x + 1) is log2(x + 1) scaled by this factor
+LOG10_OF_2 = np.log10(2)
+
+
+def average_ranks(values: np.ndarray) -> np.ndarray:
+    """Ranks from 1 along the last axis, ties sharing their average rank."""
+    values = np.asarray(values, dtype=np.float64)
+    rows = values.reshape(-1, values.shape[-1])
+    n_rows, n = rows.shape
+    order = np.argsort(rows, axis=1)
+    ordered = np.take_along_axis(rows, order, axis=1)
+
+    # Runs of equal values, numbered across all rows
+    starts_run = np.ones_like(ordered, dtype=bool)
+    starts_run[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    run = np.cumsum(starts_run.ravel()) - 1
+    position = np.tile(np.arange(n), n_rows)
+    run_rank = position[starts_run.ravel()] + (np.bincount(run) + 1) / 2
+
+    ranks = np.empty_like(rows)
+    np.put_along_axis(ranks, order, run_rank[run].reshape(n_rows, n), axis=1)
+    return ranks.reshape(values.shape)
+
+
+def _sums(a: np.ndarray, b: np.ndarray) -> tuple:
+    # Means and centred sums of squares and products along the last axis
+    mean_a = a.mean(axis=-1)
+    mean_b = b.mean(axis=-1)
+    da = a - mean_a[..., None]
+    db = b - mean_b[..., None]
+    return (mean_a, mean_b, np.einsum("...i,...i", da, da),
+            np.einsum("...i,...i", db, db), np.einsum("...i,...i", da, db))
+
+
+def correlation_pvalue(r, n: int):
+    """Two-sided p-value of a Pearson or Spearman correlation of n pairs."""
+    df = n - 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = r * np.sqrt(df / ((1 - r) * (1 + r)))
+    return 2 * special.stdtr(df, -np.abs(t))
+
+
+def correlation_interval(r, n: int, confidence: float = 0.95) -> tuple:
+    """Confidence interval of a Pearson correlation (Fisher transform)."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        spread = special.ndtri(0.5 + confidence / 2) / np.sqrt(n - 3)
+        z = np.arctanh(r)
+    return np.tanh(z - spread), np.tanh(z + spread)
+
+
+def _correlation(sum_aa, sum_bb, sum_ab, n: int, confidence: float) -> dict:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = np.clip(sum_ab / np.sqrt(sum_aa * sum_bb), -1.0, 1.0)
+    low, high = correlation_interval(r, n, confidence)
+    return {"r": r, "p": correlation_pvalue(r, n), "ci_low": low, "ci_high": high}
+
+
+def _fit(mean_a, mean_b, sum_aa, sum_bb, sum_ab, n: int, confidence: float) -> dict:
+    df = n - 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = sum_ab / sum_aa
+        r = np.clip(sum_ab / np.sqrt(sum_aa * sum_bb), -1.0, 1.0)
+        slope_stderr = np.sqrt((1 - r ** 2) * sum_bb / sum_aa / df)
+    half_width = special.stdtrit(df, 0.5 + confidence / 2) * slope_stderr if df > 0 else np.nan
+    return {
+        "slope": slope,
+        "intercept": mean_b - slope * mean_a,
+        "r_squared": r ** 2,
+        "p": correlation_pvalue(r, n),
+        "slope_stderr": slope_stderr,
+        "intercept_stderr": slope_stderr * np.sqrt(sum_aa / n + mean_a ** 2),
+        "slope_ci": (slope - half_width, slope + half_width),
+    }
+
+
+def correlations(a: np.ndarray, b: np.ndarray, confidence: float = 0.95) -> dict:
+    """
+    Pearson correlation along the last axis of two equally shaped arrays.
+    Returns:
+        Dict of arrays: r, p, ci_low, ci_high
+    """
+    _, _, sum_aa, sum_bb, sum_ab = _sums(a, b)
+    return _correlation(sum_aa, sum_bb, sum_ab, a.shape[-1], confidence)
+
+
+def pair_statistics(x: np.ndarray, y: np.ndarray, confidence: float = 0.95) -> dict:
+    """
+    Everything the comparison plot reports about two genes' TPM values.
+    Args:
+        x: TPM of the first gene per sample
+        y: TPM of the second gene, aligned with x
+        confidence: Level of the confidence intervals
+    Returns:
+        Dict with n, pearson and pearson_log2 (r, p, ci_low, ci_high),
+        spearman (r, p) and fits: a least-squares fit (slope, intercept,
+        r_squared, p, slope_stderr, intercept_stderr, slope_ci) per y-axis scale
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    # Rows: linear, log2(TPM + 1), ranks
+    a = np.vstack([x, np.log2(x + 1), np.empty(n)])
+    b = np.vstack([y, np.log2(y + 1), np.empty(n)])
+    a[2], b[2] = average_ranks(np.vstack([x, y]))
+    mean_a, mean_b, sum_aa, sum_bb, sum_ab = _sums(a, b)
+
+    correlation = _correlation(sum_aa, sum_bb, sum_ab, n, confidence)
+    pearson, pearson_log2, spearman = ({key: float(value[row]) for key, value in correlation.items()}
+                                       for row in range(3))
+    linear, log2 = (_fit(mean_a[row], mean_b[row], sum_aa[row], sum_bb[row], sum_ab[row], n, confidence)
+                    for row in (0, 1))
+
+    # log10 values are log2 values scaled: the slope and fit quality carry over
+    log10 = dict(log2, intercept=log2["intercept"] * LOG10_OF_2,
+                 intercept_stderr=log2["intercept_stderr"] * LOG10_OF_2)
+    return {
+        "n": n,
+        "pearson": pearson,
+        "pearson_log2": pearson_log2,
+        # The Fisher interval does not apply to rank correlation
+        "spearman": {"r": spearman["r"], "p": spearman["p"]},
+        "fits": {"linear": linear, "log2": log2, "log10": log10},
+    }
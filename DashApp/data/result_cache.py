@@ -0,0 +1,225 @@
+"""
+Byte-budgeted result cache shared by all workers on a host.
+
+Entries are pickled into a small SQLite database under CACHE_DIR, so both
+gunicorn workers see the same entries and counters. The total size of the
+stored values is bounded in bytes, and every entry is tied to the version of
+the expression database it was computed from and to the cache format of the
+code that stored it, so a kept CACHE_DIR is never read by a newer release.
+"""
+import functools
+import hashlib
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+
+from db.connection import database_version
+
+CACHE_DIR = os.getenv('CACHE_DIR') or os.path.join(tempfile.gettempdir(), "urotheliome-cache")
+RESULT_CACHE_BYTES = int(os.getenv('RESULT_CACHE_BYTES', 256 * 1024 * 1024))
+RESULT_CACHE_POLICY = os.getenv('RESULT_CACHE_POLICY', "lru")
+
+# Bump whenever a cached value changes shape (a memoized function's return
+# value, or the figure state saved per session); every entry is then dropped
+RESULT_CACHE_FORMAT = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS Entry (
+    Key TEXT PRIMARY KEY,
+    Value BLOB NOT NULL,
+    Size INTEGER NOT NULL,
+    Accessed REAL NOT NULL,
+    Hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS Counter (
+    Name TEXT PRIMARY KEY,
+    Value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS Setting (
+    Name TEXT PRIMARY KEY,
+    Value TEXT
+);
+"""
+
+# Order in which entries are evicted once the byte budget is exceeded
+_EVICTION_ORDER = {
+    "lru": "Accessed ASC",
+    "lfu": "Hits ASC, Accessed ASC",
+}
+
+_MISSING = object()
+
+
+class ResultCache:
+    """
+    Cross-process key/value cache bounded by the total size of its values.
+
+    Args:
+        path: SQLite file holding the cache
+        max_bytes: Upper bound on the summed size of pickled values
+        policy: "lru" or "lfu" eviction
+    """
+
+    def __init__(self, path: str, max_bytes: int, policy: str = "lru"):
+        if policy not in _EVICTION_ORDER:
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self._local = threading.local()
+        self._version = None
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _check_version(self, conn: sqlite3.Connection) -> None:
+        """Drop every entry once the expression database or the cache format has changed."""
+        version = f"{database_version()}/{RESULT_CACHE_FORMAT}"
+        if version == self._version:
+            return
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT Value FROM Setting WHERE Name = 'version'").fetchone()
+            if row is None or row[0] != version:
+                conn.execute("DELETE FROM Entry")
+                conn.execute(
+                    "INSERT OR REPLACE INTO Setting (Name, Value) VALUES ('version', ?)",
+                    (version,)
+                )
+        self._version = version
+
+    @staticmethod
+    def _count(conn: sqlite3.Connection, name: str, amount: int = 1) -> None:
+        conn.execute(
+            "INSERT INTO Counter (Name, Value) VALUES (?, ?) "
+            "ON CONFLICT(Name) DO UPDATE SET Value = Value + excluded.Value",
+            (name, amount)
+        )
+
+    @staticmethod
+    def make_key(namespace: str, *args) -> str:
+        """Stable key for a namespace and its (picklable) arguments."""
+        digest = hashlib.sha1(pickle.dumps(args, protocol=4)).hexdigest()
+        return f"{namespace}:{digest}"
+
+    def get(self, key: str, default=None):
+        conn = self._connection()
+        self._check_version(conn)
+        row = conn.execute("SELECT Value FROM Entry WHERE Key = ?", (key,)).fetchone()
+        with conn:
+            if row is None:
+                self._count(conn, "misses")
+                return default
+            conn.execute(
+                "UPDATE Entry SET Accessed = ?, Hits = Hits + 1 WHERE Key = ?",
+                (time.time(), key)
+            )
+            self._count(conn, "hits")
+        return pickle.loads(row[0])
+
+    def get_many(self, keys: list) -> dict:
+        """Values of the stored keys among `keys`, read in one query; absent keys are left out."""
+        conn = self._connection()
+        self._check_version(conn)
+        keys = list(dict.fromkeys(keys))
+        placeholders = ", ".join("?" * len(keys))
+        rows = conn.execute(
+            f"SELECT Key, Value FROM Entry WHERE Key IN ({placeholders})", keys
+        ).fetchall() if keys else []
+        with conn:
+            if rows:
+                conn.execute(
+                    f"UPDATE Entry SET Accessed = ?, Hits = Hits + 1 WHERE Key IN ({', '.join('?' * len(rows))})",
+                    (time.time(), *[key for key, _ in rows])
+                )
+                self._count(conn, "hits", len(rows))
+            if len(rows) < len(keys):
+                self._count(conn, "misses", len(keys) - len(rows))
+        return {key: pickle.loads(value) for key, value in rows}
+
+    def set(self, key: str, value) -> None:
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        conn = self._connection()
+        self._check_version(conn)
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO Entry (Key, Value, Size, Accessed, Hits) "
+                "VALUES (?, ?, ?, ?, 0)",
+                (key, blob, len(blob), time.time())
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        total = conn.execute("SELECT COALESCE(SUM(Size), 0) FROM Entry").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        order = _EVICTION_ORDER[self.policy]
+        for key, size in conn.execute(f"SELECT Key, Size FROM Entry ORDER BY {order}").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM Entry WHERE Key = ?", (key,))
+            total -= size
+            evicted += 1
+        self._count(conn, "evictions", evicted)
+
+    def clear(self, namespace: str = None) -> None:
+        """Remove every entry, or only those stored under `namespace`."""
+        conn = self._connection()
+        with conn:
+            if namespace is None:
+                conn.execute("DELETE FROM Entry")
+            else:
+                conn.execute("DELETE FROM Entry WHERE Key LIKE ?", (f"{namespace}:%",))
+
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters and current footprint, across all workers."""
+        conn = self._connection()
+        counters = dict(conn.execute("SELECT Name, Value FROM Counter").fetchall())
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(Size), 0) FROM Entry").fetchone()
+        return {
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "evictions": counters.get("evictions", 0),
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "policy": self.policy,
+        }
+
+    def memoize(self, namespace: str):
+        """Decorator caching a function's results under `namespace`."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args):
+                key = self.make_key(namespace, *args)
+                value = self.get(key, _MISSING)
+                if value is _MISSING:
+                    value = func(*args)
+                    self.set(key, value)
+                return value
+            wrapper.cache_clear = functools.partial(self.clear, namespace)
+            return wrapper
+        return decorator
+
+
+result_cache = ResultCache(
+    os.path.join(CACHE_DIR, "results.sqlite"),
+    RESULT_CACHE_BYTES,
+    RESULT_CACHE_POLICY,
+)
@@ -0,0 +1,76 @@
+"""
+Process-wide sample metadata table.
+
+The Sample table is small, so it is loaded once per worker with categorical
+text columns. Expression data refers to samples by their position in this
+table (`SampleIndex`, which is also the sample's column in the expression
+matrix), and metadata is attached with a cheap categorical `take` instead of
+a SQL join returning one Python string per row and column.
+"""
+import numpy as np
+import pandas as pd
+
+from db.connection import get_db_connection, per_database_version
+
+# Sample metadata returned alongside TPM, in the order the fetch layer exposes them
+METADATA_COLUMNS = [
+    "DatasetName",
+    "SubsetName",
+    "TissueName",
+    "SubstrateType",
+    "Gender",
+    "Stage",
+    "Status",
+    "NhuDifferentiation",
+    "SampleId",
+    "TER",
+]
+
+# Columns held with a `category` dtype; TER stays numeric
+CATEGORICAL_COLUMNS = [column for column in METADATA_COLUMNS if column != "TER"]
+
+
+@per_database_version
+def get_sample_metadata() -> pd.DataFrame:
+    """
+    Load the Sample table ordered by SampleKey.
+    Returns:
+        DataFrame with one row per sample (row position = SampleIndex),
+        categorical text columns and a float TER column
+    """
+    query = f"SELECT SampleKey, {', '.join(METADATA_COLUMNS)} FROM Sample ORDER BY SampleKey"
+    df = pd.read_sql_query(query, get_db_connection())
+    for column in CATEGORICAL_COLUMNS:
+        df[column] = df[column].astype("category")
+    df["TER"] = pd.to_numeric(df["TER"], errors="coerce")
+    return df
+
+
+def sample_mask(datasets, ter_threshold: float = 0, required_columns=()) -> np.ndarray:
+    """
+    Boolean mask over samples.
+    Args:
+        datasets: Dataset names to include
+        ter_threshold: Only keep samples with TER above this value (0 keeps all)
+        required_columns: Metadata columns that must be non-null
+    Returns:
+        Boolean array indexed by SampleIndex
+    """
+    samples = get_sample_metadata()
+    mask = samples["DatasetName"].isin(datasets).to_numpy()
+    if ter_threshold and ter_threshold > 0:
+        mask &= (samples["TER"] > ter_threshold).to_numpy()
+    for column in required_columns:
+        mask &= samples[column].notna().to_numpy()
+    return mask
+
+
+def attach_metadata(data: pd.DataFrame) -> pd.DataFrame:
+    """Add the metadata columns for each row's SampleIndex to `data`."""
+    samples = get_sample_metadata()
+    index = data["SampleIndex"].to_numpy()
+    for column in CATEGORICAL_COLUMNS:
+        # Taking from a Categorical only copies its integer codes
+        data[column] = samples[column].array.take(index)
+    data["TER"] = samples["TER"].to_numpy()[index]
+    return data
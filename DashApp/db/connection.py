@@ -1,10 +1,140 @@
 import sqlite3
+import functools
 import os
+import threading
+from urllib.parse import quote
 
 #DATABASE_PATH = "./UrotheliomeData.db"
 DATABASE_PATH = os.getenv('DATABASE_PATH') or "'../data/UrotheliomeData.db'"
 
+# The dashboard never writes to the database, so every connection is opened
+# read-only and tuned for repeated lookups against a static file.
+CONNECTION_PRAGMAS = {
+    "query_only": "ON",
+    "mmap_size": int(os.getenv('SQLITE_MMAP_SIZE', 1 << 30)),
+    "cache_size": -int(os.getenv('SQLITE_CACHE_KIB', 65536)),
+    "temp_store": "MEMORY",
+}
+
+# Number of prepared statements each connection keeps compiled
+STATEMENT_CACHE_SIZE = 256
+
+
+def database_version() -> str:
+    """
+    Identify the current database file.
+
+    The build script replaces the database with a `mv`, so the inode, size and
+    modification time together change whenever a new database is published.
+    Returns:
+        String token that changes whenever the database file is replaced
+    """
+    stat = os.stat(DATABASE_PATH)
+    return f"{stat.st_ino}-{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def per_database_version(loader):
+    """
+    Decorator memoising a zero-argument loader until the database is replaced.
+
+    Used for process-wide tables derived from the database (expression
+    matrix, sample metadata, ...), which are loaded once and shared by all
+    threads of a worker.
+    """
+    lock = threading.Lock()
+    state = {"version": None, "value": None}
+
+    @functools.wraps(loader)
+    def wrapper():
+        version = database_version()
+        if state["version"] != version:
+            with lock:
+                if state["version"] != version:
+                    state["value"] = loader()
+                    state["version"] = version
+        return state["value"]
+
+    return wrapper
+
+
+class ConnectionPool:
+    """
+    Per-thread pool of read-only SQLite connections.
+
+    Each thread (gunicorn worker thread or the Dash dev server's request
+    threads) gets its own connection, which is reused for every query that
+    thread runs. Connections are reopened after a fork or when the database
+    file is replaced.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {"opened": 0, "reused": 0, "reopened": 0}
+        self._live = 0
+
+    def _uri(self) -> str:
+        return f"file:{quote(os.path.abspath(self.path))}?mode=ro&immutable=1"
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self._uri(),
+            uri=True,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for pragma, value in CONNECTION_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening or replacing it if needed."""
+        local = self._local
+        version = database_version()
+        conn = getattr(local, "conn", None)
+
+        if conn is not None and local.pid == os.getpid() and local.version == version:
+            with self._lock:
+                self._stats["reused"] += 1
+            return conn
+
+        if conn is not None:
+            # Connections inherited across a fork must not be used or closed
+            # by the child; only close ones this process opened itself
+            if local.pid == os.getpid():
+                conn.close()
+                with self._lock:
+                    self._live -= 1
+            with self._lock:
+                self._stats["reopened"] += 1
+
+        local.conn = self._open()
+        local.pid = os.getpid()
+        local.version = version
+        with self._lock:
+            self._stats["opened"] += 1
+            self._live += 1
+        return local.conn
+
+    def stats(self) -> dict:
+        """Snapshot of pool counters for the current process."""
+        with self._lock:
+            return {**self._stats, "live": self._live, "pid": os.getpid()}
+
+
+_pool = ConnectionPool(DATABASE_PATH)
+
+
 def get_db_connection() -> sqlite3.Connection:
-    """Establish and return a connection to the SQLite database."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    return conn
+    """
+    Return the calling thread's pooled connection to the SQLite database.
+
+    The connection is shared by every query made on this thread, so callers
+    must not close it.
+    """
+    return _pool.connection()
+
+
+def get_pool_stats() -> dict:
+    """Return open/reuse counters for the connection pool in this process."""
+    return _pool.stats()
@@ -0,0 +1,87 @@
+from dash import html
+import dash_bootstrap_components as dbc
+import dash_mantine_components as dmc
+from components.radio_buttons import dataset_radio, ter_radio
+from components.plots import differential_volcano_plot
+from components.tables import differential_results
+from data.differential import DIFFERENTIAL_COLUMNS, DIFFERENTIAL_TESTS
+from layouts.gene_dashboard_layout import create_control_section, create_plot_section, create_error_card
+
+def differential_expression_layout() -> html.Div:
+    """
+    Create the differential expression page: two sample groups defined on a
+    metadata column are compared for every gene
+    Returns:
+        Dash HTML Div containing the differential expression layout
+    """
+    # Common styles
+    container_style = {"max-width": "1200px"}
+
+    # Group definition controls
+    group_controls = [
+        html.Label("Compare Samples By", htmlFor="de-column-select", className="fw-bold small"),
+        dmc.Select(
+            id="de-column-select",
+            data=[{"label": label, "value": value} for value, label in DIFFERENTIAL_COLUMNS.items()],
+            value="TissueName",
+            clearable=False,
+        ),
+        html.Hr(className="my-2"),
+
+        html.Label("Group A", htmlFor="de-group-a-select", className="fw-bold small mt-2"),
+        dmc.Select(id="de-group-a-select", data=[], placeholder="Select group A...", searchable=True),
+
+        html.Label("Group B", htmlFor="de-group-b-select", className="fw-bold small mt-2"),
+        dmc.Select(id="de-group-b-select", data=[], placeholder="Select group B...", searchable=True),
+        html.Hr(className="my-2"),
+
+        html.Label("Test", htmlFor="de-test-radio", className="fw-bold small mt-2"),
+        dbc.RadioItems(
+            id="de-test-radio",
+            options=[{"label": test["label"], "value": value} for value, test in DIFFERENTIAL_TESTS.items()],
+            value="welch",
+            className="mb-2 small"
+        ),
+
+        dbc.Button("Compare Groups", id="de-run-button", n_clicks=0, color="primary", size="sm",
+                   className="w-100 mt-2"),
+        dbc.Button("Cancel", id="de-cancel-button", n_clicks=0, color="secondary", size="sm",
+                   outline=True, disabled=True, className="w-100 mt-1"),
+    ]
+
+    # Sample selection controls
+    sample_controls = [
+        html.Label("Select Datasets", htmlFor="de-dataset-radio", className="fw-bold small"),
+        dataset_radio("de-"),
+        html.Hr(className="my-2"),
+
+        html.Label("TER threshold", htmlFor="de-ter-input", className="fw-bold small"),
+        ter_radio("de-"),
+    ]
+
+    return html.Div([
+        dbc.Container([
+            html.H3("Differential Expression", className="text-primary mb-3"),
+            html.P("Compare two groups of samples for every gene: log2 fold change of mean log2(TPM+1), "
+                   "Welch's t-test and Mann-Whitney U, with Benjamini-Hochberg adjusted p-values.",
+                   className="lead"),
+
+            create_error_card("de"),
+
+            dbc.Row([
+                dbc.Col([
+                    create_control_section("Groups", group_controls),
+                    create_control_section("Samples", sample_controls),
+                ], md=3),
+                dbc.Col([
+                    create_plot_section(differential_volcano_plot()),
+                    html.Div(id="de-progress", className="small text-muted mt-1"),
+                    dbc.Spinner(
+                        dbc.Card(dbc.CardBody(differential_results(), className="p-2"), className="mt-3"),
+                        color="primary",
+                        type="grow",
+                    ),
+                ], md=9),
+            ]),
+        ], style=container_style, className="mb-4")
+    ])
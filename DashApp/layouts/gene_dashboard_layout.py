@@ -1,8 +1,12 @@
 from dash import html, dcc
 import dash_bootstrap_components as dbc
-from components.dropdowns import gene_dropdown, xaxis_dropdown, gene_comparison_dropdown_1, gene_comparison_dropdown_2
-from components.radio_buttons import dataset_radio, ter_radio, y_axis_radio_viz, y_axis_radio_comparison
-from components.plots import gene_expression_plot, gene_comparison_plot
+from components.dropdowns import (gene_dropdown, xaxis_dropdown, gene_comparison_dropdown_1, gene_comparison_dropdown_2,
+                                  coexpression_gene_dropdown, coexpression_count_dropdown)
+from components.radio_buttons import (dataset_radio, ter_radio, y_axis_radio_viz, y_axis_radio_comparison,
+                                      coexpression_method_radio)
+from components.plots import gene_expression_plot, gene_comparison_plot, gene_heatmap_plot
+from components.tables import coexpression_results, neighbour_results
+from data.heatmap import HEATMAP_MAX_GENES
 
 def create_control_section(title, controls):
     """Helper to create consistent control cards"""
@@ -61,6 +65,7 @@ def gene_dashboard_layout() -> html.Div:
                 {"label":"Box", "value": "box"},
                 {"label": "Points", "value": "strip"},
                 {"label": "Violin", "value": "violin"},
+                {"label": "Overview", "value": "overview"},
             ],
             value="box",
             inline=True,
@@ -86,6 +91,50 @@ def gene_dashboard_layout() -> html.Div:
         html.Hr(className="my-2"),
     ]
 
+    # Co-expression controls
+    coexp_controls = [
+        html.Label("Select Gene", htmlFor="coexpression-gene-dropdown", className="fw-bold small"),
+        coexpression_gene_dropdown(),
+        html.Hr(className="my-2"),
+        
+        html.Label("Correlation", htmlFor="coexpression-method-radio", className="fw-bold small mt-2"),
+        coexpression_method_radio(),
+        
+        html.Label("Number of Genes", htmlFor="coexpression-count-dropdown", className="fw-bold small mt-2"),
+        coexpression_count_dropdown(),
+        html.Hr(className="my-2"),
+    ]
+
+    # Heatmap controls
+    heatmap_controls = [
+        html.Label("Gene List", htmlFor="heatmap-genes-input", className="fw-bold small"),
+        dcc.Textarea(
+            id="heatmap-genes-input",
+            placeholder=f"Paste up to {HEATMAP_MAX_GENES:,} gene names, separated by spaces, commas or new lines",
+            style={"width": "100%", "height": "160px"},
+            className="form-control small"
+        ),
+        html.Hr(className="my-2"),
+        
+        html.Label("Cluster", htmlFor="heatmap-cluster-checklist", className="fw-bold small mt-2"),
+        dbc.Checklist(
+            id="heatmap-cluster-checklist",
+            options=[
+                {"label": "Genes", "value": "rows"},
+                {"label": "Samples", "value": "columns"},
+            ],
+            value=["rows", "columns"],
+            inline=True,
+            className="mb-2 small"
+        ),
+        
+        dbc.Button("Draw Heatmap", id="heatmap-button", n_clicks=0, color="primary", size="sm",
+                   className="w-100 mt-2"),
+        dbc.Button("Cancel", id="heatmap-cancel-button", n_clicks=0, color="secondary", size="sm",
+                   outline=True, disabled=True, className="w-100 mt-1"),
+        html.Hr(className="my-2"),
+    ]
+
     # TER slider control for global controls
     ter_control = [
         html.Label("Transepithelial Electrical Resistance barrier (TER) threshold", 
@@ -116,6 +165,9 @@ def gene_dashboard_layout() -> html.Div:
             # Hidden div for loading indicator
             html.Div(id="loading-indicator", style={"display": "none"}),
             
+            # Per-tab id used to find the figures this browser is showing
+            dcc.Store(id="session-id", storage_type="session"),
+            
             # For backward compatibility with callbacks (these will be hidden)
             # html.Div(id="error-alert", style={"display": "none"}),
             # dbc.Collapse(id="error-alert-collapse", is_open=False, style={"display": "none"}),
@@ -175,6 +227,59 @@ def gene_dashboard_layout() -> html.Div:
                             ])
                         ]
                     ),
+                    
+                    # Co-expression Tab
+                    dbc.Tab(
+                        label="Co-expression",
+                        tab_id="gene-coexpression",
+                        labelClassName="fw-bold",
+                        id="gene-coexpression-tab",
+                        key="gene-coexpression",
+                        children=[
+                            # Row containing controls on left, results on right
+                            dbc.Row([
+                                # Left side - Co-expression Controls (compact)
+                                dbc.Col([
+                                    create_control_section("Co-expression Controls", coexp_controls),
+                                    create_error_card("coexp")
+                                ], md=3, className="pe-0"),
+                                
+                                # Right side - Table of the most correlated genes, and
+                                # the precomputed lists per dataset when the database has them
+                                dbc.Col([
+                                    create_plot_section(coexpression_results()),
+                                    html.Div(id="coexpression-progress", className="small text-muted mt-1"),
+                                    neighbour_results()
+                                ], md=9, className="ps-2")
+                            ])
+                        ]
+                    ),
+                    
+                    # Heatmap Tab
+                    dbc.Tab(
+                        label="Heatmap",
+                        tab_id="gene-heatmap",
+                        labelClassName="fw-bold",
+                        id="gene-heatmap-tab",
+                        key="gene-heatmap",
+                        children=[
+                            # Row containing controls on left, plot on right
+                            dbc.Row([
+                                # Left side - Heatmap Controls (compact)
+                                dbc.Col([
+                                    create_control_section("Heatmap Controls", heatmap_controls),
+                                    create_error_card("heatmap")
+                                ], md=3, className="pe-0"),
+                                
+                                # Right side - Graph, with the running stage or how long each stage took
+                                dbc.Col([
+                                    create_plot_section(gene_heatmap_plot()),
+                                    html.Div(id="heatmap-progress", className="small text-muted mt-1"),
+                                    html.Div(id="heatmap-timing", className="small text-muted mt-1")
+                                ], md=9, className="ps-2")
+                            ])
+                        ]
+                    ),
                 ],
             ),
             
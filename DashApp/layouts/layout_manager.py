@@ -6,8 +6,41 @@ from layouts.navigation import create_navbar
 from layouts.footer import create_footer
 from layouts.home_layout import home_layout
 from layouts.gene_dashboard_layout import gene_dashboard_layout
+from layouts.differential_expression_layout import differential_expression_layout
+from layouts.manifold_layout import manifold_layout
 from layouts.genome_browser_layout import genome_browser_layout, register_genome_browser_callbacks
 from layouts.accessibility_layout import accessibility_layout
+from data.options_asset import register_options_routes
+from db.connection import per_database_version
+
+# Page builders for each route, keyed by pathname without trailing slash
+PAGES = {
+    "/gene-explorer": gene_dashboard_layout,
+    "/gene-diff": differential_expression_layout,
+    "/manifold": manifold_layout,
+    "/genome-browser": genome_browser_layout,
+    "/accessibility": accessibility_layout,
+}
+
+@per_database_version
+def _layout_cache():
+    """Built page layouts, discarded whenever the database is replaced"""
+    return {}
+
+def get_page_layout(pathname):
+    """
+    Return the layout for a route, building it on first use
+    Args:
+        pathname: URL path of the page
+    Returns:
+        Dash component tree for the page (home page for unknown paths)
+    """
+    path = (pathname or "/").rstrip("/")
+    builder = PAGES.get(path, home_layout)
+    layouts = _layout_cache()
+    if builder not in layouts:
+        layouts[builder] = builder()
+    return layouts[builder]
 
 def create_layout():
     """
@@ -43,15 +76,11 @@ def register_layout_callbacks(app):
         Input("url", "pathname"),
     )
     def display_page(pathname):
-        if pathname == "/gene-explorer" or pathname == "/gene-explorer/":
-            return gene_dashboard_layout()
-        elif pathname == "/genome-browser" or pathname == "/genome-browser/":
-            return genome_browser_layout()
-        elif pathname == "/accessibility" or pathname == "/accessibility/":
-            return accessibility_layout()
-        else:
-            # Default to home layout
-            return home_layout()
+        # Layouts are built once per database version and reused
+        return get_page_layout(pathname)
+    
+    # Serve hashed option lists referenced by the layouts
+    register_options_routes(app.server)
             
     # Register genome browser callbacks
     register_genome_browser_callbacks(app) 
\ No newline at end of file
@@ -0,0 +1,73 @@
+from dash import html
+import dash_bootstrap_components as dbc
+from components.dropdowns import manifold_colour_dropdown
+from components.radio_buttons import dataset_radio, ter_radio
+from components.plots import manifold_plot
+from data.manifold import MANIFOLD_METHODS
+from layouts.gene_dashboard_layout import create_control_section, create_plot_section, create_error_card
+
+def manifold_layout() -> html.Div:
+    """
+    Create the manifold page: the selected samples embedded in 2D or 3D from
+    their expression of the most variable genes
+    Returns:
+        Dash HTML Div containing the manifold layout
+    """
+    # Common styles
+    container_style = {"max-width": "1200px"}
+
+    # Embedding controls
+    embedding_controls = [
+        html.Label("Embedding", htmlFor="manifold-method-radio", className="fw-bold small"),
+        dbc.RadioItems(
+            id="manifold-method-radio",
+            options=[{"label": label, "value": value} for value, label in MANIFOLD_METHODS.items()],
+            value="pca",
+            className="mb-2 small"
+        ),
+
+        html.Label("Dimensions", htmlFor="manifold-dimensions-radio", className="fw-bold small mt-2"),
+        dbc.RadioItems(
+            id="manifold-dimensions-radio",
+            options=[{"label": "2D", "value": 2}, {"label": "3D", "value": 3}],
+            value=2,
+            inline=True,
+            className="mb-2 small"
+        ),
+        html.Hr(className="my-2"),
+
+        html.Label("Colour By", htmlFor="manifold-colour-dropdown", className="fw-bold small mt-2"),
+        manifold_colour_dropdown(),
+    ]
+
+    # Sample selection controls
+    sample_controls = [
+        html.Label("Select Datasets", htmlFor="mf-dataset-radio", className="fw-bold small"),
+        dataset_radio("mf-"),
+        html.Hr(className="my-2"),
+
+        html.Label("TER threshold", htmlFor="mf-ter-input", className="fw-bold small"),
+        ter_radio("mf-"),
+    ]
+
+    return html.Div([
+        dbc.Container([
+            html.H3("Sample Manifold", className="text-primary mb-3"),
+            html.P("Embed the selected samples from their log2(TPM+1) expression of the most variable genes, "
+                   "by principal components or a neighbour graph, and colour them by any sample attribute.",
+                   className="lead"),
+
+            create_error_card("manifold"),
+
+            dbc.Row([
+                dbc.Col([
+                    create_control_section("Embedding", embedding_controls),
+                    create_control_section("Samples", sample_controls),
+                ], md=3),
+                dbc.Col([
+                    create_plot_section(manifold_plot()),
+                    html.Div(id="manifold-progress", className="small text-muted mt-1"),
+                ], md=9),
+            ]),
+        ], style=container_style, className="mb-4")
+    ])
@@ -37,6 +37,8 @@ def create_navbar():
                         [
                             dbc.NavItem(dbc.NavLink("Home", href="/", active="exact")),
                             dbc.NavItem(dbc.NavLink("Gene Explorer", href="/gene-explorer", active="exact")),
+                            dbc.NavItem(dbc.NavLink("Differential Expression", href="/gene-diff", active="exact")),
+                            dbc.NavItem(dbc.NavLink("Manifold", href="/manifold", active="exact")),
                             dbc.NavItem(dbc.NavLink("Genome Browser", href="/genome-browser", active="exact"))
                         ],
                         className="ms-auto",
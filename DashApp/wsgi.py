@@ -3,11 +3,15 @@ import dash
 from dash import dcc, html
 
 from layouts import gene_dashboard_layout as gd
+from layouts.differential_expression_layout import differential_expression_layout
+from layouts.manifold_layout import manifold_layout
 from app import app
 
 server = app.server
 
 prerendered_gene_dashboard = gd.gene_dashboard_layout()
+prerendered_differential_expression = differential_expression_layout()
+prerendered_manifold = manifold_layout()
 
 index_page = html.Div([
     html.H1("Welcome to JBU's Data visualisation!"),
@@ -31,9 +35,9 @@ def display_page(pathname):
     if pathname == '/gene-vis':
         return prerendered_gene_dashboard
     if pathname == '/gene-diff':
-        return prerendered_gene_dashboard
+        return prerendered_differential_expression
     if pathname == '/manyfold':
-        return prerendered_gene_dashboard
+        return prerendered_manifold
     else:
         return index_page
 
@@ -6,6 +6,8 @@ PROD_DB=$2
 DATA_FOLDER=$3
 METADATA_FILE=$4
 LOG_FILE=$5
+# Optional: co-expression neighbours to precompute per gene (default none)
+NEIGHBOURS=${6:-0}
 
 # Delete temporary DB if already exists
 if [ -f "$TEMP_DB" ] ; then
@@ -17,11 +19,15 @@ sqlite3 $TEMP_DB < schema.sql > /dev/null
 
 # Populate DB
 # TODO In what circumstances are errors thrown?
-python3 data_upload.py $TEMP_DB $METADATA_FILE $DATA_FOLDER $LOG_FILE
+python3 data_upload.py $TEMP_DB $METADATA_FILE $DATA_FOLDER $LOG_FILE --neighbours $NEIGHBOURS
 success=$?
 
 # If success, move DB to prod
 if [ $success -eq 0 ]; 
 then 
     mv $TEMP_DB $PROD_DB
+    # Build the dashboard's expression matrix sidecar now rather than on the
+    # first request; the dashboard builds it itself if this step fails
+    (cd ../DashApp && DATABASE_PATH="$(realpath "$PROD_DB")" python3 -m data.expression_matrix) \
+        || echo "Expression matrix sidecar not built; the dashboard will build it on first use"
 fi
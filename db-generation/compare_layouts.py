@@ -0,0 +1,112 @@
+# Compares the integer-keyed WITHOUT ROWID GeneExpression layout against the
+# previous TEXT-keyed rowid layout, in file size and single-gene read latency.
+#
+# Usage: python3 compare_layouts.py UrotheliomeData.db [--genes 200]
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+LEGACY_SCHEMA = """
+CREATE TABLE Sample AS SELECT * FROM src.Sample;
+CREATE TABLE Gene (GeneName TEXT PRIMARY KEY);
+INSERT INTO Gene SELECT GeneName FROM src.Gene ORDER BY GeneName;
+CREATE TABLE GeneExpression (
+    SampleId TEXT,
+    GeneName TEXT,
+    TPM REAL NOT NULL,
+    PRIMARY KEY (SampleId, GeneName)
+);
+INSERT INTO GeneExpression
+    SELECT s.SampleId, g.GeneName, ge.TPM
+    FROM src.GeneExpression ge
+    JOIN src.Gene g ON g.GeneKey = ge.GeneKey
+    JOIN src.Sample s ON s.SampleKey = ge.SampleKey
+    ORDER BY s.SampleId, g.GeneName;
+CREATE INDEX IdxGeneExpressionGeneName ON GeneExpression(GeneName);
+CREATE INDEX IdxSampleDatasetName ON Sample(DatasetName);
+"""
+
+LEGACY_QUERY = """
+    SELECT ge.GeneName, ge.TPM, s.DatasetName, s.SampleId, s.TER
+    FROM GeneExpression ge
+    JOIN Sample s ON ge.SampleId = s.SampleId
+    WHERE ge.GeneName = ?
+"""
+
+KEYED_QUERY = """
+    SELECT g.GeneName, ge.TPM, s.DatasetName, s.SampleId, s.TER
+    FROM Gene g
+    JOIN GeneExpression ge ON ge.GeneKey = g.GeneKey
+    JOIN Sample s ON s.SampleKey = ge.SampleKey
+    WHERE g.GeneName = ?
+"""
+
+
+def build_legacy_copy(db_path, legacy_path):
+    """Rebuild the database's expression data in the old TEXT-keyed layout."""
+    conn = sqlite3.connect(legacy_path)
+    conn.execute("ATTACH DATABASE ? AS src", (db_path,))
+    conn.executescript(LEGACY_SCHEMA)
+    conn.commit()
+    conn.execute("DETACH DATABASE src")
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def drop_page_cache(path):
+    """Ask the OS to evict the file's cached pages so the next read is cold."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def time_lookups(path, query, genes, cold):
+    timings = []
+    for gene in genes:
+        if cold:
+            drop_page_cache(path)
+        start = time.perf_counter()
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        conn.execute(query, (gene,)).fetchall()
+        conn.close()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("db_path", type=str,
+                        help="path to a database built with schema.sql")
+    parser.add_argument("--genes", type=int, default=200,
+                        help="number of random genes to look up")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db_path)
+    all_genes = [row[0] for row in conn.execute("SELECT GeneName FROM Gene")]
+    conn.close()
+    genes = random.Random(0).sample(all_genes, min(args.genes, len(all_genes)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        build_legacy_copy(args.db_path, legacy_path)
+
+        layouts = [
+            ("TEXT keys, rowid", legacy_path, LEGACY_QUERY),
+            ("INTEGER keys, WITHOUT ROWID", args.db_path, KEYED_QUERY),
+        ]
+        print(f"{'layout':<30}{'size MiB':>10}{'cold ms':>10}{'warm ms':>10}")
+        for name, path, query in layouts:
+            size = os.path.getsize(path) / 2**20
+            cold = statistics.median(time_lookups(path, query, genes, cold=True))
+            warm = statistics.median(time_lookups(path, query, genes, cold=False))
+            print(f"{name:<30}{size:>10.1f}{cold:>10.2f}{warm:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
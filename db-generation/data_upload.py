@@ -5,6 +5,8 @@ import argparse
 import logging
 import os
 import sqlite3
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 
@@ -107,43 +109,302 @@ def merge_all_datasets(base_path):
 
     return all_tsv
 
-def chunked_melt_insert(df, id_vars, var_name, value_name, chunk_size_rows,
-                 chunk_size_cols, conn):
+def add_surrogate_key(df, name_column, key_column):
     """
-    Chunked melt and DB insert operation to save memory usage.
+    Adds an integer surrogate key to a table of unique names.
 
-    The wide table (genes on rows, samples in columns) is chunked in
-    both dimensions. Each chunk is pivoted to long to match the DB
-    table format, and then the long chunk is inserted into the DB.
+    Keys are assigned densely from 0 in sorted name order, so they double as
+    row/column positions in the dashboard's expression matrix.
 
-    This saves a considerable amount of memory over making a single long
-    table (chunked or not) and inserting that in 1 go (chunked or not).
+    Args:
+        - df (pd.DataFrame): Table containing the name column.
+        - name_column (str): Column holding the natural (text) key.
+        - key_column (str): Name of the new integer key column.
+
+    Returns:
+        A new pandas DataFrame sorted by name, with the key as first column.
+    """
+    df = df.sort_values(name_column).reset_index(drop=True)
+    df.insert(0, key_column, np.arange(len(df)))
+    return df
+
+
+def chunked_expression_insert(df, gene_keys, sample_keys, chunk_size_rows,
+                              conn):
+    """
+    Chunked pivot-to-long and DB insert of the expression data.
+
+    The wide table (genes on rows, samples in columns) is processed a block of
+    genes at a time. Each block is flattened with NumPy into
+    (GeneKey, SampleKey, TPM) rows already in primary key order, so inserts
+    into the clustered WITHOUT ROWID table only ever append.
 
     Args:
-        - df (pd.DataFrame): DataFrame to melt.
-        - id_vars (List[str]): As in pandas.melt.
-        - var_name (str): As in pandas.melt.
-        - value_name (str): As in pandas.melt.
-        - chunk_size_rows (int): Number of rows to pivot at a time.
-        - chunk_size_cols (int): Number of cols to pivot at a time.
+        - df (pd.DataFrame): Wide expression table, gene names in first column.
+        - gene_keys (pd.Series): GeneKey values indexed by GeneName.
+        - sample_keys (pd.Series): SampleKey values indexed by SampleId.
+        - chunk_size_rows (int): Number of genes to insert at a time.
         - conn (SQLite connection): SQLite connection handle.
 
     Returns:
-        A pd.DataFrame of the combined long datasets.
+        The number of rows inserted.
     """
-    for i in range(0, df.shape[0], chunk_size_rows):
-        end_row = min(df.shape[0], i+chunk_size_rows)
-        for j in range(1, df.shape[1], chunk_size_cols):
-            end_col = min(df.shape[1], j+chunk_size_cols)
-            chunked_df = df.iloc[i:end_row, np.r_[0, j:end_col]]
-            chunked_df_long = chunked_df.melt(
-                id_vars=id_vars,
-                var_name=var_name,
-                value_name=value_name
+    row_keys = gene_keys.reindex(df.iloc[:, 0]).to_numpy()
+    rows = np.flatnonzero(~np.isnan(row_keys))
+    rows = rows[np.argsort(row_keys[rows], kind="stable")]
+
+    col_keys = sample_keys.reindex(df.columns[1:]).to_numpy()
+    cols = np.flatnonzero(~np.isnan(col_keys))
+    cols = cols[np.argsort(col_keys[cols], kind="stable")]
+    col_keys = col_keys[cols].astype(np.int64)
+
+    inserted = 0
+    for i in range(0, len(rows), chunk_size_rows):
+        block = rows[i:i + chunk_size_rows]
+        values = df.iloc[block, 1 + cols].to_numpy(dtype=np.float64)
+        gene_pos, sample_pos = np.nonzero(~np.isnan(values))
+        conn.executemany(
+            "INSERT INTO GeneExpression (GeneKey, SampleKey, TPM) VALUES (?, ?, ?)",
+            zip(
+                row_keys[block][gene_pos].astype(np.int64).tolist(),
+                col_keys[sample_pos].tolist(),
+                values[gene_pos, sample_pos].tolist(),
             )
-            chunked_df_long.dropna(subset=["TPM"], inplace=True)
-            insert_into_db(chunked_df_long, "GeneExpression", conn,
-                           message=False)
+        )
+        inserted += len(gene_pos)
+    return inserted
+
+# Sample metadata columns summarised in GeneGroupStats
+GROUP_STATS_COLUMNS = [
+    "DatasetName",
+    "SubsetName",
+    "TissueName",
+    "SubstrateType",
+    "Gender",
+    "Stage",
+    "Status",
+    "NhuDifferentiation",
+]
+
+
+def summarise_block(values):
+    """
+    Summary statistics of each row of a block, ignoring missing values.
+
+    Args:
+        - values (np.ndarray): Genes x samples TPM block, NaN where missing.
+
+    Returns:
+        Tuple of (count, stats) where stats has one column per statistic:
+        mean, min, Q1, median, Q3, max, then the same for log2(TPM + 1).
+    """
+    count = np.count_nonzero(~np.isnan(values), axis=1)
+    stats = np.full((len(values), 12), np.nan)
+    present = count > 0
+    n = count[present]
+
+    # Sorting moves NaNs to the end of each row, so the quantiles (linear
+    # interpolation, as np.quantile) can be read off by position
+    ordered = np.sort(values[present], axis=1)
+    for offset, block in ((0, ordered), (6, np.log2(ordered + 1))):
+        stats[present, offset] = np.nansum(block, axis=1) / n
+        for column, q in enumerate([0, 0.25, 0.5, 0.75, 1], start=offset + 1):
+            position = q * (n - 1)
+            low = np.floor(position).astype(np.int64)
+            high = np.minimum(low + 1, n - 1)
+            low_values = np.take_along_axis(block, low[:, None], axis=1)[:, 0]
+            high_values = np.take_along_axis(block, high[:, None], axis=1)[:, 0]
+            stats[present, column] = low_values + (position - low) * (high_values - low_values)
+    return count, stats
+
+
+def chunked_group_stats_insert(df, gene_keys, metadata_df, chunk_size_rows,
+                               conn):
+    """
+    Chunked computation and DB insert of GeneGroupStats.
+
+    For a block of genes at a time, the samples of every (grouping column,
+    dataset, value) group are summarised with vectorised NumPy reductions, and
+    the rows are inserted in primary key order.
+
+    Args:
+        - df (pd.DataFrame): Wide expression table, gene names in first column.
+        - gene_keys (pd.Series): GeneKey values indexed by GeneName.
+        - metadata_df (pd.DataFrame): Sample table as inserted into the DB.
+        - chunk_size_rows (int): Number of genes to summarise at a time.
+        - conn (SQLite connection): SQLite connection handle.
+
+    Returns:
+        The number of rows inserted.
+    """
+    row_keys = gene_keys.reindex(df.iloc[:, 0]).to_numpy()
+    rows = np.flatnonzero(~np.isnan(row_keys))
+    rows = rows[np.argsort(row_keys[rows], kind="stable")]
+
+    # Expression columns of each group, in primary key order
+    samples = metadata_df.set_index("SampleId").reindex(df.columns[1:])
+    groups = []
+    for column in sorted(GROUP_STATS_COLUMNS):
+        labels = pd.DataFrame({
+            "DatasetName": samples["DatasetName"],
+            "GroupValue": samples[column].fillna("Unknown"),
+        }).dropna(subset=["DatasetName"])
+        for (dataset, value), members in sorted(labels.groupby(["DatasetName", "GroupValue"]).groups.items()):
+            groups.append((column, dataset, str(value), 1 + df.columns[1:].get_indexer(members)))
+
+    inserted = 0
+    for i in range(0, len(rows), chunk_size_rows):
+        block = rows[i:i + chunk_size_rows]
+        block_keys = row_keys[block].astype(np.int64).tolist()
+        records = []
+        for column, dataset, value, cols in groups:
+            count, stats = summarise_block(df.iloc[block, cols].to_numpy(dtype=np.float64))
+            for j in np.flatnonzero(count):
+                records.append((block_keys[j], column, dataset, value, int(count[j]), *stats[j].tolist()))
+        records.sort(key=lambda record: record[:4])
+        conn.executemany(
+            f"INSERT INTO GeneGroupStats VALUES ({', '.join('?' * 17)})", records
+        )
+        inserted += len(records)
+    return inserted
+
+# Correlation measures of GeneNeighbour, by the value each is computed on
+NEIGHBOUR_METHODS = ["pearson_log2", "spearman"]
+
+# Scope of the neighbours computed over every sample
+ALL_DATASETS_SCOPE = "*"
+
+# Query genes whose correlations a worker computes per task
+NEIGHBOUR_BLOCK_ROWS = 256
+
+# Fewest samples with a value for a gene to get neighbours
+NEIGHBOUR_MIN_SAMPLES = 3
+
+
+def standardise_rows(values, method):
+    """
+    Unit-length, centred rows whose dot products are correlations.
+
+    Values are log2(TPM + 1) for Pearson or average ranks for Spearman.
+    Missing values are set to the gene's mean, so they add nothing to its
+    correlations.
+
+    Args:
+        - values (np.ndarray): Genes x samples TPM block, NaN where missing.
+        - method (str): One of NEIGHBOUR_METHODS.
+
+    Returns:
+        Tuple of (float32 rows, boolean mask of genes with enough values and
+        a non-zero spread).
+    """
+    if method == "spearman":
+        values = pd.DataFrame(values).rank(axis=1).to_numpy(dtype=np.float32)
+    else:
+        values = np.log2(values + 1)
+    count = np.count_nonzero(~np.isnan(values), axis=1)
+    centred = values - np.nanmean(np.where(count[:, None] > 0, values, 0), axis=1)[:, None]
+    centred = np.nan_to_num(centred)
+    norm = np.sqrt(np.einsum("ij,ij->i", centred, centred))
+    usable = (count >= NEIGHBOUR_MIN_SAMPLES) & (norm > 0)
+    centred[usable] /= norm[usable, None]
+    centred[~usable] = 0
+    return centred, usable
+
+
+def top_neighbours_block(path, start, stop, k, unusable):
+    """
+    Top-k neighbours of rows start:stop of a standardised matrix.
+
+    Runs in a worker process; the matrix is memory-mapped from `path`, so
+    every worker shares one copy of it.
+
+    Args:
+        - path (str): .npy file holding rows from standardise_rows.
+        - start, stop (int): Rows to find neighbours for.
+        - k (int): Neighbours per row.
+        - unusable (np.ndarray): Rows that may not be neighbours.
+
+    Returns:
+        Tuple of (int32 neighbour rows, float32 correlations), each of shape
+        (stop - start, k), strongest first; correlations are -inf past the
+        usable rows of a scope with fewer than k + 1 of them.
+    """
+    matrix = np.load(path, mmap_mode="r")
+    scores = np.asarray(matrix[start:stop]) @ np.asarray(matrix).T
+    scores[:, unusable] = -np.inf
+    scores[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return (np.take_along_axis(best, order, axis=1).astype(np.int32),
+            np.take_along_axis(best_scores, order, axis=1).astype(np.float32))
+
+
+def neighbour_insert(df, gene_keys, metadata_df, k, workers, conn):
+    """
+    Computes and inserts the GeneNeighbour table.
+
+    For every dataset, and for all datasets together, the genes are
+    standardised (see standardise_rows) into a temporary memory-mapped file,
+    and a process pool multiplies blocks of rows against the whole matrix to
+    keep each gene's k most correlated genes.
+
+    Args:
+        - df (pd.DataFrame): Wide expression table, gene names in first column.
+        - gene_keys (pd.Series): GeneKey values indexed by GeneName.
+        - metadata_df (pd.DataFrame): Sample table as inserted into the DB.
+        - k (int): Neighbours kept per gene, scope and method.
+        - workers (int): Worker processes.
+        - conn (SQLite connection): SQLite connection handle.
+
+    Returns:
+        The number of rows inserted.
+    """
+    row_keys = gene_keys.reindex(df.iloc[:, 0]).to_numpy()
+    rows = np.flatnonzero(~np.isnan(row_keys))
+    rows = rows[np.argsort(row_keys[rows], kind="stable")]
+    row_keys = row_keys[rows].astype(np.int32)
+    k = min(k, len(rows) - 1)
+
+    datasets = metadata_df.set_index("SampleId")["DatasetName"].reindex(df.columns[1:])
+    scopes = [(dataset, np.flatnonzero((datasets == dataset).to_numpy()))
+              for dataset in sorted(datasets.dropna().unique())]
+    scopes.append((ALL_DATASETS_SCOPE, np.flatnonzero(datasets.notna().to_numpy())))
+
+    inserted = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool, tempfile.TemporaryDirectory() as scratch:
+        for scope, cols in scopes:
+            values = df.iloc[rows, 1 + cols].to_numpy(dtype=np.float32)
+            for method in NEIGHBOUR_METHODS:
+                standardised, usable = standardise_rows(values, method)
+                path = os.path.join(scratch, f"{method}.npy")
+                np.save(path, standardised)
+                del standardised
+                unusable = np.flatnonzero(~usable)
+
+                starts = range(0, len(rows), NEIGHBOUR_BLOCK_ROWS)
+                futures = [
+                    pool.submit(top_neighbours_block, path, start,
+                                min(start + NEIGHBOUR_BLOCK_ROWS, len(rows)), k, unusable)
+                    for start in starts
+                ]
+                records = []
+                for start, future in zip(starts, futures):
+                    neighbours, correlations = future.result()
+                    for j in range(len(neighbours)):
+                        # With fewer than k + 1 usable genes in a scope, the
+                        # top k includes unusable ones, scored -inf
+                        found = np.isfinite(correlations[j])
+                        if usable[start + j] and found.any():
+                            records.append((
+                                int(row_keys[start + j]), method, scope,
+                                row_keys[neighbours[j][found]].astype("<i4").tobytes(),
+                                correlations[j][found].astype("<f4").tobytes(),
+                            ))
+                conn.executemany("INSERT INTO GeneNeighbour VALUES (?, ?, ?, ?, ?)", records)
+                inserted += len(records)
+                logging.info(f"Computed {method} neighbours for {len(records)} genes in {scope}")
+    return inserted
 
 def main():
     parser = argparse.ArgumentParser()
@@ -155,6 +416,10 @@ def main():
                         help="path to the data folder")
     parser.add_argument("log_file", type=str,
                         help="path to the file to append logs to")
+    parser.add_argument("--neighbours", type=int, default=0,
+                        help="co-expression neighbours to precompute per gene (0 to skip)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="processes used to compute the neighbours")
     args = parser.parse_args()
 
     # Connect to the existing SQLite database
@@ -197,7 +462,12 @@ def main():
     # - Gene_Expression
 
     # Gene
-    create_dimension(all_data_df['genes'], 'Gene', 'GeneName', conn)
+    gene_df = add_surrogate_key(
+        prepare_dimension_table(all_data_df['genes'], 'GeneName'),
+        'GeneName',
+        'GeneKey'
+    )
+    insert_into_db(gene_df, 'Gene', conn)
 
     # NHU
     create_dimension(
@@ -283,6 +553,7 @@ def main():
     # Clean error codes and missingness
     metadata_df.replace({'?': None, 'NaN': None, '': None}, inplace=True)
     metadata_df = metadata_df.where(pd.notna(metadata_df), None)
+    metadata_df = add_surrogate_key(metadata_df, 'SampleId', 'SampleKey')
     # Insert into db
     insert_into_db(metadata_df, "Sample", conn)
 
@@ -293,22 +564,42 @@ def main():
     all_data_df = all_data_df[all_cols].rename(columns={'genes': 'GeneName'})
 
     # Insert into DB
-    chunked_melt_insert(
+    row_count = chunked_expression_insert(
+        all_data_df,
+        gene_keys=gene_df.set_index('GeneName')['GeneKey'],
+        sample_keys=metadata_df.set_index('SampleId')['SampleKey'],
+        chunk_size_rows=500,
+        conn=conn
+    )
+    logging.info(f"Successfully populated GeneExpression with {row_count} rows")
+
+    # Materialised group statistics for the overview plots
+    row_count = chunked_group_stats_insert(
         all_data_df,
-        id_vars=['GeneName'],
-        var_name='SampleId',
-        value_name='TPM',
-        chunk_size_rows=5000,
-        chunk_size_cols=100,
+        gene_keys=gene_df.set_index('GeneName')['GeneKey'],
+        metadata_df=metadata_df,
+        chunk_size_rows=500,
         conn=conn
     )
-    logging.info(f"Successfully populated GeneExpression with {all_data_df.shape[0]} rows")
+    logging.info(f"Successfully populated GeneGroupStats with {row_count} rows")
+
+    # Optional precomputed co-expression neighbours
+    if args.neighbours > 0:
+        row_count = neighbour_insert(
+            all_data_df,
+            gene_keys=gene_df.set_index('GeneName')['GeneKey'],
+            metadata_df=metadata_df,
+            k=args.neighbours,
+            workers=args.workers,
+            conn=conn
+        )
+        logging.info(f"Successfully populated GeneNeighbour with {row_count} rows")
 
     # Create indexes for faster querying
-    cursor.execute("CREATE INDEX IF NOT EXISTS IdxGeneExpressionGeneName ON GeneExpression(GeneName);")
-    logging.info("Created index for GeneName")
+    # GeneExpression needs none: it is clustered on (GeneKey, SampleKey)
     cursor.execute("CREATE INDEX IF NOT EXISTS IdxSampleDatasetName ON Sample(DatasetName);")
-    logging.info("Created index for Sample")
+    cursor.execute("CREATE INDEX IF NOT EXISTS IdxSampleTER ON Sample(TER);")
+    logging.info("Created indexes for Sample")
 
     logging.info("Database built successfully")
 
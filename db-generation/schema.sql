@@ -31,7 +31,8 @@ CREATE TABLE VitalStatus (
 );
 
 CREATE TABLE Sample (
-    SampleId TEXT PRIMARY KEY,
+    SampleKey INTEGER PRIMARY KEY,
+    SampleId TEXT NOT NULL UNIQUE,
     SubsetName TEXT,
     DatasetName TEXT,
     TissueName TEXT,
@@ -53,14 +54,58 @@ CREATE TABLE Sample (
 );
 
 CREATE TABLE Gene (
-    GeneName TEXT PRIMARY KEY
+    GeneKey INTEGER PRIMARY KEY,
+    GeneName TEXT NOT NULL UNIQUE
 );
 
-CREATE TABLE GeneExpression (   
-    SampleId TEXT,
-    GeneName TEXT,
+-- Integer keys keep each row to a few bytes, and WITHOUT ROWID clusters the
+-- table on (GeneKey, SampleKey) so a gene's values are stored contiguously
+CREATE TABLE GeneExpression (
+    GeneKey INTEGER NOT NULL,
+    SampleKey INTEGER NOT NULL,
     TPM REAL NOT NULL,
-    PRIMARY KEY (SampleId, GeneName),
-    FOREIGN KEY (SampleId) REFERENCES Sample(SampleId),
-    FOREIGN KEY (GeneName) REFERENCES Gene(GeneName)
-);
+    PRIMARY KEY (GeneKey, SampleKey),
+    FOREIGN KEY (GeneKey) REFERENCES Gene(GeneKey),
+    FOREIGN KEY (SampleKey) REFERENCES Sample(SampleKey)
+) WITHOUT ROWID;
+
+-- TPM summaries per gene, dataset and value of a sample metadata column
+-- (GroupValue 'Unknown' where the metadata is missing), with Log2* holding
+-- the same statistics of log2(TPM + 1). Clustered by gene so the overview
+-- plot for one gene and column is a single range scan.
+CREATE TABLE GeneGroupStats (
+    GeneKey INTEGER NOT NULL,
+    GroupColumn TEXT NOT NULL,
+    DatasetName TEXT NOT NULL,
+    GroupValue TEXT NOT NULL,
+    SampleCount INTEGER NOT NULL,
+    Mean REAL NOT NULL,
+    Min REAL NOT NULL,
+    Q1 REAL NOT NULL,
+    Median REAL NOT NULL,
+    Q3 REAL NOT NULL,
+    Max REAL NOT NULL,
+    Log2Mean REAL NOT NULL,
+    Log2Min REAL NOT NULL,
+    Log2Q1 REAL NOT NULL,
+    Log2Median REAL NOT NULL,
+    Log2Q3 REAL NOT NULL,
+    Log2Max REAL NOT NULL,
+    PRIMARY KEY (GeneKey, GroupColumn, DatasetName, GroupValue),
+    FOREIGN KEY (GeneKey) REFERENCES Gene(GeneKey)
+) WITHOUT ROWID;
+
+-- Each gene's most correlated genes per correlation measure ('pearson_log2'
+-- or 'spearman') and scope (a DatasetName, or '*' for all datasets), strongest
+-- first: NeighbourKeys holds their GeneKeys as little-endian int32 and
+-- Correlations the matching float32 values. Only filled when data_upload.py
+-- is run with --neighbours.
+CREATE TABLE GeneNeighbour (
+    GeneKey INTEGER NOT NULL,
+    Method TEXT NOT NULL,
+    Scope TEXT NOT NULL,
+    NeighbourKeys BLOB NOT NULL,
+    Correlations BLOB NOT NULL,
+    PRIMARY KEY (GeneKey, Method, Scope),
+    FOREIGN KEY (GeneKey) REFERENCES Gene(GeneKey)
+) WITHOUT ROWID;